@@ -15,6 +15,7 @@ from noshow.database.models import (
     ApiPatient,
     ApiPrediction,
     ApiRequest,
+    ApiRequestStage,
 )
 from noshow.preprocessing.utils import add_working_days
 
@@ -281,6 +282,38 @@ def monitoring_page():
         )
         st.altair_chart(runtime_chart)
 
+        st.write("### Runtime per stap van de API")
+        stage_data = session.execute(
+            select(
+                ApiRequest.timestamp,
+                ApiRequestStage.stage,
+                ApiRequestStage.duration,
+                ApiRequestStage.rows,
+            )
+            .join(ApiRequest, ApiRequestStage.request_id == ApiRequest.id)
+            .where(
+                (cast(ApiRequest.timestamp, Date) >= date_input[0])
+                & (cast(ApiRequest.timestamp, Date) <= date_input[1])
+            )
+        ).all()
+        stage_df = pd.DataFrame(
+            stage_data, columns=["timestamp", "stage", "duration", "rows"]
+        )
+        if stage_df.empty:
+            st.info("Geen runtime per stap beschikbaar in deze periode")
+        else:
+            stage_chart = (
+                alt.Chart(stage_df)
+                .mark_bar()
+                .encode(
+                    x="timestamp:T",
+                    y=alt.Y("sum(duration):Q", title="runtime (s)"),
+                    color="stage:N",
+                    tooltip=["timestamp:T", "stage:N", "duration:Q", "rows:Q"],
+                )
+            )
+            st.altair_chart(stage_chart)
+
         st.write("### response codes per dag")
         response_chart = (
             alt.Chart(monitoring_df)
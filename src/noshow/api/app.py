@@ -1,36 +1,75 @@
 import json
 import logging
 import os
+import time
 import tomllib
+from contextlib import asynccontextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Optional
 
+import pandas as pd
+import pyarrow as pa
 from dotenv import load_dotenv
-from fastapi import Depends, FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
 from fastapi.security.api_key import APIKeyHeader
+from sqlalchemy import event
 from sqlalchemy.orm import Session, sessionmaker
 
+from noshow.api import metrics
 from noshow.api.app_helpers import (
+    APPOINTMENT_HISTORY_DATETIMES,
     create_treatment_groups,
     fix_outdated_appointments,
+    latest_history_watermark,
+    load_appointment_history,
     load_model,
+    load_patient_state,
+    patients_without_history,
     remove_sensitive_info,
+    store_appointment_history,
+    store_patient_state,
     store_predictions,
+    store_request_stages,
 )
+from noshow.api.executor import (
+    PredictionExecutor,
+    PredictionTimeoutError,
+    check_deadline,
+)
+from noshow.api.jobs import JobStore, PredictionJob
 from noshow.api.pydantic_models import Appointment
-from noshow.config import CLINIC_CONFIG, KEEP_SENSITIVE_DATA, setup_root_logger
+from noshow.api.resources import FileResource, ModelRegistry
+from noshow.api.timing import StageTimer
+from noshow.config import (
+    API_CONFIG,
+    APPOINTMENTS_LAST_DAYS,
+    CLINIC_CONFIG,
+    KEEP_SENSITIVE_DATA,
+    MINUTES_EARLY_CUTOFF,
+    setup_root_logger,
+)
 from noshow.database.connection import get_engine
 from noshow.database.models import (
     ApiRequest,
     Base,
 )
-from noshow.model.predict import create_prediction
+from noshow.features.patient_state import (
+    advance_patient_state,
+    calc_patient_state,
+    history_watermark,
+    inconsistent_patients,
+    stale_patients,
+)
+from noshow.model.predict import create_prediction_features, predict_featuretable
 from noshow.preprocessing.load_data import (
+    load_appointment_arrow,
     load_appointment_pydantic,
+    load_postal_code_index,
     process_appointments,
-    process_postal_codes,
+    read_arrow_payload,
 )
+from noshow.preprocessing.schema import apply_appointment_schema
 from noshow.preprocessing.utils import add_working_days
 
 logger = logging.getLogger(__name__)
@@ -38,14 +77,64 @@ setup_root_logger()
 
 load_dotenv()
 
-app = FastAPI()
+PROJECT_PATH = Path(__file__).parents[3]
+
+postal_codes = FileResource(
+    "postal_codes", PROJECT_PATH / "data" / "raw" / "NL.txt", load_postal_code_index
+)
+model_registry = ModelRegistry(
+    "model", PROJECT_PATH / "output" / "models" / "no_show_model_cv.pickle", load_model
+)
+prediction_executor = PredictionExecutor(
+    max_workers=API_CONFIG.max_concurrent_predictions,
+    max_queued=API_CONFIG.max_queued_predictions,
+    timeout=API_CONFIG.prediction_timeout,
+)
+job_store = JobStore()
+metrics.registry.register(
+    metrics.Gauge(
+        "noshow_prediction_requests_pending",
+        "Number of prediction requests that are running or waiting for a worker.",
+        lambda: prediction_executor.pending,
+    )
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Load the process-lifetime resources when the API starts."""
+    for resource in (postal_codes, model_registry):
+        try:
+            resource.load()
+        except Exception:
+            logger.exception(f"{resource.name} could not be loaded at startup")
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
+
 
-with (Path(__file__).parents[3] / "pyproject.toml").open("rb") as f:
+@app.middleware("http")
+async def track_request(request: Request, call_next):
+    """Record when a request was received and the latency of the request."""
+    request.state.received_at = time.perf_counter()
+    response = await call_next(request)
+    metrics.http_request_duration.observe(
+        time.perf_counter() - request.state.received_at,
+        path=metrics.route_path(request.scope),
+        method=request.method,
+        status=str(response.status_code),
+    )
+    return response
+
+
+with (PROJECT_PATH / "pyproject.toml").open("rb") as f:
     config = tomllib.load(f)
 
 API_VERSION = config["project"]["version"]
 
 engine = get_engine()
+event.listen(engine, "before_cursor_execute", metrics.count_db_roundtrip)
 Base.metadata.create_all(engine)
 SessionLocal = sessionmaker(bind=engine)
 
@@ -60,9 +149,9 @@ def get_bins():
     dict
         The fixed prediction score bins loaded from JSON.
     """
-    with (
-        Path(__file__).parents[3] / "data" / "processed" / "fixed_pred_score_bin.json"
-    ).open("r") as f:
+    with (PROJECT_PATH / "data" / "processed" / "fixed_pred_score_bin.json").open(
+        "r"
+    ) as f:
         fixed_bins = json.load(f)
     return fixed_bins
 
@@ -84,16 +173,378 @@ def get_db():
         db.close()
 
 
+def run_in_worker_session(pipeline: Callable[[Session], int]) -> int:
+    """Run a pipeline in the worker pool with its own database session
+
+    The session of the request is closed by `get_db` when the request times out,
+    while the worker thread keeps running until its next deadline check. Changes
+    that are not committed are rolled back when the pipeline fails, e.g. because
+    the deadline passed.
+
+    Parameters
+    ----------
+    pipeline : Callable[[Session], int]
+        The pipeline, is called with the session of the worker
+
+    Returns
+    -------
+    int
+        The result of the pipeline
+    """
+    with SessionLocal() as db:
+        try:
+            return pipeline(db)
+        except Exception:
+            db.rollback()
+            raise
+
+
+def check_api_key(api_key: str | None) -> None:
+    """Raise a 403 error when the API key is not valid."""
+    if api_key != os.environ["X_API_KEY"]:
+        logger.error("403: Unauthorized, Api Key not valid")
+        raise HTTPException(403, "Unauthorized, Api Key not valid")
+
+
+def merge_appointment_history(
+    db: Session,
+    appointments_df: pd.DataFrame,
+    start_date: str,
+    since: Optional[str] = None,
+) -> pd.DataFrame:
+    """Merge a delta payload with the stored appointment history.
+
+    A delta payload contains the appointments that were created or changed since
+    the watermark `since`, and all appointments from `start_date` on. The stored
+    appointments of the same patients before `start_date` are added, appointments
+    in the payload replace the stored version. Every patient in the payload should
+    have a stored history, otherwise the full history has to be sent.
+
+    Parameters
+    ----------
+    db : Session
+        Database session
+    appointments_df : pd.DataFrame
+        The loaded appointments of the payload
+    start_date : str
+        Start date of predictions in the format YYYY-MM-DD
+    since : Optional[str], optional
+        The watermark of the previous request, by default None, which means the
+        payload contains the full history
+
+    Returns
+    -------
+    pd.DataFrame
+        The appointments of the payload with their stored history
+    """
+    if since is None:
+        return appointments_df
+    if not API_CONFIG.delta_payloads:
+        logger.error("400: Delta payloads are disabled")
+        raise HTTPException(400, "Delta payloads are disabled")
+
+    try:
+        since_dt = datetime.fromisoformat(since)
+    except ValueError as e:
+        logger.error(f"400: Invalid watermark {since}")
+        raise HTTPException(400, f"Invalid watermark {since}") from e
+    watermark = latest_history_watermark(db)
+    if watermark is None or since_dt != watermark:
+        logger.error(f"409: Watermark {since} does not match {watermark}")
+        raise HTTPException(
+            409, "Watermark does not match the stored history, send the full history"
+        )
+
+    pseudo_ids = appointments_df["pseudo_id"].unique()
+    missing = patients_without_history(db, pseudo_ids)
+    if missing:
+        logger.error(f"409: No stored history for {len(missing)} patients")
+        raise HTTPException(
+            409, f"No stored history for {len(missing)} patients, send the full history"
+        )
+
+    history = load_appointment_history(db, pseudo_ids, start_date)
+    history = history.loc[~history["APP_ID"].isin(appointments_df["APP_ID"])]
+    # Use the same timezone as the payload, so the columns keep their dtype
+    tz = appointments_df["start"].dt.tz
+    for column in APPOINTMENT_HISTORY_DATETIMES:
+        history[column] = history[column].dt.tz_convert(tz)
+    logger.info(f"Merged {len(appointments_df)} appointments with {len(history)}")
+    return apply_appointment_schema(
+        pd.concat([history, appointments_df], ignore_index=True)
+    )
+
+
+def get_patient_state(
+    db: Session,
+    appointments_df: pd.DataFrame,
+    start_date: str,
+    history_start: Optional[str] = None,
+) -> Optional[pd.DataFrame]:
+    """Return the state of the patients to calculate the history features with.
+
+    When the payload contains the full history (`history_start` is None), the state
+    is calculated from the payload and the stored state is checked against it.
+    Otherwise the stored state is advanced with the appointments in the payload,
+    which is only possible when the stored state of every patient starts within
+    the payload.
+
+    Parameters
+    ----------
+    db : Session
+        Database session
+    appointments_df : pd.DataFrame
+        The processed appointments
+    start_date : str
+        Start date of predictions in the format YYYY-MM-DD
+    history_start : Optional[str], optional
+        The payload contains all appointments from this date on, by default None
+
+    Returns
+    -------
+    Optional[pd.DataFrame]
+        The state of the patients, or None when incremental features are disabled
+    """
+    if not API_CONFIG.incremental_features:
+        if history_start is not None:
+            logger.error("400: Incremental features are disabled")
+            raise HTTPException(400, "Incremental features are disabled")
+        return None
+
+    tz = appointments_df.index.get_level_values("start").tz
+    watermark = history_watermark(start_date, APPOINTMENTS_LAST_DAYS, tz=tz)
+    pseudo_ids = appointments_df.index.get_level_values("pseudo_id").unique()
+    stored_state = load_patient_state(db, pseudo_ids, tz)
+
+    if history_start is None:
+        inconsistent = inconsistent_patients(
+            stored_state, appointments_df, watermark, MINUTES_EARLY_CUTOFF
+        )
+        if len(inconsistent) > 0:
+            logger.warning(
+                f"Stored state of {len(inconsistent)} patients differs from the "
+                "full history, the state is replaced"
+            )
+        return calc_patient_state(appointments_df, watermark, MINUTES_EARLY_CUTOFF)
+
+    history_start_ts = pd.Timestamp(history_start, tz=tz)
+    if history_start_ts > watermark:
+        logger.error(f"400: history_start should be on or before {watermark}")
+        raise HTTPException(400, f"history_start should be on or before {watermark}")
+    n_stale = len(pseudo_ids.difference(stored_state.index)) + len(
+        stale_patients(stored_state, history_start_ts, watermark)
+    )
+    if n_stale > 0:
+        logger.error(f"409: No usable state for {n_stale} patients")
+        raise HTTPException(
+            409, f"No usable state for {n_stale} patients, send the full history"
+        )
+    return advance_patient_state(
+        stored_state, appointments_df, watermark, MINUTES_EARLY_CUTOFF
+    )
+
+
+def run_prediction_pipeline(
+    appointments_df: pd.DataFrame,
+    start_date: str,
+    db: Session,
+    deadline: Optional[float] = None,
+    timer: Optional[StageTimer] = None,
+    apirequest: Optional[ApiRequest] = None,
+    history_start: Optional[str] = None,
+    since: Optional[str] = None,
+) -> int:
+    """Create, store and deactivate predictions for the appointments.
+
+    This is the blocking part of the predict endpoints and runs in the worker pool
+    of the `PredictionExecutor`.
+
+    Parameters
+    ----------
+    appointments_df : pd.DataFrame
+        The loaded appointments, see `load_appointment_pydantic`
+    start_date : str
+        Start date of predictions in the format YYYY-MM-DD
+    db : Session
+        Database session
+    deadline : Optional[float], optional
+        Deadline of the request as `time.monotonic` timestamp, by default None
+    timer : Optional[StageTimer], optional
+        Keeps track of the stages of the pipeline, by default None
+    apirequest : Optional[ApiRequest], optional
+        ApiRequest to store the result in, by default a new ApiRequest is created
+    history_start : Optional[str], optional
+        The payload only contains the appointments from this date on, the earlier
+        history comes from the stored state of the patients, by default None
+    since : Optional[str], optional
+        Watermark of the previous request, if given the payload is a delta that is
+        merged with the stored appointment history, by default None
+
+    Returns
+    -------
+    int
+        Number of predictions stored in the database
+    """
+    start_time = datetime.now()
+    timer = timer or StageTimer()
+
+    payload_df = appointments_df
+    with timer.stage("process_appointments") as stage:
+        appointments_df = merge_appointment_history(
+            db, appointments_df, start_date, since
+        )
+        appointments_df = process_appointments(
+            appointments_df, CLINIC_CONFIG, start_date
+        )
+        stage.rows = len(appointments_df)
+
+    if appointments_df.empty:
+        logger.error("400: No appointments for the start date and filters")
+        raise HTTPException(
+            status_code=400, detail="No appointments for the start date and filters"
+        )
+
+    try:
+        all_postalcodes = postal_codes.get()
+        registered_model = model_registry.get()
+    except Exception as e:
+        logger.error("503: Postal codes or model are not available")
+        raise HTTPException(503, "Postal codes or model are not available") from e
+
+    check_deadline(deadline, "create_features")
+    with timer.stage("create_features") as stage:
+        patient_state = get_patient_state(
+            db, appointments_df, start_date, history_start
+        )
+        featuretable = create_prediction_features(
+            appointments_df,
+            all_postalcodes,
+            prediction_start_date=start_date,
+            patient_state=patient_state,
+        )
+        stage.rows = len(featuretable)
+
+    check_deadline(deadline, "predict_proba")
+    with timer.stage("predict_proba") as stage:
+        prediction_df = predict_featuretable(
+            registered_model.model,
+            featuretable,
+            appointments_df,
+            add_sensitive_info=True,
+        )
+
+        prediction_df = prediction_df.sort_values(
+            "prediction", ascending=False
+        ).reset_index()
+        stage.rows = len(prediction_df)
+
+    check_deadline(deadline, "create_treatment_groups")
+    with timer.stage("create_treatment_groups") as stage:
+        rct_agendas = [
+            clinic for clinic, config in CLINIC_CONFIG.items() if config.include_rct
+        ]
+        if rct_agendas is None or len(rct_agendas) == 0:
+            logger.info("No RCT agendas, defaulting to treatment group 2")
+            prediction_df["treatment_group"] = 2
+        else:
+            prediction_df = create_treatment_groups(
+                prediction_df, db, get_bins(), rct_agendas
+            )
+        stage.rows = len(prediction_df)
+
+    # The database is changed from here on, but nothing is committed before the
+    # deadline is checked again at the store stage
+    check_deadline(deadline, "remove_sensitive_info")
+    with timer.stage("remove_sensitive_info") as stage:
+        stage.rows = remove_sensitive_info(
+            db, start_date, lookback_days=KEEP_SENSITIVE_DATA
+        )
+
+    if apirequest is None:
+        # The runtime is updated when all stages are finished
+        apirequest = ApiRequest(
+            timestamp=start_time,
+            api_version=API_VERSION,
+            response_code=200,
+            response_message="success",
+            endpoint="predict",
+            runtime=timer.total,
+        )
+    apirequest.model_version = registered_model.version
+    db.add(apirequest)
+
+    # The changes are only committed when the predictions are stored
+    check_deadline(deadline, "store")
+    with timer.stage("store") as stage:
+        if patient_state is not None:
+            store_patient_state(db, patient_state)
+        if API_CONFIG.delta_payloads:
+            store_appointment_history(db, payload_df, replace=since is None)
+            apirequest.history_watermark = start_time
+        internal_pred_ids = store_predictions(prediction_df, db, apirequest)
+        stage.rows = len(internal_pred_ids)
+
+    with timer.stage("deactivate") as stage:
+        stage.rows = fix_outdated_appointments(db, internal_pred_ids, start_date)
+
+    # The runtime of the request is the sum of its stages
+    apirequest.runtime = timer.total
+    store_request_stages(db, apirequest, timer)
+    metrics.observe_stages(timer)
+
+    return len(prediction_df)
+
+
+async def get_stage_timer(request: Request) -> StageTimer:
+    """Return a timer for the stages of a prediction request.
+
+    FastAPI resolves the dependencies after the body has been read and parsed,
+    but before the appointments are validated, so the time since the request was
+    received is recorded as the decode stage.
+    """
+    timer = StageTimer()
+    received_at = getattr(request.state, "received_at", None)
+    if received_at is not None:
+        timer.add("decode", timer.created_at - received_at)
+    return timer
+
+
+def record_validation(timer: StageTimer, n_appointments: int) -> None:
+    """Record the validation of the appointments by FastAPI in the timer.
+
+    Is called at the start of the endpoint, the conversion of the appointments
+    to a DataFrame is added to the validate stage when the pipeline runs.
+    """
+    timer.add("validate", time.perf_counter() - timer.created_at, n_appointments)
+    if "decode" in timer.records:
+        timer.records["decode"].rows = n_appointments
+
+
+def get_start_date(start_date: Optional[str]) -> str:
+    """Return the start date, or the date in 3 working days if it is not given."""
+    if start_date is None:
+        start_date_dt = add_working_days(datetime.today(), 3)
+        start_date = start_date_dt.strftime(r"%Y-%m-%d")
+        logger.warning(f"No start date provided, using {start_date}")
+    return start_date
+
+
 @app.post("/predict")
 async def predict(
     appointments: list[Appointment],
     start_date: Optional[str] = None,
     db: Session = Depends(get_db),
     api_key: str = Depends(api_key_header),
+    timer: StageTimer = Depends(get_stage_timer),
+    history_start: Optional[str] = None,
+    since: Optional[str] = None,
 ) -> dict:
     """
     Predict the probability of a patient having a no-show.
 
+    The prediction pipeline runs in a bounded worker pool, so the API stays
+    responsive while a batch is scored.
+
     Parameters
     ----------
     appointments : list[Appointment]
@@ -101,84 +552,327 @@ async def predict(
     start_date: Optional[str]
         Start date of predictions, predictions will be made from that date,
         by default the date in 3 weekdays (i.e. excluding the weekend)
+    history_start: Optional[str]
+        Only when incremental features are enabled: the appointments contain the
+        full history from this date on, the history before this date comes from
+        the stored state of the patients. By default the appointments contain the
+        full history.
+    since: Optional[str]
+        Only when delta payloads are enabled: the watermark of the previous
+        request. The appointments only contain the appointments that were created
+        or changed since then, and all appointments from the start date on. By
+        default the appointments contain the full history.
 
     Returns
     -------
     dict[str, Any]
-       A dictionary containing a message with the number of predictions stored
+       A dictionary containing a message with the number of predictions stored,
+       and the watermark for the next delta payload when delta payloads are
+       enabled
     """
-    if api_key != os.environ["X_API_KEY"]:
-        logger.error("403: Unauthorized, Api Key not valid")
-        raise HTTPException(403, "Unauthorized, Api Key not valid")
-
-    if start_date is None:
-        start_date_dt = add_working_days(datetime.today(), 3)
-        start_date = start_date_dt.strftime(r"%Y-%m-%d")
-        logger.warning(f"No start date provided, using {start_date}")
-
-    project_path = Path(__file__).parents[3]
-    start_time = datetime.now()
+    record_validation(timer, len(appointments))
+    check_api_key(api_key)
+    start_date = get_start_date(start_date)
 
     if len(appointments) == 0:
         logger.error("400: Input cannot be empty.")
         raise HTTPException(status_code=400, detail="Input cannot be empty.")
 
-    appointments_df = load_appointment_pydantic(appointments)
-    appointments_df = process_appointments(appointments_df, CLINIC_CONFIG, start_date)
-    all_postalcodes = process_postal_codes(project_path / "data" / "raw" / "NL.txt")
-
-    if appointments_df.empty:
-        logger.error("400: No appointments for the start date and filters")
-        raise HTTPException(
-            status_code=400, detail="No appointments for the start date and filters"
+    def pipeline(deadline: Optional[float]) -> int:
+        with timer.stage("validate") as stage:
+            appointments_df = load_appointment_pydantic(appointments)
+            stage.rows = len(appointments_df)
+        return run_in_worker_session(
+            lambda worker_db: run_prediction_pipeline(
+                appointments_df,
+                start_date,
+                worker_db,
+                deadline,
+                timer,
+                history_start=history_start,
+                since=since,
+            )
         )
 
-    model = load_model()
-    prediction_df = create_prediction(
-        model,
-        appointments_df,
-        all_postalcodes,
-        prediction_start_date=start_date,
-        add_sensitive_info=True,
-    )
+    n_predictions = await prediction_executor.run(pipeline)
 
-    prediction_df = prediction_df.sort_values(
-        "prediction", ascending=False
-    ).reset_index()
+    logger.info("Predict endpoint finished successfully.")
+    response = {"message": f"{n_predictions} predictions created and stored in db."}
+    if API_CONFIG.delta_payloads:
+        response["watermark"] = latest_history_watermark(db).isoformat()
+    return response
 
-    rct_agendas = [
-        clinic for clinic, config in CLINIC_CONFIG.items() if config.include_rct
-    ]
-    if rct_agendas is None or len(rct_agendas) == 0:
-        logger.info("No RCT agendas, defaulting to treatment group 2")
-        prediction_df["treatment_group"] = 2
-    else:
-        prediction_df = create_treatment_groups(
-            prediction_df, db, get_bins(), rct_agendas
+
+@app.post("/predict/arrow")
+async def predict_arrow(
+    request: Request,
+    start_date: Optional[str] = None,
+    api_key: str = Depends(api_key_header),
+) -> dict:
+    """
+    Predict the probability of a patient having a no-show from a columnar payload.
+
+    Same as the predict endpoint, but the body is an Arrow IPC stream or a Parquet
+    file with a column for every field of Appointment. The columns are validated
+    at once instead of per appointment, which is much faster for large payloads.
+
+    Parameters
+    ----------
+    request : Request
+        The request, with the Arrow IPC stream or Parquet file as body
+    start_date: Optional[str]
+        Start date of predictions, predictions will be made from that date,
+        by default the date in 3 weekdays (i.e. excluding the weekend)
+
+    Returns
+    -------
+    dict[str, Any]
+       A dictionary containing a message with the number of predictions stored
+    """
+    check_api_key(api_key)
+    start_date = get_start_date(start_date)
+
+    payload = await request.body()
+    if len(payload) == 0:
+        logger.error("400: Input cannot be empty.")
+        raise HTTPException(status_code=400, detail="Input cannot be empty.")
+
+    def pipeline(deadline: Optional[float]) -> int:
+        timer = StageTimer()
+        try:
+            with timer.stage("decode") as stage:
+                table = read_arrow_payload(payload)
+                stage.rows = table.num_rows
+            with timer.stage("validate") as stage:
+                appointments_df = load_appointment_arrow(table)
+                stage.rows = len(appointments_df)
+        except (ValueError, pa.ArrowException) as e:
+            logger.error(f"422: Invalid payload: {e}")
+            raise HTTPException(422, f"Invalid payload: {e}") from e
+        if appointments_df.empty:
+            logger.error("400: Input cannot be empty.")
+            raise HTTPException(status_code=400, detail="Input cannot be empty.")
+        return run_in_worker_session(
+            lambda worker_db: run_prediction_pipeline(
+                appointments_df, start_date, worker_db, deadline, timer
+            )
         )
 
-    remove_sensitive_info(db, start_date, lookback_days=KEEP_SENSITIVE_DATA)
+    n_predictions = await prediction_executor.run(pipeline)
+
+    logger.info("Predict endpoint finished successfully.")
+    return {"message": f"{n_predictions} predictions created and stored in db."}
+
+
+def run_prediction_job(
+    job: PredictionJob, appointments: list[Appointment], deadline: Optional[float]
+) -> int:
+    """Run the prediction pipeline of a job and store the result in the ApiRequest.
+
+    Runs in the worker pool with its own database session, since the session of
+    the request is closed as soon as the job is submitted.
+
+    Parameters
+    ----------
+    job : PredictionJob
+        The job, its status is updated while the pipeline runs
+    appointments : list[Appointment]
+        The appointments of the job
+    deadline : Optional[float]
+        Deadline of the job as `time.monotonic` timestamp
+
+    Returns
+    -------
+    int
+        Number of predictions stored in the database
+    """
+    job.status = "running"
+    with SessionLocal() as db:
+        apirequest = db.get(ApiRequest, job.id)
+        try:
+            with job.timer.stage("validate") as stage:
+                appointments_df = load_appointment_pydantic(appointments)
+                stage.rows = len(appointments_df)
+            job.n_predictions = run_prediction_pipeline(
+                appointments_df, job.start_date, db, deadline, job.timer, apirequest
+            )
+        except Exception as e:
+            db.rollback()
+            job.status = "failed"
+            job.error = e.detail if isinstance(e, HTTPException) else str(e)
+            apirequest = db.get(ApiRequest, job.id)
+            apirequest.response_code = _error_status_code(e)
+            apirequest.response_message = f"failed: {job.error}"
+            logger.exception(f"Prediction job {job.id} failed")
+        else:
+            job.status = "finished"
+            apirequest.response_code = 200
+            apirequest.response_message = (
+                f"{job.n_predictions} predictions created and stored in db."
+            )
+        finally:
+            job.finished_at = datetime.now()
+            apirequest.runtime = job.timer.total
+            db.commit()
+    return job.n_predictions or 0
+
+
+def _error_status_code(error: Exception) -> int:
+    if isinstance(error, HTTPException):
+        return error.status_code
+    if isinstance(error, PredictionTimeoutError):
+        return 504
+    return 500
+
+
+@app.post("/predict/jobs", status_code=202)
+async def submit_prediction_job(
+    appointments: list[Appointment],
+    start_date: Optional[str] = None,
+    db: Session = Depends(get_db),
+    api_key: str = Depends(api_key_header),
+    timer: StageTimer = Depends(get_stage_timer),
+) -> dict:
+    """Submit a prediction job and return its id without waiting for the result.
+
+    The job runs the same pipeline as the predict endpoint, its progress can be
+    requested with `GET /predict/jobs/{job_id}`.
+
+    Parameters
+    ----------
+    appointments : list[Appointment]
+        List of appointments containing the input data of multiple patient.
+    start_date: Optional[str]
+        Start date of predictions, predictions will be made from that date,
+        by default the date in 3 weekdays (i.e. excluding the weekend)
+
+    Returns
+    -------
+    dict
+        The status of the job, including the job id
+    """
+    record_validation(timer, len(appointments))
+    check_api_key(api_key)
+    start_date = get_start_date(start_date)
+
+    if len(appointments) == 0:
+        logger.error("400: Input cannot be empty.")
+        raise HTTPException(status_code=400, detail="Input cannot be empty.")
 
-    end_time = datetime.now()
     apirequest = ApiRequest(
-        timestamp=start_time,
+        timestamp=datetime.now(),
         api_version=API_VERSION,
-        response_code=200,
-        response_message="success",
-        endpoint="predict",
-        runtime=(end_time - start_time).total_seconds(),
+        response_code=202,
+        response_message="queued",
+        endpoint="predict/jobs",
+        runtime=0.0,
     )
     db.add(apirequest)
+    db.commit()
 
-    internal_pred_ids = store_predictions(prediction_df, db, apirequest)
+    job = PredictionJob(
+        id=apirequest.id,
+        start_date=start_date,
+        n_appointments=len(appointments),
+        timer=timer,
+    )
+    try:
+        prediction_executor.submit(
+            lambda deadline: run_prediction_job(job, appointments, deadline)
+        )
+    except HTTPException as e:
+        apirequest.response_code = e.status_code
+        apirequest.response_message = f"failed: {e.detail}"
+        db.commit()
+        raise
+    job_store.add(job)
 
-    fix_outdated_appointments(db, internal_pred_ids, start_date)
+    logger.info(f"Prediction job {job.id} submitted for {start_date}")
+    return job.to_dict()
 
-    logger.info("Predict endpoint finished successfully.")
-    return {"message": f"{len(prediction_df)} predictions created and stored in db."}
+
+@app.get("/predict/jobs/{job_id}")
+async def get_prediction_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    api_key: str = Depends(api_key_header),
+) -> dict:
+    """Return the status of a prediction job.
+
+    Jobs that are no longer in memory (e.g. after a restart of the API) are
+    looked up in the ApiRequest table, without the progress and stage timings.
+
+    Parameters
+    ----------
+    job_id : int
+        The id of the job, as returned when the job was submitted
+
+    Returns
+    -------
+    dict
+        The status of the job
+    """
+    check_api_key(api_key)
+    job = job_store.get(job_id)
+    if job is not None:
+        return job.to_dict()
+
+    apirequest = db.get(ApiRequest, job_id)
+    if apirequest is None or apirequest.endpoint != "predict/jobs":
+        raise HTTPException(404, f"Prediction job {job_id} not found")
+
+    if apirequest.response_code == 200:
+        status = "finished"
+    elif apirequest.response_code == 202:
+        # The API restarted before the job was finished
+        status = "interrupted"
+    else:
+        status = "failed"
+    return {
+        "job_id": job_id,
+        "status": status,
+        "message": apirequest.response_message,
+        "runtime": apirequest.runtime,
+        "submitted_at": apirequest.timestamp.isoformat(),
+    }
 
 
 @app.get("/")
 async def root():
     """Return a standard response."""
     return {"message": "UMCU <3"}
+
+
+@app.get("/health")
+async def health(response: Response) -> dict:
+    """Readiness check, returns 503 when a resource has not been loaded."""
+    resources = {
+        resource.name: resource.status() for resource in (postal_codes, model_registry)
+    }
+    ready = all(resource["ready"] for resource in resources.values())
+    if not ready:
+        response.status_code = 503
+    return {"status": "ready" if ready else "not ready", "resources": resources}
+
+
+@app.get("/metrics")
+async def get_metrics() -> Response:
+    """Return the in-process metrics of the API in the Prometheus text format."""
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.post("/reload")
+async def reload_resources(api_key: str = Depends(api_key_header)) -> dict:
+    """Reload the cached resources from file, e.g. after NL.txt has been updated."""
+    check_api_key(api_key)
+    resources = (postal_codes, model_registry)
+    for resource in resources:
+        try:
+            resource.load()
+        except Exception as e:
+            raise HTTPException(500, f"Reloading {resource.name} failed") from e
+    return {
+        "message": "Resources reloaded",
+        "resources": [resource.name for resource in resources],
+        "model_version": model_registry.version,
+    }
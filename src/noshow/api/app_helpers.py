@@ -3,23 +3,43 @@ import pickle
 import random
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Any, Dict, Union
+from typing import Any, Dict, Optional, Union
 
 import numpy as np
 import pandas as pd
-from sqlalchemy import delete, select
+from sqlalchemy import (
+    Column,
+    Integer,
+    MetaData,
+    Select,
+    Table,
+    delete,
+    exists,
+    func,
+    insert,
+    select,
+    update,
+)
 from sqlalchemy.orm import Session
 
+from noshow.api.timing import StageTimer
 from noshow.config import CLINIC_CONFIG
 from noshow.database.models import (
+    ApiAppointment,
     ApiPatient,
+    ApiPatientState,
     ApiPrediction,
     ApiRequest,
+    ApiRequestStage,
     ApiSensitiveInfo,
 )
+from noshow.features.patient_state import STATE_COLUMNS
 
 logger = logging.getLogger(__name__)
 
+APPOINTMENT_HISTORY_COLUMNS = [column.name for column in ApiAppointment.__table__.c]
+APPOINTMENT_HISTORY_DATETIMES = ["start", "end", "gearriveerd", "created"]
+
 
 def load_model(model_path: Union[str, Path, None] = None) -> Any:
     """
@@ -53,7 +73,7 @@ def load_model(model_path: Union[str, Path, None] = None) -> Any:
 
 def remove_sensitive_info(
     session: Session, start_time: str, lookback_days: int = 7
-) -> None:
+) -> int:
     """Remove sensitive information for patients that have not been predicted on
     in the last `lookback_days` days.
 
@@ -65,6 +85,11 @@ def remove_sensitive_info(
         The start time of the predictions in the format YYYY-MM-DD
     lookback_days : int, optional
         The number of days to look back, by default 14
+
+    Returns
+    -------
+    int
+        The number of patients for which the sensitive info was removed
     """
     start_date = datetime.strptime(start_time, "%Y-%m-%d")
     patients_with_recent_predictions = (
@@ -74,16 +99,38 @@ def remove_sensitive_info(
         .scalar_subquery()
     )
 
-    session.execute(
+    result = session.execute(
         delete(ApiSensitiveInfo).where(
             ApiSensitiveInfo.patient_id.notin_(patients_with_recent_predictions)
         )
     )
+    return result.rowcount
+
+
+def _create_id_staging_table(session: Session, ids: list[int]) -> Table:
+    """Create a temporary table in the current transaction holding `ids`."""
+    if session.get_bind().dialect.name == "mssql":
+        # Tables starting with # are temporary tables in MSSQL
+        staging_table = Table(
+            "#staging_prediction_ids",
+            MetaData(),
+            Column("id", Integer, primary_key=True),
+        )
+    else:
+        staging_table = Table(
+            "staging_prediction_ids",
+            MetaData(),
+            Column("id", Integer, primary_key=True),
+            prefixes=["TEMPORARY"],
+        )
+    staging_table.create(session.connection())
+    session.execute(insert(staging_table), [{"id": app_id} for app_id in ids])
+    return staging_table
 
 
 def fix_outdated_appointments(
-    session: Session, app_ids: list[int], start_date: str
-) -> None:
+    session: Session, app_ids: list[int], start_date: str, max_in_values: int = 1000
+) -> int:
     """Set the status of outdated appointments on inactive
 
     Appointments can change while the model is running, existing apointments
@@ -91,6 +138,10 @@ def fix_outdated_appointments(
     are rescheduled further in the future need to be set to inactive to prevent
     them from showing up in the dashboard.
 
+    All outdated appointments are deactivated with a single UPDATE statement. When
+    there are more than `max_in_values` app ids, the ids are inserted in a temporary
+    staging table instead of using a (too large) NOT IN clause.
+
     Parameters
     ----------
     session : Session
@@ -99,19 +150,39 @@ def fix_outdated_appointments(
         List of app ids for which a prediction has been made
     start_date : str
         start date from which the predictions are made
+    max_in_values : int, optional
+        Maximum number of app ids to use in a NOT IN clause, by default 1000
+
+    Returns
+    -------
+    int
+        The number of predictions that were set to inactive
     """
-    all_ids = session.scalars(
-        select(ApiPrediction.id)
+    app_ids = list(set(app_ids))
+    deactivate_stmt = (
+        update(ApiPrediction)
         .where(ApiPrediction.start_time >= start_date)
         .where(ApiPrediction.active)
-    ).all()
-    inactive_ids = set(all_ids).difference(app_ids)
-    for app_id in inactive_ids:
-        apiprediction = session.get(ApiPrediction, app_id)
-        if apiprediction:
-            apiprediction.active = False
-            session.commit()
-    logger.info(f"Set {len(inactive_ids)} predictions to inactive")
+        .values(active=False)
+        .execution_options(synchronize_session=False)
+    )
+
+    staging_table = None
+    if len(app_ids) <= max_in_values:
+        deactivate_stmt = deactivate_stmt.where(ApiPrediction.id.notin_(app_ids))
+    else:
+        staging_table = _create_id_staging_table(session, app_ids)
+        deactivate_stmt = deactivate_stmt.where(
+            ~exists().where(staging_table.c.id == ApiPrediction.id)
+        )
+
+    n_inactive = session.execute(deactivate_stmt).rowcount
+    if staging_table is not None:
+        staging_table.drop(session.connection())
+    session.commit()
+
+    logger.info(f"Set {n_inactive} predictions to inactive")
+    return n_inactive
 
 
 def apply_bins(group, bin_dict):
@@ -203,7 +274,7 @@ def create_treatment_groups(
     predictions = predictions.sort_values("prediction", ascending=False)
     # apply bins based on supplied fixed score_bins
     predictions = (
-        predictions.groupby("hoofdagenda")
+        predictions.groupby("hoofdagenda", observed=True)
         .apply(apply_bins, bin_dict=bin_edges, include_groups=False)
         .reset_index()
     )
@@ -213,14 +284,14 @@ def create_treatment_groups(
     mask = predictions["treatment_group"].isnull()
     predictions.loc[mask, "treatment_group"] = (
         predictions[mask]
-        .groupby(["hoofdagenda", "score_bin"])["prediction"]
+        .groupby(["hoofdagenda", "score_bin"], observed=True)["prediction"]
         .transform(lambda x: (np.arange(len(x)) + random.randint(0, 1)) % 2)
     )
 
     # For every new patient assign the treatment group based on the mode
     predictions.loc[mask, "treatment_group"] = (
         predictions[mask]
-        .groupby("pseudo_id")["treatment_group"]
+        .groupby("pseudo_id", observed=True)["treatment_group"]
         .transform(lambda x: x.mode()[0] if not x.mode().empty else np.nan)
     )
     # drop score_bin column
@@ -229,14 +300,110 @@ def create_treatment_groups(
     return predictions
 
 
+def _select_in_chunks(
+    db: Session, statement: Select, column: Any, values: list, chunk_size: int
+) -> list:
+    """Execute a select with an IN-clause on `column` in chunks of `chunk_size`.
+
+    MSSQL allows a limited number of parameters per statement, so long lists of
+    values are split over multiple queries.
+    """
+    results = []
+    for i in range(0, len(values), chunk_size):
+        chunk = values[i : i + chunk_size]
+        results.extend(db.execute(statement.where(column.in_(chunk))).all())
+    return results
+
+
+def _sensitive_info_rows(
+    patient_rows: dict[str, dict], existing_sensitive: set[str]
+) -> tuple[list[dict], list[dict]]:
+    """Split the sensitive info of patients in rows to insert and rows to update."""
+    new_rows, updated_rows = [], []
+    for patient_id, row in patient_rows.items():
+        # name and birthdate can't change, but phone number might
+        phone_numbers = {
+            "mobile_phone": row["telecom1_value"],
+            "home_phone": row["telecom2_value"],
+            "other_phone": row["telecom3_value"],
+        }
+        if patient_id in existing_sensitive:
+            updated_rows.append({"patient_id": patient_id, **phone_numbers})
+            continue
+
+        if row["name_text"] is None:
+            logger.warning(
+                f"Patient {patient_id} has no name_text, replacing with empty string"
+            )
+        new_rows.append(
+            {
+                "patient_id": patient_id,
+                "hix_number": row["patient_id"],
+                "full_name": row["name_text"] or "",
+                "first_name": row["name_given1_callMe"],
+                "birth_date": row["birthDate"],
+                **phone_numbers,
+            }
+        )
+    return new_rows, updated_rows
+
+
+def _prediction_rows(
+    prediction_rows: dict[tuple[str, datetime], dict],
+    existing_predictions: dict[tuple[str, datetime], int],
+    request_id: int,
+) -> tuple[list[dict], list[dict]]:
+    """Split the predictions in rows to insert and rows to update."""
+    new_rows, updated_rows = [], []
+    for key, row in prediction_rows.items():
+        clinic_config = CLINIC_CONFIG[row["clinic"]]
+        # All values of a prediction can be updated except the ID and treatment
+        prediction = {
+            "prediction": row["prediction"],
+            "start_time": row["start"],
+            "request_id": request_id,
+            "clinic_name": row["hoofdagenda"],
+            "clinic_reception": row["description"],
+            "clinic_phone_number": clinic_config.phone_number,
+            "clinic_teleq_unit": clinic_config.teleq_name,
+            "clinic_actual_name": row["clinic"],
+            "active": True,
+        }
+        if key in existing_predictions:
+            updated_rows.append({"id": existing_predictions[key], **prediction})
+        else:
+            new_rows.append(
+                {
+                    "appointment_id": row["APP_ID"],
+                    "patient_id": row["pseudo_id"],
+                    **prediction,
+                }
+            )
+    return new_rows, updated_rows
+
+
+def _stored_datetime(value: Any) -> datetime:
+    """Convert a datetime to the naive wall time that is stored in a DateTime
+    column, so values from the payload and from the database can be compared"""
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_localize(None)
+    return timestamp.to_pydatetime()
+
+
 def store_predictions(
     prediction_df: pd.DataFrame,
     db: Session,
     apirequest: ApiRequest,
+    chunk_size: int = 1000,
 ) -> list[int]:
     """
     Store predictions in the database.
 
+    Existing patients, sensitive info and predictions are fetched with one query
+    per table, after which new rows are bulk inserted and existing rows are bulk
+    updated. Everything is committed in a single transaction.
+
     Parameters
     ----------
     prediction_df : pd.DataFrame
@@ -245,85 +412,388 @@ def store_predictions(
         Database session.
     apirequest : Any
         API request object related to the predictions.
+    chunk_size : int, optional
+        Maximum number of values in a single IN-clause, by default 1000
 
     Returns
     -------
     list[int]
-        List of internal prediction ID's for the stored predictions.
+        List of internal prediction ID's for the stored predictions, in the order
+        of the rows in `prediction_df`.
     """
-    appointment_ids = []
-    for _, row in prediction_df.iterrows():
-        apisensitive = db.get(ApiSensitiveInfo, row["pseudo_id"])
-
-        if not apisensitive:
-            if row["name_text"] is None:
-                row["name_text"] = ""
-                logger.warning(
-                    f"Patient {row['pseudo_id']} has no name_text, "
-                    "replacing with empty string"
-                )
+    if prediction_df.empty:
+        db.commit()
+        return []
+
+    # The request needs an id before the predictions can refer to it
+    db.add(apirequest)
+    db.flush()
+
+    rows = prediction_df.to_dict("records")
+    for row in rows:
+        row["start"] = _stored_datetime(row["start"])
+
+    # Later rows overwrite earlier rows of the same patient or appointment
+    patient_rows = {row["pseudo_id"]: row for row in rows}
+    prediction_rows = {(row["APP_ID"], row["start"]): row for row in rows}
+
+    patient_ids = list(patient_rows)
+    existing_sensitive = {
+        patient_id
+        for (patient_id,) in _select_in_chunks(
+            db,
+            select(ApiSensitiveInfo.patient_id),
+            ApiSensitiveInfo.patient_id,
+            patient_ids,
+            chunk_size,
+        )
+    }
+    existing_patients = {
+        patient_id
+        for (patient_id,) in _select_in_chunks(
+            db, select(ApiPatient.id), ApiPatient.id, patient_ids, chunk_size
+        )
+    }
+    existing_predictions = {
+        (appointment_id, _stored_datetime(start_time)): prediction_id
+        for prediction_id, appointment_id, start_time in _select_in_chunks(
+            db,
+            select(
+                ApiPrediction.id, ApiPrediction.appointment_id, ApiPrediction.start_time
+            ),
+            ApiPrediction.appointment_id,
+            list({app_id for app_id, _ in prediction_rows}),
+            chunk_size,
+        )
+    }
 
-            apisensitive = ApiSensitiveInfo(
-                patient_id=row["pseudo_id"],
-                hix_number=row["patient_id"],
-                full_name=row["name_text"],
-                first_name=row["name_given1_callMe"],
-                birth_date=row["birthDate"],
-                mobile_phone=row["telecom1_value"],
-                home_phone=row["telecom2_value"],
-                other_phone=row["telecom3_value"],
-            )
-            db.add(apisensitive)
-        else:
-            # name and birthdate can't change, but phone number might
-            apisensitive.mobile_phone = row["telecom1_value"]
-            apisensitive.home_phone = row["telecom2_value"]
-            apisensitive.other_phone = row["telecom3_value"]
-
-        apipatient = db.get(ApiPatient, row["pseudo_id"])
-        if not apipatient:
-            apipatient = ApiPatient(
-                id=row["pseudo_id"],
-            )
-            db.add(apipatient)
-        apipatient.treatment_group = int(row["treatment_group"])
-        apiprediction = db.execute(
-            select(ApiPrediction).where(
-                (ApiPrediction.appointment_id == row["APP_ID"])
-                & (ApiPrediction.start_time == row["start"])
-            )
-        ).scalar_one_or_none()
-        if not apiprediction:
-            apiprediction = ApiPrediction(
-                appointment_id=row["APP_ID"],
-                patient_id=row["pseudo_id"],
-                prediction=row["prediction"],
-                start_time=row["start"],
-                request_relation=apirequest,
-                patient_relation=apipatient,
-                clinic_name=row["hoofdagenda"],
-                clinic_reception=row["description"],
-                clinic_phone_number=CLINIC_CONFIG[row["clinic"]].phone_number,
-                clinic_teleq_unit=CLINIC_CONFIG[row["clinic"]].teleq_name,
-                clinic_actual_name=row["clinic"],
-                active=True,
+    new_sensitive, updated_sensitive = _sensitive_info_rows(
+        patient_rows, existing_sensitive
+    )
+    patients = [
+        {"id": patient_id, "treatment_group": int(row["treatment_group"])}
+        for patient_id, row in patient_rows.items()
+    ]
+    new_predictions, updated_predictions = _prediction_rows(
+        prediction_rows, existing_predictions, apirequest.id
+    )
+
+    if new_sensitive:
+        db.execute(insert(ApiSensitiveInfo), new_sensitive)
+    if updated_sensitive:
+        db.execute(update(ApiSensitiveInfo), updated_sensitive)
+    if len(existing_patients) < len(patients):
+        db.execute(
+            insert(ApiPatient),
+            [p for p in patients if p["id"] not in existing_patients],
+        )
+    if existing_patients:
+        db.execute(
+            update(ApiPatient), [p for p in patients if p["id"] in existing_patients]
+        )
+    if updated_predictions:
+        db.execute(update(ApiPrediction), updated_predictions)
+    if new_predictions:
+        inserted_ids = db.scalars(
+            insert(ApiPrediction).returning(
+                ApiPrediction.id, sort_by_parameter_order=True
+            ),
+            new_predictions,
+        ).all()
+        for prediction, prediction_id in zip(
+            new_predictions, inserted_ids, strict=True
+        ):
+            key = (prediction["appointment_id"], prediction["start_time"])
+            existing_predictions[key] = prediction_id
+
+    db.commit()
+
+    logger.info(
+        f"{len(prediction_df)} predictions stored in the database "
+        f"({len(new_predictions)} inserted, {len(updated_predictions)} updated)"
+    )
+    return [existing_predictions[(row["APP_ID"], row["start"])] for row in rows]
+
+
+def store_request_stages(
+    db: Session, apirequest: ApiRequest, timer: StageTimer
+) -> None:
+    """Store the runtime and number of rows of every stage of a request
+
+    Parameters
+    ----------
+    db : Session
+        Database session
+    apirequest : ApiRequest
+        The request the stages belong to, must already have an id
+    timer : StageTimer
+        The timer that recorded the stages of the request
+    """
+    db.add_all(
+        ApiRequestStage(
+            request_id=apirequest.id,
+            stage=record.name,
+            duration=record.duration,
+            rows=record.rows,
+        )
+        for record in timer.records.values()
+    )
+    db.commit()
+
+
+def load_patient_state(
+    db: Session,
+    pseudo_ids: list[str],
+    tz: Optional[str] = None,
+    chunk_size: int = 1000,
+) -> pd.DataFrame:
+    """Load the stored state of the patients
+
+    Parameters
+    ----------
+    db : Session
+        Database session
+    pseudo_ids : list[str]
+        The patients to load the state of
+    tz : Optional[str], optional
+        Timezone of the appointments, the timestamps are stored in UTC,
+        by default None
+    chunk_size : int, optional
+        Maximum number of ids per query, by default 1000
+
+    Returns
+    -------
+    pd.DataFrame
+        The state per `pseudo_id`, patients without a state are not included
+    """
+    rows = _select_in_chunks(
+        db,
+        select(*(getattr(ApiPatientState, c) for c in ["pseudo_id", *STATE_COLUMNS])),
+        ApiPatientState.pseudo_id,
+        list(pseudo_ids),
+        chunk_size,
+    )
+    patient_state = pd.DataFrame(rows, columns=["pseudo_id", *STATE_COLUMNS]).set_index(
+        "pseudo_id"
+    )
+    if tz is not None:
+        for column in ("watermark", "last_start"):
+            patient_state[column] = (
+                pd.to_datetime(patient_state[column])
+                .dt.tz_localize("UTC")
+                .dt.tz_convert(tz)
             )
-            db.add(apiprediction)
-        else:
-            # All values of a prediction can be updated except the ID and treatment
-            apiprediction.prediction = row["prediction"]
-            apiprediction.start_time = row["start"]
-            apiprediction.request_relation = apirequest
-            apiprediction.clinic_name = row["hoofdagenda"]
-            apiprediction.clinic_reception = row["description"]
-            apiprediction.clinic_phone_number = CLINIC_CONFIG[
-                row["clinic"]
-            ].phone_number
-            apiprediction.clinic_teleq_unit = CLINIC_CONFIG[row["clinic"]].teleq_name
-            apiprediction.clinic_actual_name = row["clinic"]
-            apiprediction.active = True
+    return patient_state
 
-        db.commit()
-        appointment_ids.append(apiprediction.id)
-    logger.info(f"{len(prediction_df)} predictions stored in the database")
-    return appointment_ids
+
+def _to_utc_datetimes(timestamps: pd.Series) -> list[Optional[datetime]]:
+    """Convert timestamps to naive UTC datetimes, as stored in the database."""
+    timestamps = pd.to_datetime(timestamps)
+    if timestamps.dt.tz is not None:
+        timestamps = timestamps.dt.tz_convert("UTC").dt.tz_localize(None)
+    return [None if pd.isna(t) else t.to_pydatetime() for t in timestamps]
+
+
+def store_patient_state(db: Session, patient_state: pd.DataFrame) -> None:
+    """Insert or update the state of the patients without committing
+
+    The state is committed together with the predictions by `store_predictions`.
+
+    Parameters
+    ----------
+    db : Session
+        Database session
+    patient_state : pd.DataFrame
+        The state per `pseudo_id`, see `calc_patient_state`
+    """
+    rows = patient_state.reset_index().to_dict(orient="records")
+    for column in ("watermark", "last_start"):
+        for row, timestamp in zip(
+            rows, _to_utc_datetimes(patient_state[column]), strict=True
+        ):
+            row[column] = timestamp
+
+    n_new, n_updated = _bulk_upsert(db, ApiPatientState.pseudo_id, rows)
+    logger.info(f"Patient state stored ({n_new} inserted, {n_updated} updated)")
+
+
+def _bulk_upsert(
+    db: Session, key: Any, rows: list[dict], chunk_size: int = 1000
+) -> tuple[int, int]:
+    """Bulk insert the new rows and bulk update the existing rows of a table.
+
+    Parameters
+    ----------
+    db : Session
+        Database session
+    key : Any
+        The primary key column of the table, e.g. `ApiPatientState.pseudo_id`
+    rows : list[dict]
+        The rows to store, with a value for the primary key
+    chunk_size : int, optional
+        Maximum number of values in a single IN-clause, by default 1000
+
+    Returns
+    -------
+    tuple[int, int]
+        The number of inserted and updated rows
+    """
+    existing = {
+        value
+        for (value,) in _select_in_chunks(
+            db, select(key), key, [row[key.key] for row in rows], chunk_size
+        )
+    }
+    new_rows = [row for row in rows if row[key.key] not in existing]
+    updated_rows = [row for row in rows if row[key.key] in existing]
+    if new_rows:
+        db.execute(insert(key.class_), new_rows)
+    if updated_rows:
+        db.execute(update(key.class_), updated_rows)
+    return len(new_rows), len(updated_rows)
+
+
+def latest_history_watermark(db: Session) -> Optional[datetime]:
+    """Return the watermark of the last request that updated the appointment history
+
+    Parameters
+    ----------
+    db : Session
+        Database session
+
+    Returns
+    -------
+    Optional[datetime]
+        The watermark, or None when the appointment history has never been stored
+    """
+    return db.scalar(select(func.max(ApiRequest.history_watermark)))
+
+
+def patients_without_history(
+    db: Session, pseudo_ids: list[str], chunk_size: int = 1000
+) -> list[str]:
+    """Return the patients that have no appointments in the stored history
+
+    Parameters
+    ----------
+    db : Session
+        Database session
+    pseudo_ids : list[str]
+        The patients to check
+    chunk_size : int, optional
+        Maximum number of ids per query, by default 1000
+
+    Returns
+    -------
+    list[str]
+        The patients of `pseudo_ids` without stored appointments
+    """
+    pseudo_ids = list(pseudo_ids)
+    stored = {
+        pseudo_id
+        for (pseudo_id,) in _select_in_chunks(
+            db,
+            select(ApiAppointment.pseudo_id).distinct(),
+            ApiAppointment.pseudo_id,
+            pseudo_ids,
+            chunk_size,
+        )
+    }
+    return [pseudo_id for pseudo_id in pseudo_ids if pseudo_id not in stored]
+
+
+def load_appointment_history(
+    db: Session,
+    pseudo_ids: list[str],
+    start_date: str,
+    chunk_size: int = 1000,
+) -> pd.DataFrame:
+    """Load the stored appointments of the patients that start before `start_date`
+
+    Parameters
+    ----------
+    db : Session
+        Database session
+    pseudo_ids : list[str]
+        The patients to load the appointments of
+    start_date : str
+        Only appointments before this date in the format YYYY-MM-DD are loaded
+    chunk_size : int, optional
+        Maximum number of ids per query, by default 1000
+
+    Returns
+    -------
+    pd.DataFrame
+        The appointments with the columns in `APPOINTMENT_HISTORY_COLUMNS`, the
+        timestamps are in UTC
+    """
+    rows = _select_in_chunks(
+        db,
+        select(*ApiAppointment.__table__.columns).where(
+            ApiAppointment.start < datetime.fromisoformat(start_date)
+        ),
+        ApiAppointment.pseudo_id,
+        list(pseudo_ids),
+        chunk_size,
+    )
+    history = pd.DataFrame(rows, columns=APPOINTMENT_HISTORY_COLUMNS)
+    for column in APPOINTMENT_HISTORY_DATETIMES:
+        history[column] = pd.to_datetime(history[column]).dt.tz_localize("UTC")
+    return history
+
+
+def store_appointment_history(
+    db: Session,
+    appointments_df: pd.DataFrame,
+    replace: bool = False,
+    chunk_size: int = 1000,
+) -> int:
+    """Store the appointments in the appointment history without committing
+
+    Only the columns in `APPOINTMENT_HISTORY_COLUMNS` are stored, so no sensitive
+    information of the patients. The history is committed together with the
+    predictions by `store_predictions`.
+
+    Parameters
+    ----------
+    db : Session
+        Database session
+    appointments_df : pd.DataFrame
+        The appointments as loaded by `load_appointment_pydantic`
+    replace : bool, optional
+        If True, the stored history of the patients in `appointments_df` is
+        replaced by their appointments, otherwise the appointments are added to it
+        or update it, by default False. The history of other patients is kept.
+    chunk_size : int, optional
+        Maximum number of ids per query, by default 1000
+
+    Returns
+    -------
+    int
+        Number of stored appointments
+    """
+    history = appointments_df[APPOINTMENT_HISTORY_COLUMNS].drop_duplicates(
+        "APP_ID", keep="last"
+    )
+    history = history.astype({"address_postalCodeNumbersNL": "Int64"}).astype(object)
+    rows = history.where(history.notna(), None).to_dict(orient="records")
+    for column in APPOINTMENT_HISTORY_DATETIMES:
+        for row, timestamp in zip(
+            rows, _to_utc_datetimes(history[column]), strict=True
+        ):
+            row[column] = timestamp
+
+    if replace:
+        pseudo_ids = list(history["pseudo_id"].unique())
+        for i in range(0, len(pseudo_ids), chunk_size):
+            db.execute(
+                delete(ApiAppointment).where(
+                    ApiAppointment.pseudo_id.in_(pseudo_ids[i : i + chunk_size])
+                )
+            )
+    n_new, n_updated = _bulk_upsert(db, ApiAppointment.APP_ID, rows, chunk_size)
+    logger.info(
+        f"Appointment history stored ({n_new} inserted, {n_updated} updated, "
+        f"replaced: {replace})"
+    )
+    return len(rows)
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+
+class PredictionTimeoutError(TimeoutError):
+    """Raised by a prediction pipeline that passed its deadline."""
+
+
+def check_deadline(deadline: Optional[float], stage: str) -> None:
+    """Stop the pipeline when the deadline of the request has passed.
+
+    Threads can not be cancelled from the outside, so long running pipelines call
+    this function between stages to stop working on requests that already timed out.
+
+    Parameters
+    ----------
+    deadline : Optional[float]
+        Deadline as a `time.monotonic` timestamp, no deadline if None
+    stage : str
+        The stage that is about to start, used in the error message
+
+    Raises
+    ------
+    PredictionTimeoutError
+        If the deadline has passed
+    """
+    if deadline is not None and time.monotonic() > deadline:
+        raise PredictionTimeoutError(f"Deadline passed before stage {stage}")
+
+
+class PredictionExecutor:
+    """Bounded worker pool for the CPU-heavy and blocking prediction pipeline.
+
+    The pipeline runs in a thread pool, so the event loop of the API stays free to
+    answer other requests (e.g. health checks) while a batch is being scored. At most
+    `max_workers` pipelines run at the same time and at most `max_queued` requests
+    wait for a free worker, other requests are refused with a 503.
+
+    Parameters
+    ----------
+    max_workers : int
+        Maximum number of pipelines that run at the same time
+    max_queued : int
+        Maximum number of requests that wait for a free worker
+    timeout : float
+        Number of seconds after which a request times out
+    """
+
+    def __init__(self, max_workers: int, max_queued: int, timeout: float) -> None:
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="predict"
+        )
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        """Number of pipelines that are running or waiting for a worker."""
+        return self._pending
+
+    def _release(self, _: Future) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def submit(self, func: Callable[[Optional[float]], Any]) -> Future:
+        """Submit a pipeline to the worker pool without waiting for the result.
+
+        Parameters
+        ----------
+        func : Callable[[Optional[float]], Any]
+            The pipeline, is called with the deadline of the request
+
+        Returns
+        -------
+        Future
+            Future that holds the result of the pipeline
+
+        Raises
+        ------
+        HTTPException
+            503 error if the queue is full
+        """
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queued:
+                logger.error("503: Too many prediction requests in the queue")
+                raise HTTPException(
+                    503,
+                    "Too many prediction requests in the queue",
+                    headers={"Retry-After": "60"},
+                )
+            self._pending += 1
+        deadline = time.monotonic() + self.timeout
+        future = self._executor.submit(func, deadline)
+        # Only release the slot when the thread is done, also after a timeout
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, func: Callable[[Optional[float]], Any]) -> Any:
+        """Run a pipeline in the worker pool and wait for the result.
+
+        Parameters
+        ----------
+        func : Callable[[Optional[float]], Any]
+            The pipeline, is called with the deadline of the request
+
+        Returns
+        -------
+        Any
+            The result of the pipeline
+
+        Raises
+        ------
+        HTTPException
+            503 error if the queue is full, or 504 if the request timed out
+        """
+        future = asyncio.wrap_future(self.submit(func))
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except (asyncio.TimeoutError, PredictionTimeoutError) as e:
+            logger.error(f"504: Prediction request timed out after {self.timeout}s")
+            raise HTTPException(504, "Prediction request timed out") from e
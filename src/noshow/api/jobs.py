@@ -0,0 +1,85 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+from noshow.api.timing import StageTimer
+
+
+@dataclass
+class PredictionJob:
+    """Status of a prediction job submitted to the `/predict/jobs` endpoint.
+
+    Attributes
+    ----------
+    id : int
+        Id of the job, equal to the id of the ApiRequest of the job
+    start_date : str
+        Start date of the predictions
+    n_appointments : int
+        Number of appointments in the payload
+    status : str
+        One of `queued`, `running`, `finished` or `failed`
+    timer : StageTimer
+        Keeps track of the current stage and the runtime per stage
+    n_predictions : int | None
+        Number of predictions stored, when the job is finished
+    error : str | None
+        Error message, when the job failed
+    """
+
+    id: int
+    start_date: str
+    n_appointments: int
+    status: str = "queued"
+    timer: StageTimer = field(default_factory=StageTimer)
+    submitted_at: datetime = field(default_factory=datetime.now)
+    finished_at: Optional[datetime] = None
+    n_predictions: Optional[int] = None
+    error: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        """Return the status of the job as returned by the API."""
+        return {
+            "job_id": self.id,
+            "start_date": self.start_date,
+            "status": self.status,
+            "stage": self.timer.current_stage,
+            "progress": round(self.timer.progress, 2),
+            "stage_timings": self.timer.timings,
+            "n_appointments": self.n_appointments,
+            "n_predictions": self.n_predictions,
+            "error": self.error,
+            "submitted_at": self.submitted_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class JobStore:
+    """In-memory store of the most recent prediction jobs.
+
+    Finished jobs are also stored in the ApiRequest table, so only the detailed
+    progress of older jobs is lost when they are removed from this store.
+
+    Parameters
+    ----------
+    max_jobs : int, optional
+        Maximum number of jobs to keep, by default 100
+    """
+
+    def __init__(self, max_jobs: int = 100) -> None:
+        self.max_jobs = max_jobs
+        self._jobs: OrderedDict[int, PredictionJob] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, job: PredictionJob) -> None:
+        """Add a job and remove the oldest jobs when the store is full."""
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+
+    def get(self, job_id: int) -> Optional[PredictionJob]:
+        """Return the job with `job_id`, or None when it is not in the store."""
+        return self._jobs.get(job_id)
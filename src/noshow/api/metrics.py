@@ -0,0 +1,304 @@
+"""In-process metrics of the prediction API in the Prometheus text format.
+
+The metrics are plain counters and histograms that are updated in memory, so
+recording them costs no more than a dictionary lookup and an addition. The
+`/metrics` endpoint renders them in the Prometheus text exposition format.
+"""
+
+import abc
+import math
+import threading
+from typing import Callable, Iterable, TypeVar
+
+from noshow.api.timing import StageTimer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DURATION_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+ROW_BUCKETS = (10, 100, 1000, 5000, 10000, 50000, 100000, 500000)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = (f'{key}="{_escape(str(value))}"' for key, value in labels.items())
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric(abc.ABC):
+    """Base class of a metric with an optional set of labels.
+
+    Parameters
+    ----------
+    name : str
+        Name of the metric
+    documentation : str
+        Description of the metric, rendered as HELP line
+    labelnames : Iterable[str], optional
+        Names of the labels of the metric, by default no labels
+    """
+
+    type_name = "untyped"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Iterable[str] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"Metric {self.name} expects labels {self.labelnames}, "
+                f"got {tuple(labels)}"
+            )
+        return tuple(str(labels[label]) for label in self.labelnames)
+
+    @abc.abstractmethod
+    def _samples(self) -> Iterable[tuple[str, dict[str, str], float]]:
+        """Yield the name, labels and value of every sample of the metric."""
+
+    def render(self) -> str:
+        """Render the metric in the Prometheus text format."""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        for name, labels, value in self._samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter."""
+
+    type_name = "counter"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Iterable[str] = ()
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Increase the counter with `amount`."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        """Return the current value of the counter."""
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> Iterable[tuple[str, dict[str, str], float]]:
+        for key, value in sorted(self._values.items()):
+            yield self.name, dict(zip(self.labelnames, key, strict=True)), value
+
+
+class Gauge(_Metric):
+    """Value that is read from a function when the metrics are rendered.
+
+    Parameters
+    ----------
+    name : str
+        Name of the metric
+    documentation : str
+        Description of the metric, rendered as HELP line
+    function : Callable[[], float]
+        Function that returns the current value
+    """
+
+    type_name = "gauge"
+
+    def __init__(
+        self, name: str, documentation: str, function: Callable[[], float]
+    ) -> None:
+        super().__init__(name, documentation)
+        self.function = function
+
+    def _samples(self) -> Iterable[tuple[str, dict[str, str], float]]:
+        yield self.name, {}, self.function()
+
+
+class Histogram(_Metric):
+    """Histogram with cumulative buckets, a sum and a count.
+
+    Parameters
+    ----------
+    name : str
+        Name of the metric
+    documentation : str
+        Description of the metric, rendered as HELP line
+    labelnames : Iterable[str], optional
+        Names of the labels of the metric, by default no labels
+    buckets : Iterable[float], optional
+        Upper bounds of the buckets, by default `DURATION_BUCKETS`
+    """
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DURATION_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._counts: dict[tuple[str, ...], list[int]] = {}
+        self._sums: dict[tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Add an observation to the histogram."""
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            for i, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    counts[i] += 1
+                    break
+            self._sums[key] = self._sums.get(key, 0) + value
+
+    def count(self, **labels: str) -> int:
+        """Return the number of observations."""
+        return sum(self._counts.get(self._key(labels), []))
+
+    def _samples(self) -> Iterable[tuple[str, dict[str, str], float]]:
+        for key, counts in sorted(self._counts.items()):
+            labels = dict(zip(self.labelnames, key, strict=True))
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets, counts, strict=True):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket",
+                    {**labels, "le": _format_value(upper_bound)},
+                    cumulative,
+                )
+            yield f"{self.name}_sum", labels, self._sums[key]
+            yield f"{self.name}_count", labels, cumulative
+
+
+MetricT = TypeVar("MetricT", bound=_Metric)
+
+
+class MetricsRegistry:
+    """Collection of metrics that are rendered together."""
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: MetricT) -> MetricT:
+        """Add a metric to the registry and return it."""
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text format."""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+registry = MetricsRegistry()
+
+http_request_duration = registry.register(
+    Histogram(
+        "noshow_http_request_duration_seconds",
+        "Latency of the API requests.",
+        labelnames=("path", "method", "status"),
+    )
+)
+stage_duration = registry.register(
+    Histogram(
+        "noshow_prediction_stage_duration_seconds",
+        "Runtime of the stages of the prediction pipeline.",
+        labelnames=("stage",),
+    )
+)
+stage_rows = registry.register(
+    Counter(
+        "noshow_prediction_stage_rows_total",
+        "Number of rows produced by the stages of the prediction pipeline.",
+        labelnames=("stage",),
+    )
+)
+payload_rows = registry.register(
+    Histogram(
+        "noshow_prediction_payload_rows",
+        "Number of appointments in the payload of a prediction request.",
+        buckets=ROW_BUCKETS,
+    )
+)
+predictions_stored = registry.register(
+    Counter("noshow_predictions_stored_total", "Number of predictions stored.")
+)
+predictions_deactivated = registry.register(
+    Counter(
+        "noshow_predictions_deactivated_total",
+        "Number of outdated predictions that were deactivated.",
+    )
+)
+resource_loads = registry.register(
+    Counter(
+        "noshow_resource_loads_total",
+        "Number of (re)loads of the cached resources of the API.",
+        labelnames=("resource", "kind", "result"),
+    )
+)
+resource_cache = registry.register(
+    Counter(
+        "noshow_resource_cache_requests_total",
+        "Number of requests of a cached resource, a miss means it was (re)loaded.",
+        labelnames=("resource", "result"),
+    )
+)
+db_roundtrips = registry.register(
+    Counter(
+        "noshow_db_roundtrips_total",
+        "Number of statements sent to the database.",
+    )
+)
+
+
+def observe_stages(timer: StageTimer) -> None:
+    """Add the stages of a finished prediction request to the metrics.
+
+    Parameters
+    ----------
+    timer : StageTimer
+        The timer that recorded the stages of the request
+    """
+    for record in timer.records.values():
+        stage_duration.observe(record.duration, stage=record.name)
+        if record.rows is not None:
+            stage_rows.inc(record.rows, stage=record.name)
+
+    rows = timer.rows
+    n_payload = rows.get("decode") or rows.get("validate")
+    if n_payload is not None:
+        payload_rows.observe(n_payload)
+    predictions_stored.inc(rows.get("store") or 0)
+    predictions_deactivated.inc(rows.get("deactivate") or 0)
+
+
+def count_db_roundtrip(*args, **kwargs) -> None:
+    """SQLAlchemy `before_cursor_execute` listener that counts round-trips."""
+    db_roundtrips.inc()
+
+
+def route_path(scope: dict) -> str:
+    """Return the path template of the matched route, to keep the labels bounded."""
+    return getattr(scope.get("route"), "path", "other")
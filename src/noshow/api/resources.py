@@ -0,0 +1,218 @@
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Optional, Union
+
+from noshow.api import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class FileResource:
+    """Process-lifetime cache for a resource that is loaded from a file.
+
+    The resource is loaded once (usually in the lifespan of the API) and reused
+    for every request. When the modification time of the file changes, the
+    resource is reloaded on the next call to `get`. The new value is only swapped
+    in after loading has succeeded, so requests that are in flight keep using the
+    value they already have and a failed reload keeps serving the old value. A file
+    that failed to load is only loaded again by `get` when it changes, or with an
+    explicit call to `load`.
+
+    Parameters
+    ----------
+    name : str
+        Name of the resource, used in logging and the health endpoint
+    path : Union[str, Path]
+        Path to the file the resource is loaded from
+    loader : Callable[[Path], Any]
+        Function that loads the resource from `path`
+    """
+
+    def __init__(
+        self, name: str, path: Union[str, Path], loader: Callable[[Path], Any]
+    ) -> None:
+        self.name = name
+        self.path = Path(path)
+        self.loader = loader
+        self._value: Any = None
+        self._mtime: Optional[float] = None
+        self._loaded_at: Optional[datetime] = None
+        self._error: Optional[str] = None
+        # Modification time of the file that failed to load, if `_error` is set
+        self._failed_mtime: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        """Whether the resource has been loaded successfully."""
+        return self._loaded_at is not None
+
+    def _file_mtime(self) -> Optional[float]:
+        try:
+            return self.path.stat().st_mtime
+        except OSError:
+            return None
+
+    def load(self) -> Any:
+        """(Re)load the resource from file and swap it in.
+
+        Returns
+        -------
+        Any
+            The newly loaded resource
+        """
+        with self._lock:
+            kind = "reload" if self.ready else "load"
+            mtime = self._file_mtime()
+            try:
+                value = self.loader(self.path)
+            except Exception as e:
+                self._error = str(e)
+                self._failed_mtime = mtime
+                metrics.resource_loads.inc(
+                    resource=self.name, kind=kind, result="failure"
+                )
+                logger.error(f"Failed to load {self.name} from {self.path}: {e}")
+                raise
+            metrics.resource_loads.inc(resource=self.name, kind=kind, result="success")
+            self._value = value
+            self._mtime = mtime
+            self._loaded_at = datetime.now()
+            self._error = None
+        logger.info(f"Loaded {self.name} from {self.path}")
+        return value
+
+    def _failed_before(self, mtime: Optional[float]) -> bool:
+        """Whether the file with this modification time already failed to load."""
+        return self._error is not None and mtime == self._failed_mtime
+
+    def reload_if_changed(self) -> bool:
+        """Reload the resource when the file changed since the last load.
+
+        A file that already failed to load is not loaded again until it changes.
+
+        Returns
+        -------
+        bool
+            True if the resource was reloaded
+        """
+        mtime = self._file_mtime()
+        if self.ready and (mtime == self._mtime or self._failed_before(mtime)):
+            return False
+        self.load()
+        return True
+
+    def get(self) -> Any:
+        """Return the cached resource, loading or reloading it when needed.
+
+        Returns
+        -------
+        Any
+            The cached resource
+        """
+        if self.ready:
+            try:
+                reloaded = self.reload_if_changed()
+            except Exception:
+                reloaded = True
+                logger.warning(f"Keeping previously loaded {self.name}")
+            result = "miss" if reloaded else "hit"
+            metrics.resource_cache.inc(resource=self.name, result=result)
+            return self._value
+        metrics.resource_cache.inc(resource=self.name, result="miss")
+        if self._failed_before(self._file_mtime()):
+            raise RuntimeError(f"{self.name} failed to load: {self._error}")
+        return self.load()
+
+    def status(self) -> dict:
+        """Return the readiness information of the resource."""
+        return {
+            "ready": self.ready,
+            "path": str(self.path),
+            "loaded_at": self._loaded_at.isoformat() if self._loaded_at else None,
+            "error": self._error,
+        }
+
+
+@dataclass(frozen=True)
+class RegisteredModel:
+    """A loaded model together with the version it was loaded from.
+
+    Attributes
+    ----------
+    model : Any
+        The deserialized model object
+    version : str
+        Short content hash of the model file
+    """
+
+    model: Any
+    version: str
+
+
+def file_hash(path: Union[str, Path], length: int = 12) -> str:
+    """Calculate the (shortened) sha256 hash of the contents of a file.
+
+    Parameters
+    ----------
+    path : Union[str, Path]
+        Path to the file
+    length : int, optional
+        Number of hexadecimal characters to return, by default 12
+
+    Returns
+    -------
+    str
+        The hexadecimal hash of the file
+    """
+    sha = hashlib.sha256()
+    with Path(path).open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()[:length]
+
+
+class ModelRegistry(FileResource):
+    """Process-lifetime cache for the prediction model.
+
+    The model is unpickled once and swapped for a new model when the model file
+    changes, for example after retraining with `train_pipeline`. The version of
+    the model is the content hash of the file, so touching the file without
+    changing the model does not trigger unpickling the model again.
+
+    Parameters
+    ----------
+    name : str
+        Name of the model, used in logging and the health endpoint
+    path : Union[str, Path]
+        Path to the pickled model
+    loader : Callable[[Path], Any]
+        Function that loads the model from `path`
+    """
+
+    def __init__(
+        self, name: str, path: Union[str, Path], loader: Callable[[Path], Any]
+    ) -> None:
+        super().__init__(name, path, self._load_registered_model)
+        self.model_loader = loader
+
+    def _load_registered_model(self, path: Path) -> RegisteredModel:
+        version = file_hash(path) if path.exists() else "unknown"
+        current: Optional[RegisteredModel] = self._value
+        if current is not None and current.version == version != "unknown":
+            logger.info(f"{self.name} file changed, but content is the same")
+            return current
+        return RegisteredModel(model=self.model_loader(path), version=version)
+
+    @property
+    def version(self) -> Optional[str]:
+        """Version of the currently loaded model."""
+        return self._value.version if self.ready else None
+
+    def status(self) -> dict:
+        """Return the readiness information and version of the model."""
+        return {**super().status(), "version": self.version}
@@ -0,0 +1,110 @@
+import logging
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+PREDICTION_STAGES = [
+    "decode",
+    "validate",
+    "process_appointments",
+    "create_features",
+    "predict_proba",
+    "create_treatment_groups",
+    "remove_sensitive_info",
+    "store",
+    "deactivate",
+]
+
+
+@dataclass
+class Stage:
+    """Runtime and number of output rows of a single stage of a pipeline.
+
+    Attributes
+    ----------
+    name : str
+        Name of the stage
+    duration : float
+        Runtime of the stage in seconds
+    rows : int | None
+        Number of rows the stage produced, optional
+    """
+
+    name: str
+    duration: float = 0.0
+    rows: Optional[int] = None
+
+
+class StageTimer:
+    """Keep track of the current stage and the runtime of each stage of a pipeline.
+
+    Parameters
+    ----------
+    stages : list[str], optional
+        All stages of the pipeline in order, used to calculate the progress,
+        by default the stages of the prediction pipeline
+    """
+
+    def __init__(self, stages: Optional[list[str]] = None) -> None:
+        self.stages = stages or PREDICTION_STAGES
+        self.created_at = time.perf_counter()
+        self.current_stage: Optional[str] = None
+        self.records: dict[str, Stage] = {}
+
+    @contextmanager
+    def stage(self, name: str, started_at: Optional[float] = None) -> Iterator[Stage]:
+        """Context manager that times a stage of the pipeline.
+
+        The stage is yielded, so the number of rows can be set on it. When a stage
+        is timed more than once, e.g. partly in the request and partly in the
+        worker pool, the runtimes are added up.
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage
+        started_at : Optional[float], optional
+            `time.perf_counter` timestamp at which the stage started, for stages
+            that started before the context manager, by default now
+        """
+        self.current_stage = name
+        record = Stage(name)
+        start = time.perf_counter() if started_at is None else started_at
+        try:
+            yield record
+        finally:
+            record.duration = time.perf_counter() - start
+            previous = self.records.get(name)
+            if previous is not None:
+                record.duration += previous.duration
+                if record.rows is None:
+                    record.rows = previous.rows
+            self.records[name] = record
+            logger.debug(f"Stage {name} took {record.duration:.3f}s")
+
+    def add(self, name: str, duration: float, rows: Optional[int] = None) -> None:
+        """Add a stage that was timed outside of the timer."""
+        self.records[name] = Stage(name, duration, rows)
+
+    @property
+    def timings(self) -> dict[str, float]:
+        """Runtime in seconds per finished stage."""
+        return {name: record.duration for name, record in self.records.items()}
+
+    @property
+    def total(self) -> float:
+        """Total runtime in seconds of the finished stages."""
+        return sum(record.duration for record in self.records.values())
+
+    @property
+    def rows(self) -> dict[str, Optional[int]]:
+        """Number of rows per finished stage."""
+        return {name: record.rows for name, record in self.records.items()}
+
+    @property
+    def progress(self) -> float:
+        """Fraction of the stages that is finished."""
+        return len(set(self.records).intersection(self.stages)) / len(self.stages)
@@ -39,6 +39,20 @@ class DashboardConfig(BaseModel):
     prediction_threshold: float = 0.1
 
 
+class ApiConfig(BaseModel):
+    """API configuration, contains how many prediction requests can run at the same
+    time, how many requests can wait in the queue, after how many seconds a
+    prediction request times out, whether the history features are calculated
+    from the stored state of the patients and whether delta payloads are merged
+    with the stored appointment history."""
+
+    max_concurrent_predictions: int = 1
+    max_queued_predictions: int = 4
+    prediction_timeout: float = 1800
+    incremental_features: bool = False
+    delta_payloads: bool = False
+
+
 class ClinicConfig(BaseModel):
     """Clinic configuration, used for clinic-specific information and
     filtering of appointments."""
@@ -60,6 +74,7 @@ class ProjectConfig(BaseModel):
     feature_building: FeatureBuildingConfig
     dashboard: DashboardConfig
     clinic: Dict[str, ClinicConfig]
+    api: ApiConfig = ApiConfig()
 
 
 def load_config(config_path: Path) -> ProjectConfig:
@@ -140,3 +155,5 @@ MINUTES_EARLY_CUTOFF = project_config.feature_building.minutes_early_cutoff
 APPOINTMENTS_LAST_DAYS = project_config.feature_building.appointments_last_days
 
 CLINIC_CONFIG = project_config.clinic
+
+API_CONFIG = project_config.api
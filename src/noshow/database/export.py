@@ -1,30 +1,166 @@
 # Module to export data from dataplatform to a csv file to train the model
 # uses the export query in data/sql/data_export.sql
 import csv
+import hashlib
+import json
 import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import Callable, Optional, Sequence
 
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from dotenv import load_dotenv
 from rich.console import Console
-from sqlalchemy import text
+from sqlalchemy import CursorResult, Engine, text
+from sqlalchemy.exc import SQLAlchemyError
 
 from noshow.config import setup_root_logger
 from noshow.database.connection import get_connection_string, get_engine
+from noshow.preprocessing.load_data import (
+    compare_appointment_dataset,
+    convert_appointment_parquet,
+    merge_appointment_dataset,
+)
+from noshow.preprocessing.schema import APPOINTMENT_ARROW_SCHEMA
 
 logger = logging.getLogger(__name__)
 console = Console()
 
 
+def rows_to_record_batch(rows: Sequence[Sequence], schema: pa.Schema) -> pa.RecordBatch:
+    """Convert rows of a query result to an Arrow RecordBatch
+
+    Every column is converted to an Arrow array and cast to the type in `schema`,
+    so for example numeric ids become strings and postal codes integers.
+
+    Parameters
+    ----------
+    rows : Sequence[Sequence]
+        The rows, with the columns in the order of `schema`
+    schema : pa.Schema
+        The schema of the rows
+
+    Returns
+    -------
+    pa.RecordBatch
+        The rows as RecordBatch
+    """
+    columns = list(zip(*rows, strict=True)) if rows else [()] * len(schema)
+    return pa.RecordBatch.from_arrays(
+        [
+            pa.array(column, from_pandas=True).cast(field.type)
+            for column, field in zip(columns, schema, strict=True)
+        ],
+        schema=schema,
+    )
+
+
+def export_schema(columns: Sequence[str]) -> pa.Schema:
+    """Return the schema of the exported columns
+
+    Columns of the training export get the type in `APPOINTMENT_ARROW_SCHEMA`,
+    other columns are exported as strings.
+    """
+    return pa.schema(
+        [
+            APPOINTMENT_ARROW_SCHEMA.field(column)
+            if column in APPOINTMENT_ARROW_SCHEMA.names
+            else pa.field(column, pa.string())
+            for column in columns
+        ]
+    )
+
+
+def write_parquet(
+    result: CursorResult,
+    output_path: Path,
+    batch_size: int = 10_000,
+    row_group_size: int = 100_000,
+    progress: Optional[Callable[[int, float], None]] = None,
+    compression: str = "zstd",
+) -> int:
+    """Write a query result to a Parquet file in batches
+
+    Rows are fetched per `batch_size` and converted to Arrow with the schema of
+    `export_schema`. The batches are buffered until a row group of
+    `row_group_size` rows is complete, so memory use does not depend on the size
+    of the result.
+
+    Parameters
+    ----------
+    result : CursorResult
+        The (streamed) query result
+    output_path : Path
+        Path of the Parquet file
+    batch_size : int, optional
+        Number of rows fetched at once, by default 10 000
+    row_group_size : int, optional
+        Number of rows per row group, by default 100 000
+    progress : Optional[Callable[[int, float], None]], optional
+        Called after every batch with the number of rows written so far and the
+        rows per second, by default None
+    compression : str, optional
+        Compression of the Parquet file, by default "zstd"
+
+    Returns
+    -------
+    int
+        The number of exported rows
+    """
+    schema = export_schema(list(result.keys()))
+    n_rows, buffer, buffered_rows = 0, [], 0
+    start_time = time.perf_counter()
+    with pq.ParquetWriter(output_path, schema, compression=compression) as writer:
+        while rows := result.fetchmany(batch_size):
+            buffer.append(rows_to_record_batch(rows, schema))
+            buffered_rows += len(rows)
+            n_rows += len(rows)
+            if buffered_rows >= row_group_size:
+                writer.write_table(pa.Table.from_batches(buffer, schema=schema))
+                buffer, buffered_rows = [], 0
+            if progress is not None:
+                progress(n_rows, n_rows / (time.perf_counter() - start_time))
+        if buffer:
+            writer.write_table(pa.Table.from_batches(buffer, schema=schema))
+    return n_rows
+
+
+def write_csv(result: CursorResult, output_path: Path, batch_size: int = 10_000):
+    """Write a query result to a csv file in batches"""
+    with output_path.open("w", newline="") as csvfile:
+        writer = csv.writer(csvfile)
+
+        # Write the header row
+        writer.writerow(result.keys())
+
+        # Write data in batches
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            writer.writerows(rows)
+
+
 def export_data(
     db_host: str = "dataplatform",
     db_database: str = "PUB",
-    output_path: str = "poliafspraken_no_show.csv",
+    output_path: Optional[str] = None,
     batch_size: int = 10_000,
-):
+    output_format: str = "csv",
+    progress: Optional[Callable[[int, float], None]] = None,
+) -> Path:
     """Function to efficiently export data from the dataplatform to a csv file
 
     Used to export data to train the model. The data is exported in batches to
-    avoid memory issues.
+    avoid memory issues. With `output_format="parquet"` every batch is converted
+    to Arrow with the types of `APPOINTMENT_ARROW_SCHEMA` and written to a zstd
+    compressed Parquet file, see `write_parquet`.
 
     Parameters
     ----------
@@ -32,19 +168,33 @@ def export_data(
         hostname of the database server, by default "dataplatform"
     db_database : str, optional
         Name of the database, by default "PUB"
-    output_path : str, optional
+    output_path : Optional[str], optional
         Name of the output file, located in the data/raw folder,
-        by default "poliafspraken_no_show.csv"
+        by default "poliafspraken_no_show.csv" or "poliafspraken_no_show.parquet"
     batch_size : int, optional
         batch size for reading from query result and writing to csv, by default 1000
+    output_format : str, optional
+        Either "csv" or "parquet", by default "csv"
+    progress : Optional[Callable[[int, float], None]], optional
+        Called with the number of exported rows and the rows per second during a
+        Parquet export, by default the progress is shown in the console status
+
+    Returns
+    -------
+    Path
+        The path of the exported file
     """
+    if output_format not in ("csv", "parquet"):
+        raise ValueError("output_format should be either 'csv' or 'parquet'")
+    if output_path is None:
+        output_path = f"poliafspraken_no_show.{output_format}"
     connection_string, _ = get_connection_string(
         db_database=db_database, db_host=db_host
     )
     with (Path(__file__).parents[3] / "data/sql/data_export.sql").open("r") as f:
         sql_query = f.read()
 
-    output_csv = Path(__file__).parents[3] / "data/raw" / output_path
+    output_file = Path(__file__).parents[3] / "data/raw" / output_path
 
     db_engine = get_engine(connection_string)
     with db_engine.connect() as conn:
@@ -55,21 +205,471 @@ def export_data(
             )
         logger.info("Export query executed successfully")
 
-        with console.status("[bold green]Exporting data to CSV..."):
-            with output_csv.open("w", newline="") as csvfile:
-                writer = csv.writer(csvfile)
+        if output_format == "csv":
+            with console.status("[bold green]Exporting data to CSV..."):
+                write_csv(result, output_file, batch_size)
+        else:
+            with console.status("[bold green]Exporting data to Parquet...") as status:
+
+                def show_progress(n_rows: int, rows_per_second: float) -> None:
+                    status.update(
+                        "[bold green]Exporting data to Parquet... "
+                        f"{n_rows:,} rows ({rows_per_second:,.0f} rows/s)"
+                    )
+
+                n_rows = write_parquet(
+                    result, output_file, batch_size, progress=progress or show_progress
+                )
+            logger.info(f"Exported {n_rows} rows")
+
+    logger.info(f"Data exported to {output_file}")
+    return output_file
+
+
+MANIFEST_FILE = "_manifest.json"
+
+
+def filter_query(sql_query: str, condition: str) -> str:
+    """Wrap the export query in a subquery with a condition on its columns
+
+    The ORDER BY at the end of the query is removed since it is not allowed in a
+    subquery.
+    """
+    sql_query = re.sub(r"\bORDER\s+BY\b[^)]*$", "", sql_query.strip(), flags=re.I)
+    return f"SELECT * FROM (\n{sql_query}\n) AS export\nWHERE {condition}"
+
+
+def partition_query(sql_query: str) -> str:
+    """Restrict the export query to appointments that start in a date range
+
+    The range is given by the parameters `:start` and `:end`, see `filter_query`.
+    """
+    return filter_query(sql_query, "[start] >= :start AND [start] < :end")
+
+
+def date_partitions(
+    start_date: str, end_date: str, freq: str = "QS"
+) -> list[tuple[pd.Timestamp, pd.Timestamp]]:
+    """Split a date range in consecutive partitions
+
+    Parameters
+    ----------
+    start_date : str
+        Start of the first partition
+    end_date : str
+        End (exclusive) of the last partition
+    freq : str, optional
+        Pandas frequency of the partition bounds, by default "QS" (quarters)
+
+    Returns
+    -------
+    list[tuple[pd.Timestamp, pd.Timestamp]]
+        The start and end of every partition
+    """
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    bounds = pd.date_range(start, end, freq=freq, inclusive="neither")
+    edges = [start, *bounds, end]
+    return list(zip(edges[:-1], edges[1:], strict=True))
+
+
+def _write_json(path: Path, content: dict) -> None:
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(content, indent=2))
+    tmp_path.replace(path)
+
+
+def _export_partition(
+    engine: Engine,
+    sql_query: str,
+    start: pd.Timestamp,
+    end: pd.Timestamp,
+    output_path: Path,
+    batch_size: int,
+    retries: int,
+    retry_delay: float,
+) -> dict:
+    """Export a single partition to Parquet, retrying on database errors"""
+    # Files starting with a dot are not read as part of the dataset
+    tmp_path = output_path.with_name(f".{output_path.name}")
+    for attempt in range(1, retries + 1):
+        start_time = time.perf_counter()
+        try:
+            with engine.connect() as conn:
+                result = conn.execution_options(stream_results=True).execute(
+                    text(sql_query),
+                    {"start": start.to_pydatetime(), "end": end.to_pydatetime()},
+                )
+                n_rows = write_parquet(result, tmp_path, batch_size)
+        except (SQLAlchemyError, OSError) as e:
+            logger.warning(
+                f"Export of {output_path.name} failed (attempt {attempt}/{retries}): "
+                f"{e}"
+            )
+            tmp_path.unlink(missing_ok=True)
+            if attempt == retries:
+                raise
+            time.sleep(retry_delay * 2 ** (attempt - 1))
+            continue
+        tmp_path.replace(output_path)
+        seconds = time.perf_counter() - start_time
+        logger.info(
+            f"Exported {n_rows} rows to {output_path.name} in {seconds:.1f}s "
+            f"({n_rows / seconds:,.0f} rows/s)"
+        )
+        return {
+            "file": output_path.name,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "rows": n_rows,
+            "seconds": round(seconds, 2),
+            "attempts": attempt,
+        }
+    raise ValueError("retries should be at least 1")
+
+
+def export_partitions(
+    engine: Engine,
+    sql_query: str,
+    output_dir: Path,
+    partitions: list[tuple[pd.Timestamp, pd.Timestamp]],
+    max_workers: int = 4,
+    retries: int = 3,
+    retry_delay: float = 5.0,
+    batch_size: int = 10_000,
+    resume: bool = True,
+) -> dict:
+    """Export the partitions of a query concurrently to separate Parquet files
+
+    Every partition is fetched over its own connection from the pool of `engine`
+    and written to `part-<start>.parquet` in `output_dir`. A failed partition is
+    retried with exponential backoff. The manifest `_manifest.json` records the
+    row count of every finished partition, so an interrupted export of the same
+    query and partitions is resumed by only exporting the missing partitions.
+
+    Parameters
+    ----------
+    engine : Engine
+        The database engine, its pool needs at least `max_workers` connections
+    sql_query : str
+        The export query, see `partition_query`
+    output_dir : Path
+        Folder of the Parquet files and the manifest
+    partitions : list[tuple[pd.Timestamp, pd.Timestamp]]
+        The start and end of every partition, see `date_partitions`
+    max_workers : int, optional
+        Number of partitions that are exported at the same time, by default 4
+    retries : int, optional
+        Number of attempts per partition, by default 3
+    retry_delay : float, optional
+        Seconds to wait before the first retry, doubled every retry, by default 5
+    batch_size : int, optional
+        Number of rows fetched at once, by default 10 000
+    resume : bool, optional
+        Skip the partitions that are already in the manifest, by default True
+
+    Returns
+    -------
+    dict
+        The manifest
+
+    Raises
+    ------
+    RuntimeError
+        If partitions still fail after all retries, the finished partitions are
+        kept in the manifest
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = output_dir / MANIFEST_FILE
+    query = partition_query(sql_query)
+    query_hash = hashlib.sha256(query.encode()).hexdigest()
+    bounds = [[start.isoformat(), end.isoformat()] for start, end in partitions]
+
+    manifest = None
+    if resume and manifest_path.exists():
+        manifest = json.loads(manifest_path.read_text())
+        if manifest["query_hash"] != query_hash or manifest["bounds"] != bounds:
+            logger.info("Export query or partitions changed, not resuming")
+            manifest = None
+    if manifest is None:
+        for part in output_dir.glob("*part-*.parquet"):
+            part.unlink()
+        manifest = {"query_hash": query_hash, "bounds": bounds, "partitions": {}}
+        _write_json(manifest_path, manifest)
+
+    todo = [
+        (start, end)
+        for start, end in partitions
+        if f"part-{start:%Y%m%d}.parquet" not in manifest["partitions"]
+        or not (output_dir / f"part-{start:%Y%m%d}.parquet").exists()
+    ]
+    logger.info(f"Exporting {len(todo)} of {len(partitions)} partitions")
 
-                # Write the header row
-                writer.writerow(result.keys())
+    lock = threading.Lock()
+    failed = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                _export_partition,
+                engine,
+                query,
+                start,
+                end,
+                output_dir / f"part-{start:%Y%m%d}.parquet",
+                batch_size,
+                retries,
+                retry_delay,
+            ): start
+            for start, end in todo
+        }
+        for future in as_completed(futures):
+            try:
+                record = future.result()
+            except (SQLAlchemyError, OSError):
+                failed.append(f"part-{futures[future]:%Y%m%d}")
+                continue
+            with lock:
+                manifest["partitions"][record["file"]] = record
+                _write_json(manifest_path, manifest)
 
-                # Write data in batches
-                while True:
-                    rows = result.fetchmany(batch_size)
-                    if not rows:
-                        break
-                    writer.writerows(rows)
+    if failed:
+        raise RuntimeError(
+            f"Export of {sorted(failed)} failed, rerun the export to resume"
+        )
+    n_rows = sum(record["rows"] for record in manifest["partitions"].values())
+    logger.info(f"Exported {n_rows} rows in {len(partitions)} partitions")
+    return manifest
 
-    logger.info(f"Data exported to {output_csv}")
+
+def export_data_partitioned(
+    db_host: str = "dataplatform",
+    db_database: str = "PUB",
+    output_path: str = "poliafspraken_no_show_parts",
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    freq: str = "QS",
+    max_workers: int = 4,
+    retries: int = 3,
+    batch_size: int = 10_000,
+) -> Path:
+    """Export the training data in date partitions over multiple connections
+
+    Alternative to `export_data` that splits the export query on the start of
+    the appointments and exports the partitions concurrently, see
+    `export_partitions`. Rerunning a failed export on the same day resumes it.
+
+    Parameters
+    ----------
+    db_host : str, optional
+        hostname of the database server, by default "dataplatform"
+    db_database : str, optional
+        Name of the database, by default "PUB"
+    output_path : str, optional
+        Name of the output folder, located in the data/raw folder,
+        by default "poliafspraken_no_show_parts"
+    start_date : Optional[str], optional
+        Start of the first partition, by default 8 years ago like the query
+    end_date : Optional[str], optional
+        End of the last partition, by default tomorrow
+    freq : str, optional
+        Pandas frequency of the partitions, by default "QS" (quarters)
+    max_workers : int, optional
+        Number of concurrent connections, by default 4
+    retries : int, optional
+        Number of attempts per partition, by default 3
+    batch_size : int, optional
+        Number of rows fetched at once, by default 10 000
+
+    Returns
+    -------
+    Path
+        The folder with the Parquet files of the partitions
+    """
+    today = pd.Timestamp.today().normalize()
+    start_date = start_date or str((today - pd.DateOffset(years=8)).date())
+    end_date = end_date or str((today + pd.Timedelta(days=1)).date())
+
+    connection_string, _ = get_connection_string(
+        db_database=db_database, db_host=db_host
+    )
+    with (Path(__file__).parents[3] / "data/sql/data_export.sql").open("r") as f:
+        sql_query = f.read()
+    output_dir = Path(__file__).parents[3] / "data/raw" / output_path
+
+    export_partitions(
+        get_engine(connection_string),
+        sql_query,
+        output_dir,
+        date_partitions(start_date, end_date, freq),
+        max_workers=max_workers,
+        retries=retries,
+        batch_size=batch_size,
+    )
+    logger.info(f"Data exported to {output_dir}")
+    return output_dir
+
+
+EXPORT_STATE_FILE = "_export_state.json"
+
+
+def export_incremental(
+    engine: Engine,
+    sql_query: str,
+    dataset_path: Path,
+    lookback_days: int = 14,
+    full_refresh_days: int = 28,
+    full_refresh: bool = False,
+    batch_size: int = 10_000,
+) -> dict:
+    """Update the Parquet dataset with the appointments that changed since the
+    last export
+
+    Appointments enter the export when their planned end has passed, and are
+    sometimes mutated in the days after. The export state keeps a watermark,
+    the latest `end` that was exported. Only the appointments that end after the
+    watermark minus `lookback_days` are exported and merged into the dataset with
+    `merge_appointment_dataset`, which deduplicates on `APP_ID`.
+
+    Every `full_refresh_days` (or when there is no state yet) the full history is
+    exported instead. The dataset is compared with the full export using
+    `compare_appointment_dataset` and then replaced, the differences are logged
+    and stored in the state.
+
+    Parameters
+    ----------
+    engine : Engine
+        The database engine
+    sql_query : str
+        The export query
+    dataset_path : Path
+        The folder of the Parquet dataset, the state is stored in
+        `_export_state.json` in this folder
+    lookback_days : int, optional
+        Appointments that end this many days before the watermark are exported
+        again, by default 14
+    full_refresh_days : int, optional
+        Days after which the full history is exported again, by default 28
+    full_refresh : bool, optional
+        Export the full history regardless of the state, by default False
+    batch_size : int, optional
+        Number of rows fetched at once, by default 10 000
+
+    Returns
+    -------
+    dict
+        The new export state
+    """
+    state_path = dataset_path / EXPORT_STATE_FILE
+    state = json.loads(state_path.read_text()) if state_path.exists() else None
+    now = pd.Timestamp.now()
+    full_refresh = (
+        full_refresh
+        or state is None
+        or now - pd.Timestamp(state["last_full_refresh"])
+        >= pd.Timedelta(days=full_refresh_days)
+    )
+
+    dataset_path.mkdir(parents=True, exist_ok=True)
+    export_path = dataset_path / ".export.parquet"
+    with engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True)
+        if full_refresh:
+            result = conn.execute(text(sql_query))
+        else:
+            since = pd.Timestamp(state["watermark"]) - pd.Timedelta(days=lookback_days)
+            result = conn.execute(
+                text(filter_query(sql_query, "[end] >= :since")),
+                {"since": since.to_pydatetime()},
+            )
+        n_rows = write_parquet(result, export_path, batch_size)
+
+    watermark = pc.max(pq.read_table(export_path, columns=["end"])["end"]).as_py()
+    new_state = {
+        "watermark": str(watermark or (state or {}).get("watermark") or now),
+        "last_full_refresh": (str(now) if full_refresh else state["last_full_refresh"]),
+        "last_export": str(now),
+        "full_refresh": full_refresh,
+        "rows": n_rows,
+    }
+    if full_refresh:
+        if state is not None:
+            new_state["differences"] = compare_appointment_dataset(
+                dataset_path, pq.read_table(export_path)
+            )
+            logger.info(
+                f"Full refresh, differences with the dataset: "
+                f"{new_state['differences']}"
+            )
+        convert_appointment_parquet(export_path, dataset_path)
+    else:
+        n_new, n_updated = merge_appointment_dataset(
+            dataset_path, pq.read_table(export_path)
+        )
+        new_state["new"], new_state["updated"] = n_new, n_updated
+        logger.info(
+            f"Merged {n_rows} rows since {since}: {n_new} new and "
+            f"{n_updated} updated appointments"
+        )
+    export_path.unlink()
+
+    _write_json(state_path, new_state)
+    return new_state
+
+
+def export_data_incremental(
+    db_host: str = "dataplatform",
+    db_database: str = "PUB",
+    dataset_path: str = "poliafspraken_no_show",
+    lookback_days: int = 14,
+    full_refresh_days: int = 28,
+    full_refresh: bool = False,
+    batch_size: int = 10_000,
+) -> Path:
+    """Export the training data incrementally into the Parquet dataset
+
+    See `export_incremental`.
+
+    Parameters
+    ----------
+    db_host : str, optional
+        hostname of the database server, by default "dataplatform"
+    db_database : str, optional
+        Name of the database, by default "PUB"
+    dataset_path : str, optional
+        Name of the Parquet dataset, located in the data/raw folder,
+        by default "poliafspraken_no_show"
+    lookback_days : int, optional
+        Appointments that end this many days before the watermark are exported
+        again, by default 14
+    full_refresh_days : int, optional
+        Days after which the full history is exported again, by default 28
+    full_refresh : bool, optional
+        Export the full history regardless of the state, by default False
+    batch_size : int, optional
+        Number of rows fetched at once, by default 10 000
+
+    Returns
+    -------
+    Path
+        The folder of the Parquet dataset
+    """
+    connection_string, _ = get_connection_string(
+        db_database=db_database, db_host=db_host
+    )
+    with (Path(__file__).parents[3] / "data/sql/data_export.sql").open("r") as f:
+        sql_query = f.read()
+    output_dir = Path(__file__).parents[3] / "data/raw" / dataset_path
+
+    export_incremental(
+        get_engine(connection_string),
+        sql_query,
+        output_dir,
+        lookback_days=lookback_days,
+        full_refresh_days=full_refresh_days,
+        full_refresh=full_refresh,
+        batch_size=batch_size,
+    )
+    logger.info(f"Data exported to {output_dir}")
+    return output_dir
 
 
 if __name__ == "__main__":
@@ -41,6 +41,11 @@ class ApiRequest(Base):
         Execution/runtime of the request in seconds.
     api_version : str
         Version of the API used for the request.
+    model_version : str | None
+        Content hash of the model file that served the request, optional.
+    history_watermark : datetime | None
+        Set when the request updated the appointment history, a delta payload
+        contains the appointments that changed since this watermark, optional.
     """
 
     __tablename__ = "apirequest"
@@ -53,6 +58,122 @@ class ApiRequest(Base):
     endpoint: Mapped[str]
     runtime: Mapped[float]
     api_version: Mapped[str]
+    model_version: Mapped[str] = mapped_column(String(64), nullable=True, default=None)
+    history_watermark: Mapped[datetime] = mapped_column(
+        DateTime, nullable=True, default=None
+    )
+
+
+class ApiRequestStage(Base):
+    """ORM model for the runtime of a stage of an API request in
+    noshow.apirequeststage.
+
+    Attributes
+    ----------
+    id : int
+        Primary key for the stage record.
+    request_id : int
+        Foreign key referencing the ApiRequest the stage belongs to.
+    stage : str
+        Name of the stage of the prediction pipeline (e.g. predict_proba).
+    duration : float
+        Runtime of the stage in seconds.
+    rows : int | None
+        Number of rows the stage produced, optional.
+    """
+
+    __tablename__ = "apirequeststage"
+    __table_args__ = {"schema": "noshow"}
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True, init=False)
+    request_id: Mapped[int] = mapped_column(ForeignKey(ApiRequest.id), index=True)
+    stage: Mapped[str] = mapped_column(String(64))
+    duration: Mapped[float] = mapped_column(Float)
+    rows: Mapped[int] = mapped_column(Integer, nullable=True, default=None)
+
+
+class ApiPatientState(Base):
+    """ORM model for the running totals of the appointment history of a patient
+    stored in noshow.apipatientstate.
+
+    Attributes
+    ----------
+    pseudo_id : str
+        Primary key, the pseudonymized patient identifier (up to 64 characters).
+    watermark : datetime
+        The state contains all appointments that start on or before this time.
+    n_appointments : int
+        Number of appointments up to the watermark.
+    n_no_show : int
+        Number of no-shows up to the watermark.
+    minutes_early_sum : float
+        Sum of the minutes early of the appointments up to the watermark.
+    last_start : datetime | None
+        Start of the last appointment up to the watermark, optional.
+    """
+
+    __tablename__ = "apipatientstate"
+    __table_args__ = {"schema": "noshow"}
+
+    pseudo_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    watermark: Mapped[datetime] = mapped_column(DateTime)
+    n_appointments: Mapped[int] = mapped_column(Integer)
+    n_no_show: Mapped[int] = mapped_column(Integer)
+    minutes_early_sum: Mapped[float] = mapped_column(Float)
+    last_start: Mapped[datetime] = mapped_column(DateTime, nullable=True, default=None)
+
+
+class ApiAppointment(Base):
+    """ORM model for the appointment history of the API stored in
+    noshow.apiappointment, used to merge delta payloads with.
+
+    Contains the fields of the Appointment pydantic model without the sensitive
+    information of the patient.
+
+    Attributes
+    ----------
+    APP_ID : str
+        Primary key, the appointment identifier.
+    pseudo_id : str
+        The pseudonymized patient identifier (up to 64 characters).
+    start : datetime
+        Scheduled start time of the appointment (UTC).
+    end : datetime
+        Scheduled end time of the appointment (UTC).
+    gearriveerd : datetime | None
+        Time the patient arrived (UTC), optional.
+    created : datetime
+        Time the appointment was created (UTC).
+
+    The other attributes are the same as in the Appointment pydantic model.
+    """
+
+    __tablename__ = "apiappointment"
+    __table_args__ = {"schema": "noshow"}
+
+    APP_ID: Mapped[str] = mapped_column(String(50), primary_key=True)
+    pseudo_id: Mapped[str] = mapped_column(String(64), index=True)
+    hoofdagenda: Mapped[str]
+    hoofdagenda_id: Mapped[str]
+    subagenda_id: Mapped[str]
+    specialty_code: Mapped[str] = mapped_column(String, nullable=True)
+    soort_consult: Mapped[str] = mapped_column(String, nullable=True)
+    afspraak_code: Mapped[str]
+    start: Mapped[datetime] = mapped_column(DateTime)
+    end: Mapped[datetime] = mapped_column(DateTime)
+    gearriveerd: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    created: Mapped[datetime] = mapped_column(DateTime)
+    minutesDuration: Mapped[int]  # noqa: N815
+    status: Mapped[str] = mapped_column(String, nullable=True)
+    status_code_original: Mapped[str] = mapped_column(String, nullable=True)
+    mutationReason_code: Mapped[str] = mapped_column(String, nullable=True)  # noqa: N815
+    mutationReason_display: Mapped[str] = mapped_column(String, nullable=True)  # noqa: N815
+    BIRTH_YEAR: Mapped[int]
+    address_postalCodeNumbersNL: Mapped[int] = mapped_column(  # noqa: N815
+        Integer, nullable=True
+    )
+    name: Mapped[str] = mapped_column(String, nullable=True)
+    description: Mapped[str] = mapped_column(String, nullable=True)
 
 
 class ApiPatient(Base):
@@ -1,7 +1,25 @@
+from typing import Optional
+
 import numpy as np
 import pandas as pd
 
-from noshow.features.cumulative_features import calc_cumulative_features
+from noshow.features.cumulative_features import (
+    CumulativeFeature,
+    calc_history_features,
+)
+
+PREV_MINUTES_EARLY_FEATURE = CumulativeFeature("minutes_early", "prev_minutes_early")
+
+
+def appointments_last_days_feature(days: int = 14) -> CumulativeFeature:
+    """Return the definition of the `appointments_last_days` feature"""
+    return CumulativeFeature(
+        "APP_ID",
+        "appointments_last_days",
+        window=f"{days}D",
+        cumfunc="count",
+        exclude_window=False,
+    )
 
 
 def add_days_since_created(appointments_df: pd.DataFrame) -> pd.DataFrame:
@@ -37,7 +55,9 @@ def add_days_since_created(appointments_df: pd.DataFrame) -> pd.DataFrame:
     return appointments_df
 
 
-def add_days_since_last_appointment(appointments_df: pd.DataFrame) -> pd.DataFrame:
+def add_days_since_last_appointment(
+    appointments_df: pd.DataFrame, last_start: Optional[pd.Series] = None
+) -> pd.DataFrame:
     """Add the amount of days since the last appointment
 
     Note that the last appointment can also be an appointment that hasn't happened
@@ -49,6 +69,10 @@ def add_days_since_last_appointment(appointments_df: pd.DataFrame) -> pd.DataFra
     appointments_df : pd.DataFrame
         The dataframe with appointent information, needs to contain a `start`
         and `pseudo_id` index
+    last_start : Optional[pd.Series], optional
+        Start of the last appointment per `pseudo_id` before the appointments in
+        `appointments_df`, used for the first appointment of a patient,
+        by default None
 
     Returns
     -------
@@ -57,9 +81,27 @@ def add_days_since_last_appointment(appointments_df: pd.DataFrame) -> pd.DataFra
     """
     appointments_df = appointments_df.sort_index(level="start")
     appointments_df["start_time"] = appointments_df.index.get_level_values("start")
+    days_since_last_appointment = (
+        appointments_df.groupby(level="pseudo_id", observed=True)["start_time"]
+        .diff()
+        .dt.days
+    )
+    if last_start is not None:
+        previous_start = last_start.reindex(
+            appointments_df.index.get_level_values("pseudo_id")
+        )
+        days_since_last_appointment = days_since_last_appointment.fillna(
+            pd.Series(
+                (
+                    appointments_df["start_time"].to_numpy()
+                    - pd.to_datetime(previous_start).to_numpy()
+                ),
+                index=appointments_df.index,
+            ).dt.days
+        )
     appointments_df["days_since_last_appointment"] = (
-        appointments_df.groupby(level="pseudo_id")["start_time"].diff().dt.days
-    ).replace(np.nan, 0)
+        days_since_last_appointment.replace(np.nan, 0)
+    )
     appointments_df = appointments_df.drop(columns="start_time")
     return appointments_df
 
@@ -86,17 +128,10 @@ def add_appointments_last_days(
     pd.DataFrame
         The input dataframe with an added column `appointments_last_days`
     """
-    appointments_df = appointments_df.sort_index(level="start")
-    appointments_df["appointments_last_days"] = (
-        appointments_df.reset_index()
-        .set_index("start")
-        .groupby("pseudo_id")["APP_ID"]
-        .rolling(f"{days}D")
-        .count()
+    return calc_history_features(
+        appointments_df, [appointments_last_days_feature(days)]
     )
 
-    return appointments_df
-
 
 def add_appointments_same_day(appointments_df: pd.DataFrame) -> pd.DataFrame:
     """Add the number of appointments on the same day
@@ -115,12 +150,42 @@ def add_appointments_same_day(appointments_df: pd.DataFrame) -> pd.DataFrame:
     appointment_date = appointments_df.index.get_level_values("start").date  # type: ignore
     appointment_pseudo_id = appointments_df.index.get_level_values("pseudo_id")
     appointments_df["appointments_same_day"] = appointments_df.groupby(
-        [appointment_pseudo_id, appointment_date]
+        [appointment_pseudo_id, appointment_date], observed=True
     )["APP_ID"].transform("count")
 
     return appointments_df
 
 
+def calc_minutes_early(appointments_df: pd.DataFrame, cutoff: int = 60) -> pd.DataFrame:
+    """Add the column `minutes_early`, clipped to [-`cutoff`, `cutoff`]"""
+    appointments_df["minutes_early"] = (
+        appointments_df.index.get_level_values(level="start")
+        - appointments_df["gearriveerd"]
+    ).dt.total_seconds() / 60  # type: ignore
+
+    appointments_df.loc[appointments_df["gearriveerd"].isna(), "minutes_early"] = 0
+    appointments_df.loc[appointments_df["minutes_early"] > cutoff, "minutes_early"] = (
+        cutoff
+    )
+    appointments_df.loc[
+        appointments_df["minutes_early"] < -cutoff, "minutes_early"
+    ] = -cutoff
+    return appointments_df
+
+
+def average_prev_minutes_early(appointments_df: pd.DataFrame) -> pd.DataFrame:
+    """Divide the cumulative `prev_minutes_early` by the earlier appointments"""
+    appointments_df["prev_minutes_early"] = (
+        appointments_df["prev_minutes_early"] / appointments_df["earlier_appointments"]
+    )
+
+    appointments_df["prev_minutes_early"] = appointments_df[
+        "prev_minutes_early"
+    ].replace([np.inf, -np.inf, np.nan], 0)
+
+    return appointments_df
+
+
 def add_minutes_early(appointments_df: pd.DataFrame, cutoff: int = 60) -> pd.DataFrame:
     """Add the number of minutes a patient was early
 
@@ -144,31 +209,11 @@ def add_minutes_early(appointments_df: pd.DataFrame, cutoff: int = 60) -> pd.Dat
         Note: Only use `prev_minutes_early` in model,
         since `minutes_early` will leak data!
     """
-    appointments_df["minutes_early"] = (
-        appointments_df.index.get_level_values(level="start")
-        - appointments_df["gearriveerd"]
-    ).dt.total_seconds() / 60  # type: ignore
-
-    appointments_df.loc[appointments_df["gearriveerd"].isna(), "minutes_early"] = 0
-    appointments_df.loc[appointments_df["minutes_early"] > cutoff, "minutes_early"] = (
-        cutoff
+    appointments_df = calc_minutes_early(appointments_df, cutoff)
+    appointments_df = calc_history_features(
+        appointments_df, [PREV_MINUTES_EARLY_FEATURE]
     )
-    appointments_df.loc[
-        appointments_df["minutes_early"] < -cutoff, "minutes_early"
-    ] = -cutoff
-
-    appointments_df = calc_cumulative_features(
-        appointments_df, "minutes_early", "prev_minutes_early"
-    )
-    appointments_df["prev_minutes_early"] = (
-        appointments_df["prev_minutes_early"] / appointments_df["earlier_appointments"]
-    )
-
-    appointments_df["prev_minutes_early"] = appointments_df[
-        "prev_minutes_early"
-    ].replace([np.inf, -np.inf, np.nan], 0)
-
-    return appointments_df
+    return average_prev_minutes_early(appointments_df)
 
 
 def add_time_features(appointments_df: pd.DataFrame) -> pd.DataFrame:
@@ -1,6 +1,210 @@
+from typing import NamedTuple, Optional
+
+import numpy as np
 import pandas as pd
 
 
+class CumulativeFeature(NamedTuple):
+    """Definition of a feature that is calculated over the history of a patient.
+
+    Attributes
+    ----------
+    column_name : str
+        The column name on which to base the feature.
+    feature_name : str
+        The column name for the newly created feature.
+    window : str
+        Time window that is excluded from the cumulative value, or the window to
+        aggregate over if `exclude_window` is False, by default "3D"
+    cumfunc : str
+        The cumulative function to use, either "sum" or "count", by default "sum"
+    exclude_window : bool
+        If True, the feature is the cumulative value of all earlier appointments
+        excluding the last `window`. If False, the feature is the value over the
+        last `window` (like pandas rolling), by default True
+    """
+
+    column_name: str
+    feature_name: str
+    window: str = "3D"
+    cumfunc: str = "sum"
+    exclude_window: bool = True
+
+
+def _window_starts(
+    codes: np.ndarray,
+    times: np.ndarray,
+    window: int,
+    rows: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Find the first row of the time window of every row
+
+    For every row i the start of the window is the first row j of the same patient
+    with `times[j] > times[i] - window`. The rows and the window bounds are merged
+    in a single sort, so this works for all patients at once.
+
+    Parameters
+    ----------
+    codes : np.ndarray
+        Sorted group codes of the patients
+    times : np.ndarray
+        Start times as int64, sorted within every group
+    window : int
+        Length of the window in the same unit as `times`
+    rows : Optional[np.ndarray], optional
+        Positions of the rows to find the window start of, by default all rows
+
+    Returns
+    -------
+    np.ndarray
+        The position of the first row of the window for every row in `rows`
+    """
+    if rows is None:
+        rows = np.arange(len(times))
+    n_rows = len(times)
+    is_bound = np.repeat(np.array([0, 1], dtype=np.int8), [n_rows, len(rows)])
+    merged_order = np.lexsort(
+        (
+            is_bound,
+            np.concatenate([times, times[rows] - window]),
+            np.concatenate([codes, codes[rows]]),
+        )
+    )
+    # Number of rows that are sorted before each window bound
+    rows_before = np.cumsum(is_bound[merged_order] == 0)
+    bound_positions = merged_order >= n_rows
+    starts = np.empty(len(rows), dtype=np.int64)
+    starts[merged_order[bound_positions] - n_rows] = rows_before[bound_positions]
+    return starts
+
+
+def _calc_feature(
+    values: pd.Series,
+    rows: np.ndarray,
+    group_starts: np.ndarray,
+    window_starts: np.ndarray,
+    feature: CumulativeFeature,
+) -> np.ndarray:
+    """Calculate a single cumulative feature at `rows` of the sorted values using
+    prefix sums."""
+    valid = values.notna().to_numpy()
+    # prefix[k] is the aggregate of the first k sorted rows
+    if feature.cumfunc == "sum":
+        summed = np.where(valid, values.to_numpy(dtype=np.float64, na_value=0), 0)
+        prefix = np.concatenate([[0.0], np.cumsum(summed)])
+    else:
+        prefix = np.concatenate([[0], np.cumsum(valid)])
+
+    in_window = prefix[rows + 1] - prefix[window_starts]
+    if not feature.exclude_window:
+        result = in_window.astype(np.float64)
+        if feature.cumfunc == "sum":
+            valid_prefix = np.concatenate([[0], np.cumsum(valid)])
+            no_values = valid_prefix[rows + 1] == valid_prefix[window_starts]
+            result[no_values] = np.nan
+        return result
+
+    if feature.cumfunc == "sum":
+        result = prefix[window_starts] - prefix[group_starts]
+        result[~valid[rows]] = np.nan
+        return result
+    return (rows - group_starts + 1 - in_window).astype(np.float64)
+
+
+def calc_history_features(
+    df: pd.DataFrame,
+    features: list[CumulativeFeature],
+    targets: Optional[np.ndarray] = None,
+) -> pd.DataFrame:
+    """Calculate multiple cumulative features in a single pass
+
+    The rows are sorted once on patient and start time, after which every feature
+    is calculated with prefix sums over contiguous arrays. The time windows are
+    found once per distinct window length, instead of a grouped rolling per feature.
+
+    When `targets` is given, all rows are still part of the prefix sums, but the
+    window bounds and features are only calculated for the target rows, and only
+    the target rows are returned.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The input dataframe, with an index on `pseudo_id` and `start`.
+    features : list[CumulativeFeature]
+        The features to calculate.
+    targets : Optional[np.ndarray], optional
+        Boolean mask of the rows of `df` to calculate the features for,
+        by default all rows
+
+    Returns
+    -------
+    pd.DataFrame
+        The input dataframe sorted on `start`, with added columns containing the
+        new features. With `targets`, only the target rows in the order of `df`.
+
+    Raises
+    ------
+    NotImplementedError
+        Raises a not implemented error in case the cumfunc of a feature is not sum
+        or count
+    """
+    for feature in features:
+        if feature.cumfunc not in ("sum", "count"):
+            raise NotImplementedError()
+
+    if targets is None:
+        df = df.sort_index(level="start")
+    codes, _ = pd.factorize(df.index.get_level_values("pseudo_id"))
+    # The windows are in nanoseconds, the index can have another unit
+    times = df.index.get_level_values("start").as_unit("ns").asi8
+    order = np.lexsort((times, codes))
+    sorted_codes = codes[order]
+    sorted_times = times[order]
+
+    row_positions = np.arange(len(df))
+    is_first = np.ones(len(df), dtype=bool)
+    is_first[1:] = sorted_codes[1:] != sorted_codes[:-1]
+    group_starts = np.maximum.accumulate(np.where(is_first, row_positions, 0))
+
+    if targets is None:
+        rows = row_positions
+    else:
+        target_positions = np.flatnonzero(targets)
+        sorted_positions = np.empty(len(df), dtype=np.int64)
+        sorted_positions[order] = row_positions
+        rows = sorted_positions[target_positions]
+
+    window_starts = {
+        window: _window_starts(
+            sorted_codes, sorted_times, pd.Timedelta(window).value, rows
+        )
+        for window in {feature.window for feature in features}
+    }
+
+    # Calculate all features before adding them, a feature can replace its column
+    results = {}
+    for feature in features:
+        result = _calc_feature(
+            df[feature.column_name].iloc[order],
+            rows,
+            group_starts[rows],
+            window_starts[feature.window],
+            feature,
+        )
+        if targets is None:
+            # Back from the order of patient and start to the order of df
+            results[feature.feature_name] = np.empty(len(df), dtype=np.float64)
+            results[feature.feature_name][order] = result
+        else:
+            results[feature.feature_name] = result
+
+    if targets is not None:
+        df = df.iloc[target_positions].copy()
+    for feature_name, result in results.items():
+        df[feature_name] = result
+    return df
+
+
 def calc_cumulative_features(
     df: pd.DataFrame,
     column_name: str,
@@ -14,6 +218,8 @@ def calc_cumulative_features(
     but exclude the last `exclude_last` observations. This is useful, since
     some of these observations will not be known at the time of prediction.
 
+    Use `calc_history_features` to calculate multiple features at once.
+
     Parameters
     ----------
     df : pd.DataFrame
@@ -24,7 +230,7 @@ def calc_cumulative_features(
         The column name for the newly created feature.
     exclude_last : str, optional
         How many recent observations to exclude from calculation,
-        can be anything pandas rolling understands, by default "3D"
+        can be anything pandas Timedelta understands, by default "3D"
     cumfunc : str, optional
         The cumulative function to use, by default "sum"
 
@@ -38,27 +244,6 @@ def calc_cumulative_features(
     NotImplementedError
         Raises a not implemented error in case the cumfunc parameter is not sum or count
     """
-    if cumfunc not in ("sum", "count"):
-        raise NotImplementedError()
-
-    df = df.sort_index(level="start")
-    grouped_cum_values = df.groupby(level="pseudo_id", sort=False)[column_name]
-    if cumfunc == "sum":
-        total_cum_values = grouped_cum_values.cumsum()
-    else:
-        total_cum_values = grouped_cum_values.cumcount() + 1
-
-    # Exclude last n days of data
-    exclude_last_rolling = (
-        df.reset_index()
-        .set_index("start")
-        .groupby("pseudo_id", sort=False)[column_name]
-        .rolling(exclude_last)
+    return calc_history_features(
+        df, [CumulativeFeature(column_name, feature_name, exclude_last, cumfunc)]
     )
-    if cumfunc == "sum":
-        exclude_last_values = exclude_last_rolling.sum()
-    else:
-        exclude_last_values = exclude_last_rolling.count()
-
-    df[feature_name] = total_cum_values - exclude_last_values
-    return df
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Any, Callable, Iterable, Union
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# The featuretable depends on the code of these packages
+FEATURE_CODE_PATHS = [
+    Path(__file__).parent,
+    Path(__file__).parents[1] / "preprocessing",
+]
+
+
+def _input_files(path: Path) -> list[Path]:
+    """Files of an input, hidden files and folders (e.g. temporary files) and
+    non-Parquet files in a dataset folder are skipped"""
+    if path.is_file():
+        return [path]
+    return sorted(
+        file
+        for file in path.rglob("*.parquet")
+        if not any(part.startswith(".") for part in file.relative_to(path).parts)
+    )
+
+
+def featuretable_fingerprint(
+    input_paths: Iterable[Union[str, Path]],
+    settings: dict[str, Any],
+    code_paths: Iterable[Path] = FEATURE_CODE_PATHS,
+    length: int = 16,
+) -> str:
+    """Calculate the content hash of everything the featuretable depends on
+
+    Parameters
+    ----------
+    input_paths : Iterable[Union[str, Path]]
+        The input files, or folders of a Parquet dataset
+    settings : dict[str, Any]
+        The settings of the feature building, serialized as JSON
+    code_paths : Iterable[Path], optional
+        Folders with the code of the feature building, by default the features
+        and preprocessing packages
+    length : int, optional
+        Number of hexadecimal characters to return, by default 16
+
+    Returns
+    -------
+    str
+        The hexadecimal fingerprint
+    """
+    sha = hashlib.sha256()
+    for input_path in map(Path, input_paths):
+        for file in _input_files(input_path):
+            sha.update(str(file.relative_to(input_path.parent)).encode())
+            with file.open("rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    sha.update(chunk)
+    sha.update(json.dumps(settings, sort_keys=True, default=str).encode())
+    for code_path in code_paths:
+        for file in sorted(code_path.glob("*.py")):
+            sha.update(file.name.encode())
+            sha.update(file.read_bytes())
+    return sha.hexdigest()[:length]
+
+
+def cached_featuretable(
+    cache_dir: Union[str, Path],
+    fingerprint: str,
+    build: Callable[[], pd.DataFrame],
+    rebuild: bool = False,
+    max_entries: int = 5,
+) -> tuple[pd.DataFrame, bool]:
+    """Load the featuretable of a fingerprint from the cache or build it
+
+    Parameters
+    ----------
+    cache_dir : Union[str, Path]
+        Folder of the cached featuretables
+    fingerprint : str
+        The fingerprint of the featuretable, see `featuretable_fingerprint`
+    build : Callable[[], pd.DataFrame]
+        Function that builds the featuretable when it is not cached
+    rebuild : bool, optional
+        Build the featuretable even when it is cached, by default False
+    max_entries : int, optional
+        Number of featuretables to keep, the least recently used are removed,
+        by default 5
+
+    Returns
+    -------
+    tuple[pd.DataFrame, bool]
+        The featuretable and whether it was loaded from the cache
+    """
+    cache_dir = Path(cache_dir)
+    cache_path = cache_dir / f"featuretable-{fingerprint}.parquet"
+    if cache_path.exists() and not rebuild:
+        logger.info(f"Using cached featuretable {cache_path.name}")
+        cache_path.touch()
+        return pd.read_parquet(cache_path), True
+
+    featuretable = build()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(f".{cache_path.name}")
+    featuretable.to_parquet(tmp_path)
+    tmp_path.replace(cache_path)
+    logger.info(f"Featuretable cached as {cache_path.name}")
+
+    entries = sorted(
+        cache_dir.glob("featuretable-*.parquet"),
+        key=lambda path: path.stat().st_mtime,
+        reverse=True,
+    )
+    for entry in entries[max_entries:]:
+        entry.unlink()
+    return featuretable, False
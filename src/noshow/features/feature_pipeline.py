@@ -1,55 +1,155 @@
+import logging
 from pathlib import Path
+from typing import Optional, Union
 
+import numpy as np
 import pandas as pd
 
 from noshow.config import APPOINTMENTS_LAST_DAYS, CLINIC_CONFIG, MINUTES_EARLY_CUTOFF
 from noshow.features.appointment_features import (
-    add_appointments_last_days,
+    PREV_MINUTES_EARLY_FEATURE,
     add_appointments_same_day,
     add_days_since_created,
     add_days_since_last_appointment,
-    add_minutes_early,
     add_time_features,
+    appointments_last_days_feature,
+    average_prev_minutes_early,
+    calc_minutes_early,
+)
+from noshow.features.cumulative_features import calc_history_features
+from noshow.features.no_show_features import (
+    PREV_NO_SHOW_FEATURES,
+    add_no_show_indicator,
+    add_prev_no_show_perc,
 )
-from noshow.features.no_show_features import prev_no_show_features
 from noshow.features.patient_features import add_patient_features
+from noshow.features.patient_state import (
+    add_patient_state,
+    calc_patient_state,
+    history_watermark,
+    remove_summarized_appointments,
+)
+from noshow.preprocessing.geo import PostalCodeIndex
 from noshow.preprocessing.load_data import (
-    load_appointment_csv,
+    load_appointment_parquet,
     process_appointments,
     process_postal_codes,
+    update_appointment_dataset,
 )
 
+logger = logging.getLogger(__name__)
+
+
+def add_history_features(
+    appointments_df: pd.DataFrame,
+    appointments_last_days: int = 14,
+    minutes_early_cutoff: int = 60,
+    patient_state: Optional[pd.DataFrame] = None,
+    targets: Optional[np.ndarray] = None,
+) -> pd.DataFrame:
+    """Add all features that are calculated over the history of a patient
+
+    Gives the same result as `prev_no_show_features`, `add_appointments_last_days`
+    and `add_minutes_early`, but sorts the appointments and calculates all
+    cumulative and rolling features in a single pass.
+
+    Parameters
+    ----------
+    appointments_df : pd.DataFrame
+        The dataframe containing all the appointment data, with an index on
+        `pseudo_id` and `start`
+    appointments_last_days : int, optional
+        The amount of days to include in `appointments_last_days`, by default 14
+    minutes_early_cutoff : int, optional
+        The cutoff of the minutes early, by default 60
+    patient_state : Optional[pd.DataFrame], optional
+        Running totals of the appointments before the appointments in
+        `appointments_df`, see `calc_patient_state`, by default None
+    targets : Optional[np.ndarray], optional
+        Boolean mask of the appointments to calculate the features for, see
+        `calc_history_features`, by default all appointments
+
+    Returns
+    -------
+    pd.DataFrame
+        The input dataframe sorted on `start` with the added features, or only the
+        target appointments with the added features when `targets` is given
+    """
+    appointments_df = add_no_show_indicator(appointments_df)
+    appointments_df = calc_minutes_early(appointments_df, minutes_early_cutoff)
+    appointments_df = calc_history_features(
+        appointments_df,
+        [
+            *PREV_NO_SHOW_FEATURES,
+            appointments_last_days_feature(appointments_last_days),
+            PREV_MINUTES_EARLY_FEATURE,
+        ],
+        targets,
+    )
+    if patient_state is not None:
+        appointments_df = add_patient_state(appointments_df, patient_state)
+    appointments_df = add_prev_no_show_perc(appointments_df)
+    return average_prev_minutes_early(appointments_df)
+
 
 def create_features(
     appointments_df: pd.DataFrame,
-    all_postal_codes: pd.DataFrame,
+    all_postal_codes: Union[pd.DataFrame, PostalCodeIndex],
+    patient_state: Optional[pd.DataFrame] = None,
+    prediction_start_date: Optional[str] = None,
 ) -> pd.DataFrame:
     """Create all the feature for the no-show model
 
     This function is a pipeline that applies all the feature
     creation code to generate a feature table.
 
+    When the state of the patients is given, the appointments up to the watermark
+    of the state are replaced by the running totals in the state. The features of
+    appointments after `history_watermark` are the same as when they are
+    calculated on the full history.
+
     Parameters
     ----------
     appointments_df : pd.DataFrame
         The dataframe containing all the appointment data, see the
         process_appointments function on how to read this data.
-    all_postal_codes : pd.DataFrame
-        The dataframe containing all the postalcodes in the
-        Netherlands
+    all_postal_codes : Union[pd.DataFrame, PostalCodeIndex]
+        The (index of) all the postalcodes in the Netherlands, see
+        `add_patient_features`
+    patient_state : Optional[pd.DataFrame], optional
+        The state of the patients, see `calc_patient_state`, by default None
+    prediction_start_date : Optional[str], optional
+        If given, only the features of the planned appointments from this date
+        on are created, see `create_target_features`, by default None
 
     Returns
     -------
     pd.DataFrame
         The featuretable
     """
+    last_start = None
+    if patient_state is not None:
+        appointments_df = remove_summarized_appointments(appointments_df, patient_state)
+        last_start = patient_state["last_start"]
+    if prediction_start_date:
+        return create_target_features(
+            appointments_df,
+            all_postal_codes,
+            prediction_start_date,
+            patient_state,
+            last_start,
+        )
+
     appointments_features = (
-        appointments_df.pipe(prev_no_show_features)
+        appointments_df.pipe(
+            add_history_features,
+            APPOINTMENTS_LAST_DAYS,
+            MINUTES_EARLY_CUTOFF,
+            patient_state,
+        )
         .pipe(add_appointments_same_day)
-        .pipe(add_days_since_last_appointment)
+        .pipe(add_days_since_last_appointment, last_start)
         .pipe(add_days_since_created)
-        .pipe(add_appointments_last_days, APPOINTMENTS_LAST_DAYS)
-        .pipe(add_minutes_early, MINUTES_EARLY_CUTOFF)
         .pipe(add_time_features)
         .pipe(add_patient_features, all_postal_codes)
         .sort_index(level="start")
@@ -58,6 +158,134 @@ def create_features(
     return appointments_features
 
 
+def create_target_features(
+    appointments_df: pd.DataFrame,
+    all_postal_codes: Union[pd.DataFrame, PostalCodeIndex],
+    prediction_start_date: str,
+    patient_state: Optional[pd.DataFrame] = None,
+    last_start: Optional[pd.Series] = None,
+) -> pd.DataFrame:
+    """Create the features of the planned appointments from `prediction_start_date`
+
+    Gives the same features for these appointments as `create_features`, but the
+    history of the patients is only used to calculate the history features of
+    the target appointments. The other features are only calculated for the
+    target appointments.
+
+    Parameters
+    ----------
+    appointments_df : pd.DataFrame
+        The dataframe containing all the appointment data, see the
+        process_appointments function on how to read this data.
+    all_postal_codes : Union[pd.DataFrame, PostalCodeIndex]
+        The (index of) all the postalcodes in the Netherlands
+    prediction_start_date : str
+        Start date of the predictions in the format YYYY-MM-DD
+    patient_state : Optional[pd.DataFrame], optional
+        The state of the patients, see `create_features`, by default None
+    last_start : Optional[pd.Series], optional
+        Start of the last appointment per `pseudo_id` before the appointments in
+        `appointments_df`, by default None
+
+    Returns
+    -------
+    pd.DataFrame
+        The featuretable of the target appointments
+    """
+    targets = (
+        (appointments_df["status"] == "planned")
+        & (appointments_df.index.get_level_values("start") >= prediction_start_date)
+    ).to_numpy()
+    target_positions = np.flatnonzero(targets)
+
+    # Features that only need the index are calculated on a frame without columns
+    index_features = pd.DataFrame(
+        {"APP_ID": appointments_df["APP_ID"], "position": np.arange(len(targets))},
+        index=appointments_df.index,
+    )
+    index_features = add_appointments_same_day(index_features).pipe(
+        add_days_since_last_appointment, last_start
+    )
+    index_features = index_features.set_index("position").sort_index()
+
+    target_features = add_history_features(
+        appointments_df,
+        APPOINTMENTS_LAST_DAYS,
+        MINUTES_EARLY_CUTOFF,
+        patient_state,
+        targets,
+    )
+    for column in ("appointments_same_day", "days_since_last_appointment"):
+        target_features[column] = index_features[column].to_numpy()[target_positions]
+
+    return (
+        target_features.pipe(add_days_since_created)
+        .pipe(add_time_features)
+        .pipe(add_patient_features, all_postal_codes)
+        .sort_index(level="start")
+    )
+
+
+def verify_patient_state(
+    appointments_df: pd.DataFrame,
+    all_postal_codes: Union[pd.DataFrame, PostalCodeIndex],
+    start_date: str,
+    patient_state: Optional[pd.DataFrame] = None,
+) -> pd.DataFrame:
+    """Compare the features from the patient state with a full recompute
+
+    Parameters
+    ----------
+    appointments_df : pd.DataFrame
+        Processed appointments with the full history of the patients
+    all_postal_codes : Union[pd.DataFrame, PostalCodeIndex]
+        The (index of) all the postalcodes in the Netherlands
+    start_date : str
+        Start date of the predictions in the format YYYY-MM-DD, the features of
+        the appointments from this date are compared
+    patient_state : Optional[pd.DataFrame], optional
+        The state to verify, by default the state is calculated from
+        `appointments_df` with `calc_patient_state`
+
+    Returns
+    -------
+    pd.DataFrame
+        The appointments with a different feature value, with the features of
+        the full recompute and of the state as column groups `full` and `state`
+    """
+    if patient_state is None:
+        watermark = history_watermark(
+            start_date,
+            APPOINTMENTS_LAST_DAYS,
+            tz=appointments_df.index.get_level_values("start").tz,
+        )
+        patient_state = calc_patient_state(
+            appointments_df, watermark, MINUTES_EARLY_CUTOFF
+        )
+
+    full = create_features(appointments_df.copy(), all_postal_codes)
+    from_state = create_features(
+        appointments_df.copy(), all_postal_codes, patient_state
+    )
+    full = select_feature_columns(full).drop(columns="no_show")
+    full = full.loc[full.index.get_level_values("start") >= start_date]
+    from_state = from_state.reindex(full.index)[full.columns]
+
+    equal = np.isclose(
+        full.to_numpy(dtype=np.float64),
+        from_state.to_numpy(dtype=np.float64),
+        equal_nan=True,
+    ).all(axis=1)
+    differences = pd.concat(
+        [full.loc[~equal], from_state.loc[~equal]],
+        axis="columns",
+        keys=["full", "state"],
+    )
+    if not differences.empty:
+        logger.warning(f"{len(differences)} appointments differ from full recompute")
+    return differences
+
+
 def select_feature_columns(featuretable: pd.DataFrame) -> pd.DataFrame:
     """Select and return the subset of columns used as features for the model.
 
@@ -95,7 +323,10 @@ def select_feature_columns(featuretable: pd.DataFrame) -> pd.DataFrame:
 if __name__ == "__main__":
     data_path = Path(__file__).parents[3] / "data" / "raw"
     output_path = Path(__file__).parents[3] / "data" / "processed"
-    appointments_df = load_appointment_csv(data_path / "poliafspraken_no_show.csv")
+    update_appointment_dataset(
+        data_path / "poliafspraken_no_show.csv", data_path / "poliafspraken_no_show"
+    )
+    appointments_df = load_appointment_parquet(data_path / "poliafspraken_no_show")
     appointments_df = process_appointments(appointments_df, CLINIC_CONFIG)
     all_postalcodes = process_postal_codes(data_path / "NL.txt")
     appointments_features = (
@@ -1,6 +1,37 @@
 import pandas as pd
 
-from noshow.features.cumulative_features import calc_cumulative_features
+from noshow.features.cumulative_features import (
+    CumulativeFeature,
+    calc_history_features,
+)
+
+PREV_NO_SHOW_FEATURES = [
+    CumulativeFeature("prev_no_show", "prev_no_show"),
+    CumulativeFeature("no_show", "earlier_appointments", cumfunc="count"),
+]
+
+
+def add_no_show_indicator(appointments_df: pd.DataFrame) -> pd.DataFrame:
+    """Add the column `prev_no_show` with 1 for a no-show and 0 otherwise
+
+    The column is replaced by the cumulative number of no-shows by the
+    `PREV_NO_SHOW_FEATURES`.
+    """
+    appointments_df.loc[:, "prev_no_show"] = (
+        appointments_df["no_show"].replace({"no_show": "1", "show": "0"}).astype(int)
+    )
+    return appointments_df
+
+
+def add_prev_no_show_perc(appointments_df: pd.DataFrame) -> pd.DataFrame:
+    """Add the percentage of earlier appointments that was a no-show"""
+    appointments_df["prev_no_show_perc"] = (
+        appointments_df["prev_no_show"] / appointments_df["earlier_appointments"]
+    )
+    appointments_df.loc[
+        appointments_df["prev_no_show_perc"].isna(), "prev_no_show_perc"
+    ] = 0
+    return appointments_df
 
 
 def prev_no_show_features(appointments_df: pd.DataFrame) -> pd.DataFrame:
@@ -22,23 +53,6 @@ def prev_no_show_features(appointments_df: pd.DataFrame) -> pd.DataFrame:
     pd.DataFrame
         The input dataframe with added feature columns
     """
-    appointments_df.loc[:, "prev_no_show"] = (
-        appointments_df["no_show"].replace({"no_show": "1", "show": "0"}).astype(int)
-    )
-
-    appointments_df = calc_cumulative_features(
-        appointments_df, "prev_no_show", "prev_no_show"
-    )
-
-    appointments_df = calc_cumulative_features(
-        appointments_df, "no_show", "earlier_appointments", cumfunc="count"
-    )
-
-    appointments_df["prev_no_show_perc"] = (
-        appointments_df["prev_no_show"] / appointments_df["earlier_appointments"]
-    )
-    appointments_df.loc[
-        appointments_df["prev_no_show_perc"].isna(), "prev_no_show_perc"
-    ] = 0
-
-    return appointments_df
+    appointments_df = add_no_show_indicator(appointments_df)
+    appointments_df = calc_history_features(appointments_df, PREV_NO_SHOW_FEATURES)
+    return add_prev_no_show_perc(appointments_df)
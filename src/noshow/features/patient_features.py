@@ -1,10 +1,18 @@
+import logging
+from typing import Union
+
+import numpy as np
 import pandas as pd
 
-from noshow.preprocessing.geo import haversine_distance
+from noshow.preprocessing.geo import MISSING_POSTAL_CODE_POLICIES, PostalCodeIndex
+
+logger = logging.getLogger(__name__)
 
 
 def add_patient_features(
-    appointments_df: pd.DataFrame, all_postalcodes: pd.DataFrame
+    appointments_df: pd.DataFrame,
+    all_postalcodes: Union[pd.DataFrame, PostalCodeIndex],
+    missing_postal_codes: str = "drop",
 ) -> pd.DataFrame:
     """Add patient age and distance to UMCU
 
@@ -14,26 +22,46 @@ def add_patient_features(
         A dataframe containing info on appointments,
         needs to contain the `address_postalCodeNumbersNL` and `BIRTH_YEAR`
         columns.
-    all_postalcodes : pd.DataFrame
-        A dataframe containing all postalcodes in the Netherlands with location.
-        Needs to have a index on postalcode and columns `longitude` and `latitude`.
+    all_postalcodes : Union[pd.DataFrame, PostalCodeIndex]
+        The index of all postalcodes in the Netherlands with location, or a
+        dataframe with a index on postalcode and columns `longitude` and `latitude`
+        that is converted to an index.
+    missing_postal_codes : str, optional
+        What to do with appointments with a missing or unknown postal code, "drop"
+        removes the appointments and "nan" keeps them with a missing distance,
+        by default "drop"
 
     Returns
     -------
     pd.DataFrame
         The appointment_df dataframe with added columns `age` and `dist_umcu`.
     """
-    appointments_df = appointments_df.merge(
-        all_postalcodes, left_on="address_postalCodeNumbersNL", right_index=True
-    )
+    if missing_postal_codes not in MISSING_POSTAL_CODE_POLICIES:
+        raise ValueError(
+            f"missing_postal_codes should be one of {MISSING_POSTAL_CODE_POLICIES}"
+        )
+    if isinstance(all_postalcodes, pd.DataFrame):
+        all_postalcodes = PostalCodeIndex.from_frame(all_postalcodes)
 
-    appointments_df["dist_umcu"] = appointments_df.apply(
-        lambda x: haversine_distance(x["latitude"], x["longitude"]), axis="columns"
+    positions, found = all_postalcodes.positions(
+        appointments_df["address_postalCodeNumbersNL"]
     )
+    n_missing = int((~found).sum())
+    if n_missing > 0:
+        logger.warning(
+            f"{n_missing} appointments with a missing or unknown postal code, "
+            f"policy: {missing_postal_codes}"
+        )
+    if missing_postal_codes == "drop" and n_missing > 0:
+        appointments_df = appointments_df.loc[found].copy()
+        positions = positions[found]
+        found = found[found]
+
+    for column, distances in all_postalcodes.distances.items():
+        appointments_df[column] = np.where(found, distances[positions], np.nan)
 
     appointments_df["age"] = (
         appointments_df.index.get_level_values("start").year  # type: ignore
         - appointments_df["BIRTH_YEAR"]
     )
-    appointments_df = appointments_df.drop(columns=["latitude", "longitude"])
     return appointments_df
@@ -0,0 +1,305 @@
+import logging
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from noshow.features.appointment_features import calc_minutes_early
+
+logger = logging.getLogger(__name__)
+
+STATE_COLUMNS = [
+    "watermark",
+    "n_appointments",
+    "n_no_show",
+    "minutes_early_sum",
+    "last_start",
+]
+
+
+def history_watermark(
+    start_date: str,
+    appointments_last_days: int = 14,
+    exclude_last: str = "3D",
+    tz: Optional[str] = None,
+) -> pd.Timestamp:
+    """Return the watermark up to which the history of a patient can be summarized
+
+    The features of appointments on or after `start_date` only look at individual
+    appointments in the last `appointments_last_days` days and exclude the last
+    `exclude_last` from the cumulative features. Appointments before the
+    watermark are therefore only needed as running totals.
+
+    Parameters
+    ----------
+    start_date : str
+        Start date of the predictions in the format YYYY-MM-DD
+    appointments_last_days : int, optional
+        Window of the `appointments_last_days` feature, by default 14
+    exclude_last : str, optional
+        Window excluded from the cumulative features, by default "3D"
+    tz : Optional[str], optional
+        Timezone of the appointment start times, by default None
+
+    Returns
+    -------
+    pd.Timestamp
+        The watermark
+    """
+    window = max(pd.Timedelta(days=appointments_last_days), pd.Timedelta(exclude_last))
+    return pd.Timestamp(start_date, tz=tz) - window
+
+
+def _as_utc_ns(values) -> np.ndarray:
+    """Convert timestamps to UTC nanoseconds, missing values become the minimum"""
+    values = pd.DatetimeIndex(pd.to_datetime(values))
+    if values.tz is not None:
+        values = values.tz_convert("UTC").tz_localize(None)
+    return values.as_unit("ns").asi8
+
+
+def _aggregate_history(
+    appointments_df: pd.DataFrame, minutes_early_cutoff: int
+) -> pd.DataFrame:
+    """Summarize appointments per patient into the running totals of the state"""
+    starts = appointments_df.index.get_level_values("start")
+    minutes_early = calc_minutes_early(
+        appointments_df[["gearriveerd"]].copy(), minutes_early_cutoff
+    )["minutes_early"]
+    history = pd.DataFrame(
+        {
+            # Same definitions as the prev_no_show and earlier_appointments features
+            "n_appointments": appointments_df["no_show"].notna().astype(int),
+            "n_no_show": (appointments_df["no_show"] == "no_show").astype(int),
+            "minutes_early_sum": minutes_early,
+            "last_start": starts,
+        },
+        index=appointments_df.index,
+    )
+    return history.groupby(level="pseudo_id", observed=True).agg(
+        n_appointments=("n_appointments", "sum"),
+        n_no_show=("n_no_show", "sum"),
+        minutes_early_sum=("minutes_early_sum", "sum"),
+        last_start=("last_start", "max"),
+    )
+
+
+def calc_patient_state(
+    appointments_df: pd.DataFrame,
+    watermark: pd.Timestamp,
+    minutes_early_cutoff: int = 60,
+) -> pd.DataFrame:
+    """Calculate the state of every patient from their full history
+
+    Parameters
+    ----------
+    appointments_df : pd.DataFrame
+        Processed appointments with an index on `pseudo_id` and `start`, see
+        `process_appointments`
+    watermark : pd.Timestamp
+        Only appointments that start on or before the watermark are summarized
+    minutes_early_cutoff : int, optional
+        The cutoff of the minutes early, by default 60
+
+    Returns
+    -------
+    pd.DataFrame
+        The state per `pseudo_id` with the columns in `STATE_COLUMNS`
+    """
+    return advance_patient_state(
+        _empty_state(), appointments_df, watermark, minutes_early_cutoff
+    )
+
+
+def _empty_state() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "watermark": pd.Series([], dtype="datetime64[ns, UTC]"),
+            "n_appointments": pd.Series([], dtype=int),
+            "n_no_show": pd.Series([], dtype=int),
+            "minutes_early_sum": pd.Series([], dtype=float),
+            "last_start": pd.Series([], dtype="datetime64[ns, UTC]"),
+        },
+        index=pd.Index([], name="pseudo_id", dtype=object),
+    )
+
+
+def advance_patient_state(
+    patient_state: pd.DataFrame,
+    appointments_df: pd.DataFrame,
+    watermark: pd.Timestamp,
+    minutes_early_cutoff: int = 60,
+) -> pd.DataFrame:
+    """Add the appointments up to `watermark` to the state of the patients
+
+    For patients that already have a state, only the appointments after the
+    watermark of their state are added. Patients without a state start from
+    scratch, so their appointments before the new watermark must all be given.
+
+    Parameters
+    ----------
+    patient_state : pd.DataFrame
+        The current state per `pseudo_id`, see `calc_patient_state`
+    appointments_df : pd.DataFrame
+        Processed appointments with an index on `pseudo_id` and `start`
+    watermark : pd.Timestamp
+        The new watermark
+    minutes_early_cutoff : int, optional
+        The cutoff of the minutes early, by default 60
+
+    Returns
+    -------
+    pd.DataFrame
+        The state at `watermark` of every patient in `appointments_df`
+    """
+    pseudo_ids = appointments_df.index.get_level_values("pseudo_id")
+    starts = _as_utc_ns(appointments_df.index.get_level_values("start"))
+    # Patients without a state get the minimum timestamp, so all rows are new
+    previous_watermark = _as_utc_ns(patient_state["watermark"].reindex(pseudo_ids))
+    new_rows = (starts <= _as_utc_ns([watermark])[0]) & (starts > previous_watermark)
+
+    delta = _aggregate_history(appointments_df.loc[new_rows], minutes_early_cutoff)
+    current = patient_state.reindex(pseudo_ids.unique())
+    state = pd.DataFrame(index=current.index)
+    for column in ("n_appointments", "n_no_show", "minutes_early_sum"):
+        state[column] = current[column].fillna(0).add(delta[column], fill_value=0)
+    state["n_appointments"] = state["n_appointments"].astype(int)
+    state["n_no_show"] = state["n_no_show"].astype(int)
+    last_start = np.maximum(
+        _as_utc_ns(current["last_start"]),
+        _as_utc_ns(delta["last_start"].reindex(current.index)),
+    )
+    state["last_start"] = pd.to_datetime(last_start, utc=True).tz_convert(watermark.tz)
+    state["watermark"] = watermark
+    return state[STATE_COLUMNS]
+
+
+def stale_patients(
+    patient_state: pd.DataFrame,
+    history_start: pd.Timestamp,
+    watermark: pd.Timestamp,
+) -> pd.Index:
+    """Return the patients whose state can not be advanced to `watermark`
+
+    The state of a patient can only be advanced when the payload contains all
+    appointments after the watermark of the state, so when the payload starts
+    before that watermark, and the state is not ahead of the new watermark.
+
+    Parameters
+    ----------
+    patient_state : pd.DataFrame
+        The current state per `pseudo_id`
+    history_start : pd.Timestamp
+        The payload contains all appointments from this moment on
+    watermark : pd.Timestamp
+        The new watermark
+
+    Returns
+    -------
+    pd.Index
+        The `pseudo_id` of the patients with a stale state
+    """
+    state_watermark = _as_utc_ns(patient_state["watermark"])
+    stale = (state_watermark < _as_utc_ns([history_start])[0]) | (
+        state_watermark > _as_utc_ns([watermark])[0]
+    )
+    return patient_state.index[stale]
+
+
+def add_patient_state(
+    appointments_df: pd.DataFrame, patient_state: pd.DataFrame
+) -> pd.DataFrame:
+    """Add the running totals of the state to the cumulative features
+
+    Must be called after the cumulative features have been calculated on the
+    appointments after the watermark, and before `prev_no_show_perc` and the
+    average `prev_minutes_early` are calculated.
+
+    Parameters
+    ----------
+    appointments_df : pd.DataFrame
+        The appointments after the watermark, with the columns `prev_no_show`,
+        `earlier_appointments` and `prev_minutes_early` (as sum)
+    patient_state : pd.DataFrame
+        The state per `pseudo_id` at the watermark
+
+    Returns
+    -------
+    pd.DataFrame
+        The input dataframe with the state added to the cumulative features
+    """
+    state = patient_state.reindex(appointments_df.index.get_level_values("pseudo_id"))
+    for feature, column in (
+        ("prev_no_show", "n_no_show"),
+        ("earlier_appointments", "n_appointments"),
+        ("prev_minutes_early", "minutes_early_sum"),
+    ):
+        appointments_df[feature] = appointments_df[feature] + np.nan_to_num(
+            state[column].to_numpy(dtype=np.float64)
+        )
+    return appointments_df
+
+
+def remove_summarized_appointments(
+    appointments_df: pd.DataFrame, patient_state: pd.DataFrame
+) -> pd.DataFrame:
+    """Remove the appointments that are already part of the state of the patient"""
+    state_watermark = _as_utc_ns(
+        patient_state["watermark"].reindex(
+            appointments_df.index.get_level_values("pseudo_id")
+        )
+    )
+    starts = _as_utc_ns(appointments_df.index.get_level_values("start"))
+    return appointments_df.loc[starts > state_watermark].copy()
+
+
+def inconsistent_patients(
+    stored_state: pd.DataFrame,
+    appointments_df: pd.DataFrame,
+    watermark: pd.Timestamp,
+    minutes_early_cutoff: int = 60,
+) -> pd.Index:
+    """Compare the stored state with a full recompute from the appointments
+
+    The stored state is advanced to `watermark` with the appointments and compared
+    to the state that is calculated from all appointments. Patients with a stored
+    state that is ahead of `watermark` are skipped.
+
+    Parameters
+    ----------
+    stored_state : pd.DataFrame
+        The stored state per `pseudo_id`
+    appointments_df : pd.DataFrame
+        Processed appointments with the full history of the patients
+    watermark : pd.Timestamp
+        The watermark to compare the states at
+    minutes_early_cutoff : int, optional
+        The cutoff of the minutes early, by default 60
+
+    Returns
+    -------
+    pd.Index
+        The `pseudo_id` of the patients with an inconsistent stored state
+    """
+    comparable = stored_state.loc[
+        _as_utc_ns(stored_state["watermark"]) <= _as_utc_ns([watermark])[0]
+    ]
+    if comparable.empty:
+        return comparable.index
+    appointments_df = appointments_df.loc[
+        appointments_df.index.get_level_values("pseudo_id").isin(comparable.index)
+    ]
+    advanced = advance_patient_state(
+        comparable, appointments_df, watermark, minutes_early_cutoff
+    )
+    recomputed = calc_patient_state(
+        appointments_df, watermark, minutes_early_cutoff
+    ).reindex(advanced.index)
+
+    consistent = (
+        (advanced["n_appointments"] == recomputed["n_appointments"])
+        & (advanced["n_no_show"] == recomputed["n_no_show"])
+        & np.isclose(advanced["minutes_early_sum"], recomputed["minutes_early_sum"])
+        & (_as_utc_ns(advanced["last_start"]) == _as_utc_ns(recomputed["last_start"]))
+    )
+    return advanced.index[~consistent]
@@ -1,52 +1,53 @@
 import logging
 import pickle
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Optional, Union
 
 import numpy as np
 import pandas as pd
 
 from noshow.config import CLINIC_CONFIG
 from noshow.features.feature_pipeline import create_features, select_feature_columns
+from noshow.preprocessing.geo import PostalCodeIndex
 from noshow.preprocessing.load_data import (
-    load_appointment_csv,
+    load_appointment_parquet,
     process_appointments,
     process_postal_codes,
+    update_appointment_dataset,
 )
 
 logger = logging.getLogger(__name__)
 
 
-def create_prediction(
-    model: Any,
+def create_prediction_features(
     appointments_df: pd.DataFrame,
-    all_postal_codes: pd.DataFrame,
+    all_postal_codes: Union[pd.DataFrame, PostalCodeIndex],
     prediction_start_date: Optional[str] = None,
-    add_sensitive_info: bool = False,
+    patient_state: Optional[pd.DataFrame] = None,
 ) -> pd.DataFrame:
-    """Create predictions using a pretrained model
+    """Create the featuretable of the appointments that need a prediction
 
     Parameters
     ----------
-    model : Any
-        A sklearn model (that implements the predict_proba function)
     appointments_df : pd.DataFrame
         Dataframe containing cleaned appointments data
-    all_postal_codes : pd.DataFrame
-        Dataframe containing postalcodes
+    all_postal_codes : Union[pd.DataFrame, PostalCodeIndex]
+        Dataframe or index containing postalcodes
     prediction_start_date : Optional[str], optional
-        Start date for the predictions, if given will only predict appointments
+        Start date for the predictions, if given will only return appointments
         that have status 'planned' and occur after the start date, by default None
-    add_sensitive_info : bool, optional
-        If sensitive data should be added to the predictions
-        for use in the api, by default False
+    patient_state : Optional[pd.DataFrame], optional
+        The state of the patients to calculate the history features with, see
+        `create_features`, by default None
 
     Returns
     -------
     pd.DataFrame
-        Dataframe containing the predictions and optionaly sensitive info
+        The featuretable with the model features
     """
-    featuretable = create_features(appointments_df, all_postal_codes)
+    featuretable = create_features(
+        appointments_df, all_postal_codes, patient_state, prediction_start_date
+    )
 
     if prediction_start_date:
         featuretable = featuretable.loc[featuretable["status"] == "planned"]
@@ -58,8 +59,34 @@ def create_prediction(
             f" {prediction_start_date}"
         )
     featuretable = select_feature_columns(featuretable)
-    featuretable = featuretable.drop(columns="no_show")
+    return featuretable.drop(columns="no_show")
+
+
+def predict_featuretable(
+    model: Any,
+    featuretable: pd.DataFrame,
+    appointments_df: pd.DataFrame,
+    add_sensitive_info: bool = False,
+) -> pd.DataFrame:
+    """Predict the no-show probability for every row of the featuretable
+
+    Parameters
+    ----------
+    model : Any
+        A sklearn model (that implements the predict_proba function)
+    featuretable : pd.DataFrame
+        The featuretable, see `create_prediction_features`
+    appointments_df : pd.DataFrame
+        Dataframe containing cleaned appointments data, used for the sensitive info
+    add_sensitive_info : bool, optional
+        If sensitive data should be added to the predictions
+        for use in the api, by default False
 
+    Returns
+    -------
+    pd.DataFrame
+        Dataframe containing the predictions and optionaly sensitive info
+    """
     prediction_probs: np.ndarray = model.predict_proba(featuretable)
     prediction_df = pd.DataFrame(
         prediction_probs[:, 1], index=featuretable.index, columns=["prediction"]
@@ -86,11 +113,53 @@ def create_prediction(
     return prediction_df
 
 
+def create_prediction(
+    model: Any,
+    appointments_df: pd.DataFrame,
+    all_postal_codes: Union[pd.DataFrame, PostalCodeIndex],
+    prediction_start_date: Optional[str] = None,
+    add_sensitive_info: bool = False,
+) -> pd.DataFrame:
+    """Create predictions using a pretrained model
+
+    Parameters
+    ----------
+    model : Any
+        A sklearn model (that implements the predict_proba function)
+    appointments_df : pd.DataFrame
+        Dataframe containing cleaned appointments data
+    all_postal_codes : Union[pd.DataFrame, PostalCodeIndex]
+        Dataframe or index containing postalcodes
+    prediction_start_date : Optional[str], optional
+        Start date for the predictions, if given will only predict appointments
+        that have status 'planned' and occur after the start date, by default None
+    add_sensitive_info : bool, optional
+        If sensitive data should be added to the predictions
+        for use in the api, by default False
+
+    Returns
+    -------
+    pd.DataFrame
+        Dataframe containing the predictions and optionaly sensitive info
+    """
+    featuretable = create_prediction_features(
+        appointments_df, all_postal_codes, prediction_start_date
+    )
+    return predict_featuretable(
+        model, featuretable, appointments_df, add_sensitive_info
+    )
+
+
 if __name__ == "__main__":
     project_folder = Path(__file__).parents[3]
     data_path = project_folder / "data" / "raw"
     output_path = project_folder / "data" / "processed"
-    appointments_df = load_appointment_csv(data_path / "poliafspraken_no_show.csv")
+    update_appointment_dataset(
+        data_path / "poliafspraken_no_show.csv", data_path / "poliafspraken_no_show"
+    )
+    appointments_df = load_appointment_parquet(
+        data_path / "poliafspraken_no_show", columns=None
+    )
     appointments_df = process_appointments(appointments_df, CLINIC_CONFIG)
     all_postal_codes = process_postal_codes(data_path / "NL.txt")
     with (project_folder / "output" / "models" / "no_show_model_cv.pickle").open(
@@ -1,33 +1,297 @@
+import copy
 import logging
 import os
 import pickle
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, Union
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple, Union
 
 import mlflow
+import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
+from joblib.externals.loky import get_reusable_executor
 from matplotlib import pyplot as plt
-from sklearn.base import BaseEstimator
+from sklearn.base import BaseEstimator, clone
 from sklearn.calibration import CalibrationDisplay
 from sklearn.ensemble import HistGradientBoostingClassifier
-from sklearn.metrics import roc_auc_score
-from sklearn.model_selection import GridSearchCV, StratifiedGroupKFold, train_test_split
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.metrics import log_loss, roc_auc_score
+from sklearn.model_selection import (
+    GridSearchCV,
+    HalvingGridSearchCV,
+    StratifiedGroupKFold,
+    train_test_split,
+)
+from sklearn.model_selection._search import BaseSearchCV
 
 from noshow.config import setup_root_logger
 
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
 logger = logging.getLogger(__name__)
 
 
+def save_model(model: BaseEstimator, model_path: Union[Path, str]) -> None:
+    """Pickle the model to disk
+
+    The model is first written to a temporary file that replaces the model file
+    when writing is finished, so a running API never reads a partially written model.
+
+    Parameters
+    ----------
+    model : BaseEstimator
+        The trained model
+    model_path : Union[Path, str]
+        Path of the pickled model file
+    """
+    model_path = Path(model_path)
+    tmp_path = model_path.with_suffix(model_path.suffix + ".tmp")
+    with tmp_path.open("wb") as f:
+        pickle.dump(model, f)
+    tmp_path.replace(model_path)
+    logger.info(f"Model saved to {model_path}")
+
+
+def available_cores() -> int:
+    """Return the number of cores this process is allowed to use"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def grid_search(
+    classifier: BaseEstimator,
+    param_grid: Dict,
+    cv: StratifiedGroupKFold,
+    n_jobs: int,
+    **kwargs,
+) -> BaseSearchCV:
+    """Exhaustive search over the parameter grid, scored on AUC, precision and
+    recall"""
+    return GridSearchCV(
+        classifier,
+        param_grid=param_grid,
+        cv=cv,
+        scoring=["roc_auc", "precision", "recall"],
+        verbose=2,
+        refit="roc_auc",
+        n_jobs=n_jobs,
+    )
+
+
+def halving_search(
+    classifier: BaseEstimator,
+    param_grid: Dict,
+    cv: StratifiedGroupKFold,
+    n_jobs: int,
+    resource: str = "max_iter",
+    factor: int = 3,
+) -> BaseSearchCV:
+    """Successive halving over the parameter grid, scored on AUC
+
+    All candidates start with a small budget of `resource` and only the best
+    1 / `factor` of the candidates continue with `factor` times more budget. With
+    `resource="max_iter"` the largest `max_iter` of the grid is the maximum
+    budget, with `resource="n_samples"` it is the full training set.
+    """
+    param_grid = dict(param_grid)
+    max_resources: Union[int, str] = "auto"
+    if resource != "n_samples":
+        max_resources = max(param_grid.pop(resource, [getattr(classifier, resource)]))
+    return HalvingGridSearchCV(
+        classifier,
+        param_grid=param_grid,
+        cv=cv,
+        scoring="roc_auc",
+        verbose=2,
+        factor=factor,
+        resource=resource,
+        max_resources=max_resources,
+        min_resources="exhaust",
+        n_jobs=n_jobs,
+    )
+
+
+SEARCH_STRATEGIES: Dict[str, Callable[..., BaseSearchCV]] = {
+    "grid": grid_search,
+    "halving": halving_search,
+}
+
+
+def search_budget(
+    search: BaseSearchCV, n_splits: int, n_samples: int
+) -> Dict[str, float]:
+    """Return the number of fits and the total resources used by a search
+
+    The resources are the boosting iterations (`max_iter`) or the training samples
+    summed over all fits.
+    """
+    results = search.cv_results_
+    n_fits = len(results["params"]) * n_splits
+    if "n_resources" in results:
+        resources = float(sum(results["n_resources"]) * n_splits)
+    elif "max_iter" in search.estimator.get_params():
+        resources = float(
+            sum(
+                params.get("max_iter", search.estimator.get_params()["max_iter"])
+                for params in results["params"]
+            )
+            * n_splits
+        )
+    else:
+        resources = float(n_fits * n_samples * (n_splits - 1) / n_splits)
+    return {"search_fits": n_fits, "search_resources": resources}
+
+
+@contextmanager
+def shared_training_data(
+    X: pd.DataFrame, y: pd.Series, folder: Optional[Union[str, Path]] = None
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Write the training data to memory-mapped arrays for the CV workers
+
+    The features are converted once to a contiguous float32 array. The workers
+    open the same file instead of receiving a pickled copy of the dataframe, so
+    they share the pages of the operating system. The files are removed on exit.
+
+    Parameters
+    ----------
+    X : pd.DataFrame
+        The numeric features
+    y : pd.Series
+        The labels
+    folder : Optional[Union[str, Path]], optional
+        Folder of the memory-mapped files, e.g. `/dev/shm`, by default the
+        temporary folder of the system
+
+    Yields
+    ------
+    Tuple[np.ndarray, np.ndarray]
+        The read-only memory-mapped features and labels
+    """
+    with tempfile.TemporaryDirectory(dir=folder, prefix="noshow-train-") as tmp:
+        arrays = []
+        for name, values in (("X", X.to_numpy(np.float32)), ("y", y.to_numpy())):
+            path = Path(tmp) / f"{name}.npy"
+            array = np.lib.format.open_memmap(
+                path, mode="w+", dtype=values.dtype, shape=values.shape
+            )
+            array[:] = values
+            array.flush()
+            del array, values
+            arrays.append(np.load(path, mmap_mode="r"))
+        logger.info(f"Training data memory-mapped: {arrays[0].nbytes / 1e6:.0f} MB")
+        yield arrays[0], arrays[1]
+        del arrays
+
+
+def positional_estimator(estimator: BaseEstimator, columns: pd.Index) -> BaseEstimator:
+    """Clone the estimator with categorical features referenced by position
+    instead of by name, to train it on an array without column names"""
+    estimator = clone(estimator)
+    categorical = estimator.get_params().get("categorical_features")
+    if not isinstance(categorical, str) and categorical is not None:
+        if all(isinstance(feature, str) for feature in categorical):
+            estimator.set_params(
+                categorical_features=columns.get_indexer(categorical).tolist()
+            )
+    return estimator
+
+
+def refit_best_candidate(
+    search: BaseSearchCV,
+    classifier: BaseEstimator,
+    refit: Union[bool, str],
+    X: pd.DataFrame,
+    y: pd.Series,
+) -> BaseSearchCV:
+    """Refit the best candidate of a search that was fitted without refit on `X`
+
+    Sets the same attributes as a search with refit, so the search can be used
+    to predict and `best_estimator_` is the refit model.
+
+    Parameters
+    ----------
+    search : BaseSearchCV
+        The search, fitted with `refit=False`
+    classifier : BaseEstimator
+        The classifier to refit with the best parameters
+    refit : Union[bool, str]
+        The original `refit` of the search, the metric to select the best candidate
+        on when there are multiple metrics
+    X : pd.DataFrame
+        The training features
+    y : pd.Series
+        The training labels
+
+    Returns
+    -------
+    BaseSearchCV
+        The search with the refit best candidate
+    """
+    results = search.cv_results_
+    if not hasattr(search, "best_index_"):
+        search.best_index_ = int(np.argmin(results[f"rank_test_{refit}"]))
+        search.best_score_ = results[f"mean_test_{refit}"][search.best_index_]
+        search.best_params_ = results["params"][search.best_index_]
+    search.set_params(refit=refit)
+    start_time = time.time()
+    search.best_estimator_ = clone(classifier).set_params(**search.best_params_)
+    search.best_estimator_.fit(X, y)
+    search.refit_time_ = time.time() - start_time
+    if hasattr(search.best_estimator_, "feature_names_in_"):
+        search.feature_names_in_ = search.best_estimator_.feature_names_in_
+    return search
+
+
+def peak_rss_mb() -> Dict[str, float]:
+    """Return the peak resident memory of this process and of the largest child
+    process (e.g. a CV worker that has exited) in MB"""
+    if resource is None:
+        return {}
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    bytes_per_unit = 1 if sys.platform == "darwin" else 1024
+    return {
+        "peak_rss_mb": (
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * bytes_per_unit / 2**20
+        ),
+        "peak_rss_workers_mb": (
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            * bytes_per_unit
+            / 2**20
+        ),
+    }
+
+
 def train_cv_model(
     featuretable: pd.DataFrame,
     output_path: Union[Path, str],
     classifier: BaseEstimator,
     param_grid: Dict,
     save_exp: bool = True,
-) -> None:
+    search: str = "grid",
+    n_jobs: Optional[int] = None,
+    memmap_folder: Optional[Union[str, Path]] = None,
+    **search_kwargs,
+) -> BaseSearchCV:
     """Use Cross validation to train a model and save results and parameters to mlflow
 
+    The search strategy is one of `SEARCH_STRATEGIES`: an exhaustive grid search,
+    or successive halving that stops the worst candidates early. Both use group
+    aware cross validation on `pseudo_id`. The strategy, number of fits, resources
+    and duration of the search are logged to mlflow.
+
+    The CV workers read the training data from a shared float32 memory map, see
+    `shared_training_data`. The best candidate is refit on the same float32 values
+    as a dataframe, so the model keeps the feature names. The peak memory of the
+    training process and of the largest worker is logged.
+
     Parameters
     ----------
     featuretable : pd.DataFrame
@@ -40,46 +304,327 @@ def train_cv_model(
         The parameter grid to search for the best model
     save_exp : bool
         If we want to save the experiment to MLFlow, by default True
+    search : str, optional
+        The search strategy, "grid" or "halving", by default "grid"
+    n_jobs : Optional[int], optional
+        Number of parallel fits, by default the number of available cores
+    memmap_folder : Optional[Union[str, Path]], optional
+        Folder of the memory-mapped training data, by default the temporary
+        folder of the system
+    **search_kwargs
+        Passed to the search strategy, e.g. `resource` and `factor` of
+        `halving_search`
+
+    Returns
+    -------
+    BaseSearchCV
+        The fitted search, `best_estimator_` is the refit best candidate that is
+        saved as model
     """
+    if search not in SEARCH_STRATEGIES:
+        raise ValueError(f"search should be one of {list(SEARCH_STRATEGIES)}")
+    n_jobs = n_jobs or available_cores()
 
-    if save_exp:
-        mlflow.set_experiment("Periodic Retraining")
-        mlflow.autolog(log_models=False)
+    run_id = _start_experiment(save_exp)
+    X_train, X_test, y_train, y_test = _split_featuretable(featuretable)
 
-        if os.getenv("MLFLOW_TRACKING_URI") is None:
-            logger.warning(
-                "MLFLOW_TRACKING_URI is not set, will default to mlruns directory."
-            )
+    train_groups = pd.factorize(X_train.index.get_level_values("pseudo_id"))[0]
 
-        run_id = mlflow.start_run().info.run_id
+    cv = StratifiedGroupKFold()
 
-    featuretable["no_show"] = (
-        featuretable["no_show"].replace({"no_show": "1", "show": "0"}).astype(int)
+    # Search on the shared arrays, the best candidate is refit on the dataframe
+    grid = SEARCH_STRATEGIES[search](
+        positional_estimator(classifier, X_train.columns),
+        param_grid,
+        cv,
+        n_jobs=n_jobs,
+        **search_kwargs,
     )
+    refit = grid.refit
+    grid.set_params(refit=False)
+    start_time = time.perf_counter()
+    with shared_training_data(X_train, y_train, memmap_folder) as (X_shared, y_shared):
+        grid.fit(X_shared, y_shared, groups=train_groups)
+    budget = {
+        **search_budget(grid, cv.get_n_splits(), len(X_train)),
+        "search_seconds": time.perf_counter() - start_time,
+    }
+    logger.info(f"Search {search} with {n_jobs} jobs: {budget}")
 
-    X, y = featuretable.drop(columns="no_show"), featuretable["no_show"]
+    refit_best_candidate(grid, classifier, refit, X_train.astype(np.float32), y_train)
+    model = grid.best_estimator_
+    # Stop the workers, so their peak memory is included in the children usage
+    get_reusable_executor().shutdown(wait=True)
+    budget.update(peak_rss_mb())
+    logger.info(f"Peak memory usage: {peak_rss_mb()}")
 
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.2, random_state=0, shuffle=False
+    _finish_experiment(
+        model,
+        X_test,
+        y_test,
+        output_path,
+        run_id,
+        {"search_strategy": search, "search_n_jobs": n_jobs},
+        budget,
     )
+    return grid
 
-    train_groups = X_train.index.get_level_values("pseudo_id")
 
-    cv = StratifiedGroupKFold()
+class WarmStartHistGradientBoostingClassifier(HistGradientBoostingClassifier):
+    """HistGradientBoostingClassifier that can warm start on new data
 
-    # Train the pipeline on the training data
-    grid = GridSearchCV(
-        classifier,
-        param_grid=param_grid,
-        cv=cv,
-        scoring=["roc_auc", "precision", "recall"],
-        verbose=2,
-        refit="roc_auc",
-        n_jobs=5,
+    The default classifier fits new bins on every call to `fit`, while the trees
+    of the previous fit split on the bins of the previous data. When warm starting,
+    this classifier keeps the bins of the first fit, so the existing trees give the
+    same predictions during training as after. The early stopping scores of the
+    previous fit are replaced by the score on the new validation data.
+    """
+
+    def fit(self, X, y, sample_weight=None, *, X_val=None, y_val=None, **kwargs):
+        """Fit the classifier, or add trees to it when warm starting, see
+        `HistGradientBoostingClassifier.fit`"""
+        self._warm_start_bin_mapper = None
+        if self.warm_start and self._is_fitted():
+            self._warm_start_bin_mapper = self._bin_mapper
+            if X_val is not None and self.scoring == "loss":
+                # Only the validation scores are used for early stopping
+                self.train_score_ = np.array([])
+                self.validation_score_ = np.array(
+                    [-log_loss(y_val, self.predict_proba(X_val))]
+                )
+        return super().fit(X, y, sample_weight, X_val=X_val, y_val=y_val, **kwargs)
+
+    def _bin_data(self, X, sample_weight, is_training_data):
+        warm_start_bin_mapper = getattr(self, "_warm_start_bin_mapper", None)
+        if is_training_data and warm_start_bin_mapper is not None:
+            self._bin_mapper = warm_start_bin_mapper
+            return self._bin_mapper.transform(X)
+        return super()._bin_data(X, sample_weight, is_training_data)
+
+    @classmethod
+    def from_model(
+        cls, model: HistGradientBoostingClassifier
+    ) -> "WarmStartHistGradientBoostingClassifier":
+        """Create a warm start classifier with the parameters and (fitted) state
+        of another HistGradientBoostingClassifier"""
+        warm_start_model = cls(**model.get_params())
+        warm_start_model.__dict__.update(copy.deepcopy(vars(model)))
+        return warm_start_model
+
+
+def load_warm_start_model(
+    model_path: Union[Path, str],
+    classifier: HistGradientBoostingClassifier,
+    columns: pd.Index,
+) -> Optional[HistGradientBoostingClassifier]:
+    """Load the deployed model if it can be warm started on the featuretable
+
+    Parameters
+    ----------
+    model_path : Union[Path, str]
+        Path of the deployed model
+    classifier : HistGradientBoostingClassifier
+        The classifier of a cold fit, the categorical features should be the same
+    columns : pd.Index
+        The feature columns of the featuretable
+
+    Returns
+    -------
+    Optional[HistGradientBoostingClassifier]
+        The deployed model, or None if there is no model or the feature schema
+        changed
+    """
+    model_path = Path(model_path)
+    if not model_path.is_file():
+        logger.info(f"No deployed model at {model_path}, fitting a new model")
+        return None
+    with model_path.open("rb") as f:
+        model = pickle.load(f)
+    if not isinstance(model, HistGradientBoostingClassifier):
+        logger.info(f"Deployed model is a {type(model).__name__}, fitting a new model")
+        return None
+    if list(getattr(model, "feature_names_in_", [])) != list(columns) or (
+        model.categorical_features != classifier.categorical_features
+    ):
+        logger.info(
+            "Feature schema changed since the deployed model, fitting a new model"
+        )
+        return None
+    return model
+
+
+def retrain_model(
+    featuretable: pd.DataFrame,
+    output_path: Union[Path, str],
+    classifier: HistGradientBoostingClassifier,
+    warm_start: bool = False,
+    max_iter: int = 1000,
+    n_iter_no_change: int = 10,
+    validation_fraction: float = 0.1,
+    compare_cold: bool = False,
+    save_exp: bool = True,
+) -> HistGradientBoostingClassifier:
+    """Retrain the model with early stopping instead of a hyperparameter search
+
+    The latest `validation_fraction` of the training appointments (the
+    featuretable is sorted on `start`) is the validation data. Trees are added
+    until the loss on the validation data has not improved for `n_iter_no_change`
+    iterations, so the number of iterations is chosen automatically.
+
+    With `warm_start`, the deployed model is trained further with its own
+    parameters when the feature schema is unchanged, see `load_warm_start_model`.
+    Only the trees needed for the new data are added, so the time of a retrain
+    scales with how much the data changed. With `compare_cold`, a cold fit is also
+    run to measure the time saved. Otherwise the retrain time is only compared
+    with the recorded duration of the last cold fit the deployed model started
+    from (`cold_fit_seconds_`), when the model has one.
+
+    Parameters
+    ----------
+    featuretable : pd.DataFrame
+        The featuretable
+    output_path : Union[Path, str]
+        Path to the output folder of the model
+    classifier : HistGradientBoostingClassifier
+        The classifier of a cold fit
+    warm_start : bool, optional
+        Continue training the deployed model, by default False
+    max_iter : int, optional
+        Maximum number of trees to add, by default 1000
+    n_iter_no_change : int, optional
+        Number of iterations without improvement before stopping, by default 10
+    validation_fraction : float, optional
+        Fraction of the latest training appointments to validate on, by default 0.1
+    compare_cold : bool, optional
+        Also fit a cold model to measure the time saved by the warm start,
+        by default False
+    save_exp : bool, optional
+        If we want to save the experiment to MLFlow, by default True
+
+    Returns
+    -------
+    HistGradientBoostingClassifier
+        The retrained model
+    """
+    run_id = _start_experiment(save_exp)
+    X_train, X_test, y_train, y_test = _split_featuretable(featuretable)
+    # Early stopping on the latest appointments instead of a random sample
+    X_fit, X_val, y_fit, y_val = train_test_split(
+        X_train, y_train, test_size=validation_fraction, shuffle=False
+    )
+
+    model_path = Path(output_path) / "no_show_model_cv.pickle"
+    deployed = (
+        load_warm_start_model(model_path, classifier, X_train.columns)
+        if warm_start
+        else None
+    )
+    model, seconds = _fit_early_stopping(
+        classifier if deployed is None else deployed,
+        X_fit,
+        y_fit,
+        X_val,
+        y_val,
+        max_iter,
+        n_iter_no_change,
+    )
+    metrics = {"retrain_seconds": seconds, "n_iter": model.n_iter_}
+
+    if deployed is not None:
+        metrics["n_iter_added"] = model.n_iter_ - deployed.n_iter_
+        if compare_cold:
+            cold_model, metrics["cold_fit_seconds"] = _fit_early_stopping(
+                classifier, X_fit, y_fit, X_val, y_val, max_iter, n_iter_no_change
+            )
+            metrics["cold_fit_n_iter"] = cold_model.n_iter_
+            metrics["time_saved_seconds"] = metrics["cold_fit_seconds"] - seconds
+        elif hasattr(deployed, "cold_fit_seconds_"):
+            # Not a measurement: the last cold fit was on other (less) data
+            metrics["last_cold_fit_seconds"] = deployed.cold_fit_seconds_
+            metrics["time_saved_vs_last_cold_fit_seconds"] = (
+                deployed.cold_fit_seconds_ - seconds
+            )
+    logger.info(f"Retrained model: {metrics}")
+
+    _finish_experiment(
+        model,
+        X_test,
+        y_test,
+        output_path,
+        run_id,
+        {"retrain_mode": "warm_start" if deployed is not None else "early_stopping"},
+        metrics,
+    )
+    return model
+
+
+def _fit_early_stopping(
+    model: HistGradientBoostingClassifier,
+    X: pd.DataFrame,
+    y: pd.Series,
+    X_val: pd.DataFrame,
+    y_val: pd.Series,
+    max_iter: int,
+    n_iter_no_change: int,
+) -> Tuple[WarmStartHistGradientBoostingClassifier, float]:
+    """Fit with early stopping, a fitted model is warm started. The duration of
+    a cold fit is stored in `cold_fit_seconds_`"""
+    fitted = hasattr(model, "n_iter_")
+    model = WarmStartHistGradientBoostingClassifier.from_model(
+        model if fitted else clone(model)
+    ).set_params(
+        warm_start=fitted,
+        early_stopping=True,
+        scoring="loss",
+        n_iter_no_change=n_iter_no_change,
+        max_iter=max_iter + (model.n_iter_ if fitted else 0),
+    )
+    start_time = time.perf_counter()
+    model.fit(X, y, X_val=X_val, y_val=y_val)
+    seconds = time.perf_counter() - start_time
+    if not fitted:
+        # Kept through warm starts, to compare later retrains with
+        model.cold_fit_seconds_ = seconds
+    return model, seconds
+
+
+def _start_experiment(save_exp: bool) -> Optional[str]:
+    if not save_exp:
+        return None
+    mlflow.set_experiment("Periodic Retraining")
+    mlflow.autolog(log_models=False)
+
+    if os.getenv("MLFLOW_TRACKING_URI") is None:
+        logger.warning(
+            "MLFLOW_TRACKING_URI is not set, will default to mlruns directory."
+        )
+
+    return mlflow.start_run().info.run_id
+
+
+def _split_featuretable(
+    featuretable: pd.DataFrame,
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.Series, pd.Series]:
+    featuretable["no_show"] = (
+        featuretable["no_show"].replace({"no_show": "1", "show": "0"}).astype(int)
     )
-    grid.fit(X_train, y_train, groups=train_groups)
 
-    y_pred = grid.best_estimator_.predict_proba(X_test)  # type: ignore
+    X, y = featuretable.drop(columns="no_show"), featuretable["no_show"]
+
+    return train_test_split(X, y, test_size=0.2, random_state=0, shuffle=False)
+
+
+def _finish_experiment(
+    model: BaseEstimator,
+    X_test: pd.DataFrame,
+    y_test: pd.Series,
+    output_path: Union[Path, str],
+    run_id: Optional[str],
+    params: Dict[str, Any],
+    metrics: Dict[str, float],
+) -> None:
+    """Evaluate the model on the test data, log the results and save the model"""
+    y_pred = model.predict_proba(X_test)  # type: ignore
     test_roc_auc = roc_auc_score(y_test, y_pred[:, 1])
 
     # Create and log calibration curve
@@ -90,19 +635,27 @@ def train_cv_model(
     ax.set_ylabel("Fraction of Positives")
     plt.tight_layout()
 
-    if save_exp and mlflow.active_run():
-        mlflow.log_metric("test_roc_auc", float(test_roc_auc))
-        mlflow.log_figure(fig, "calibration_curve.png")
-    elif save_exp:
+    if run_id is not None and mlflow.active_run():
+        _log_results(test_roc_auc, fig, params, metrics)
+    elif run_id is not None:
         logger.info("Mlflow run not active, re-activating run to log custom metrics.")
         with mlflow.start_run(run_id=run_id):
-            mlflow.log_metric("test_roc_auc", float(test_roc_auc))
-            mlflow.log_figure(fig, "calibration_curve.png")
+            _log_results(test_roc_auc, fig, params, metrics)
 
     model_path = Path(output_path) / "no_show_model_cv.pickle"
-    with model_path.open("wb") as f:
-        pickle.dump(grid.best_estimator_, f)
-    logger.info(f"Model saved to {model_path}")
+    save_model(model, model_path)
+
+
+def _log_results(
+    test_roc_auc: float,
+    fig: plt.Figure,
+    params: Dict[str, Any],
+    metrics: Dict[str, float],
+) -> None:
+    mlflow.log_metric("test_roc_auc", float(test_roc_auc))
+    mlflow.log_figure(fig, "calibration_curve.png")
+    mlflow.log_params(params)
+    mlflow.log_metrics(metrics)
 
 
 if __name__ == "__main__":
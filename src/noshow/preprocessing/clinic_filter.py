@@ -0,0 +1,159 @@
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from noshow.config import ClinicConfig
+
+
+class ClinicFilter:
+    """Clinic configuration compiled into lookup tables
+
+    Every appointment is labeled with the clinics of its main agenda and filtered
+    on the subagendas and appointment codes of these clinics in a single pass over
+    the appointments, instead of a filtered copy of the appointments per clinic.
+
+    Parameters
+    ----------
+    clinics : list[str]
+        Names of the clinics in the order of the configuration
+    agenda_clinics : dict[str, list[int]]
+        Positions in `clinics` of the clinics of every main agenda code, an agenda
+        code can belong to several clinics
+    subagendas : list[tuple[set[str], bool]]
+        The subagendas and whether they are excluded, per clinic
+    appcodes : list[tuple[set[str], bool]]
+        The appointment codes and whether they are excluded, per clinic
+    """
+
+    def __init__(
+        self,
+        clinics: list[str],
+        agenda_clinics: dict[str, list[int]],
+        subagendas: list[tuple[set[str], bool]],
+        appcodes: list[tuple[set[str], bool]],
+    ) -> None:
+        self.clinics = clinics
+        self.agenda_clinics = agenda_clinics
+        self.subagendas = subagendas
+        self.appcodes = appcodes
+
+    @classmethod
+    def from_config(cls, clinic_config: Dict[str, ClinicConfig]) -> "ClinicFilter":
+        """Compile the clinic configuration
+
+        Parameters
+        ----------
+        clinic_config : Dict[str, ClinicConfig]
+            The clinic configuration, containing filters and clinic info
+
+        Returns
+        -------
+        ClinicFilter
+            The compiled clinic filter
+        """
+        agenda_clinics: dict[str, list[int]] = {}
+        for position, config in enumerate(clinic_config.values()):
+            for agenda_code in dict.fromkeys(config.main_agenda_codes):
+                agenda_clinics.setdefault(agenda_code, []).append(position)
+        return cls(
+            clinics=list(clinic_config),
+            agenda_clinics=agenda_clinics,
+            subagendas=[
+                (set(config.subagendas), config.subagenda_exclude)
+                for config in clinic_config.values()
+            ],
+            appcodes=[
+                (set(config.appcodes), config.appcode_exclude)
+                for config in clinic_config.values()
+            ],
+        )
+
+    def _allowed(
+        self, values: pd.Series, rules: list[tuple[set[str], bool]]
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Return the codes of the values and which clinic allows which code
+
+        An empty set allows every value, like the configuration without
+        subagendas or appointment codes.
+        """
+        codes, uniques = pd.factorize(values, use_na_sentinel=False)
+        uniques = pd.Index(uniques)
+        allowed = np.ones((len(rules), len(uniques)), dtype=bool)
+        for position, (code_set, exclude) in enumerate(rules):
+            if code_set:
+                in_set = uniques.isin(code_set)
+                allowed[position] = ~in_set if exclude else in_set
+        return codes, allowed
+
+    def clinic_rows(
+        self, appointments_df: pd.DataFrame
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Find the clinics of every appointment that passes the filters
+
+        Parameters
+        ----------
+        appointments_df : pd.DataFrame
+            The appointments, with the columns `hoofdagenda_id`, `subagenda_id` and
+            `afspraak_code`
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray]
+            The positions of the appointments and of their clinics, an appointment
+            of an agenda that belongs to several clinics is returned per clinic.
+            Sorted on clinic and appointment.
+        """
+        agenda_codes, agendas = pd.factorize(appointments_df["hoofdagenda_id"])
+        clinics_per_agenda = [self.agenda_clinics.get(agenda, []) for agenda in agendas]
+        # Clinics of all agendas concatenated, with the offset of every agenda
+        n_clinics = np.array([len(c) for c in clinics_per_agenda] + [0], dtype=np.int64)
+        agenda_offsets = np.concatenate([[0], np.cumsum(n_clinics)])
+        flat_clinics = np.array(
+            [clinic for clinics in clinics_per_agenda for clinic in clinics],
+            dtype=np.int64,
+        )
+
+        # Missing agenda codes have code -1 and no clinics
+        counts = n_clinics[agenda_codes]
+        rows = np.repeat(np.arange(len(appointments_df)), counts)
+        within_agenda = np.arange(len(rows)) - np.repeat(
+            np.cumsum(counts) - counts, counts
+        )
+        clinics = flat_clinics[agenda_offsets[agenda_codes][rows] + within_agenda]
+
+        subagenda_codes, allowed_subagendas = self._allowed(
+            appointments_df["subagenda_id"], self.subagendas
+        )
+        appcode_codes, allowed_appcodes = self._allowed(
+            appointments_df["afspraak_code"], self.appcodes
+        )
+        keep = (
+            allowed_subagendas[clinics, subagenda_codes[rows]]
+            & allowed_appcodes[clinics, appcode_codes[rows]]
+        )
+        rows, clinics = rows[keep], clinics[keep]
+
+        order = np.lexsort((rows, clinics))
+        return rows[order], clinics[order]
+
+    def apply(self, appointments_df: pd.DataFrame) -> pd.DataFrame:
+        """Filter the appointments and add the column `clinic`
+
+        Gives the same result as filtering a copy of the appointments per clinic and
+        concatenating them, see `apply_config_filters`.
+
+        Parameters
+        ----------
+        appointments_df : pd.DataFrame
+            The appointments data
+
+        Returns
+        -------
+        pd.DataFrame
+            The appointments of the clinics with the added column `clinic`
+        """
+        rows, clinics = self.clinic_rows(appointments_df)
+        filtered_df = appointments_df.take(rows)
+        filtered_df["clinic"] = np.array(self.clinics, dtype=object)[clinics]
+        return filtered_df
@@ -1,4 +1,12 @@
 from math import atan2, cos, radians, sin, sqrt
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS_KM = 6373.0  # approximate radius of Earth in km
+
+REFERENCE_LOCATIONS = {"umcu": (52.08593762444437, 5.179600848939784)}
 
 
 def haversine_distance(
@@ -27,7 +35,7 @@ def haversine_distance(
     float
         The distance between both points in kilometers
     """
-    r = 6373.0  # approximate radius of Earth in km
+    r = EARTH_RADIUS_KM
 
     lat1 = radians(lat1)
     lon1 = radians(lon1)
@@ -43,3 +51,171 @@ def haversine_distance(
     distance = r * c
 
     return distance
+
+
+def haversine_distances(
+    lat1: np.ndarray,
+    lon1: np.ndarray,
+    lat2: float = 52.08593762444437,
+    lon2: float = 5.179600848939784,
+) -> np.ndarray:
+    """Calculate the Haversine distance for arrays of locations
+
+    Vectorized version of `haversine_distance`, the default second location is
+    the location of the UMCU.
+
+    Parameters
+    ----------
+    lat1 : np.ndarray
+        Latitudes of the locations
+    lon1 : np.ndarray
+        Longitudes of the locations
+    lat2 : float, optional
+        Latitude of the reference location, by default 52.08593762444437
+    lon2 : float, optional
+        Longitude of the reference location, by default 5.179600848939784
+
+    Returns
+    -------
+    np.ndarray
+        The distances between the locations and the reference location in kilometers
+    """
+    lat1 = np.radians(np.asarray(lat1, dtype=np.float64))
+    lon1 = np.radians(np.asarray(lon1, dtype=np.float64))
+    lat2 = np.radians(lat2)
+    lon2 = np.radians(lon2)
+
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return EARTH_RADIUS_KM * c
+
+
+def add_reference_distances(
+    all_postalcodes: pd.DataFrame,
+    reference_locations: Optional[dict[str, tuple[float, float]]] = None,
+) -> pd.DataFrame:
+    """Add the distance of every postal code to the reference locations
+
+    Adds a column `dist_{name}` for every reference location, so the distance
+    features become a lookup on postal code.
+
+    Parameters
+    ----------
+    all_postalcodes : pd.DataFrame
+        Dataframe with the columns `latitude` and `longitude`
+    reference_locations : Optional[dict[str, tuple[float, float]]], optional
+        Mapping of name to (latitude, longitude), by default `REFERENCE_LOCATIONS`
+
+    Returns
+    -------
+    pd.DataFrame
+        The input dataframe with a distance column per reference location
+    """
+    reference_locations = reference_locations or REFERENCE_LOCATIONS
+    for name, (latitude, longitude) in reference_locations.items():
+        all_postalcodes[f"dist_{name}"] = haversine_distances(
+            all_postalcodes["latitude"].to_numpy(),
+            all_postalcodes["longitude"].to_numpy(),
+            latitude,
+            longitude,
+        )
+    return all_postalcodes
+
+
+MISSING_POSTAL_CODE_POLICIES = ("drop", "nan")
+
+
+class PostalCodeIndex:
+    """Dense lookup table of the locations of the 4-digit Dutch postal codes
+
+    Dutch postal code numbers lie between 1000 and 9999, so the location and the
+    distances of a postal code are stored at the position of the code in float32
+    arrays of length 10 000. A lookup is an array index, instead of a join on the
+    postal code table.
+
+    Parameters
+    ----------
+    latitude : np.ndarray
+        Latitude per postal code
+    longitude : np.ndarray
+        Longitude per postal code
+    distances : dict[str, np.ndarray]
+        Distance per postal code to a reference location, e.g. `dist_umcu`
+    valid : np.ndarray
+        Boolean mask of the postal codes that are known
+    """
+
+    size = 10_000
+
+    def __init__(
+        self,
+        latitude: np.ndarray,
+        longitude: np.ndarray,
+        distances: dict[str, np.ndarray],
+        valid: np.ndarray,
+    ) -> None:
+        self.latitude = latitude
+        self.longitude = longitude
+        self.distances = distances
+        self.valid = valid
+
+    @classmethod
+    def from_frame(cls, all_postalcodes: pd.DataFrame) -> "PostalCodeIndex":
+        """Create the index from the output of `process_postal_codes`
+
+        Parameters
+        ----------
+        all_postalcodes : pd.DataFrame
+            Dataframe with an index on postal code, the columns `latitude` and
+            `longitude` and optionally `dist_{name}` columns. `dist_umcu` is
+            calculated when it is missing.
+
+        Returns
+        -------
+        PostalCodeIndex
+            The dense index of the postal codes
+        """
+        if "dist_umcu" not in all_postalcodes.columns:
+            all_postalcodes = add_reference_distances(all_postalcodes.copy())
+        codes = all_postalcodes.index.to_numpy(dtype=np.int64)
+        in_range = (codes >= 0) & (codes < cls.size)
+        codes = codes[in_range]
+
+        def dense(column: str) -> np.ndarray:
+            values = np.full(cls.size, np.nan, dtype=np.float32)
+            values[codes] = all_postalcodes[column].to_numpy()[in_range]
+            return values
+
+        valid = np.zeros(cls.size, dtype=bool)
+        valid[codes] = True
+        distance_columns = [c for c in all_postalcodes.columns if c.startswith("dist_")]
+        return cls(
+            latitude=dense("latitude"),
+            longitude=dense("longitude"),
+            distances={column: dense(column) for column in distance_columns},
+            valid=valid,
+        )
+
+    def positions(self, postal_codes: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+        """Find the position of the postal codes in the index
+
+        Parameters
+        ----------
+        postal_codes : pd.Series
+            The postal code numbers, can contain missing values
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray]
+            The position of every postal code and a mask of the known postal codes,
+            the position of unknown postal codes is 0
+        """
+        codes = pd.to_numeric(postal_codes, errors="coerce").to_numpy(dtype=np.float64)
+        in_range = np.isfinite(codes) & (codes >= 0) & (codes < self.size)
+        positions = np.where(in_range, codes, 0).astype(np.int64)
+        found = in_range & self.valid[positions]
+        return np.where(found, positions, 0), found
@@ -1,12 +1,28 @@
 import logging
-from datetime import date
+import shutil
+from datetime import date, datetime
 from pathlib import Path
-from typing import Dict, List, Union
+from typing import Dict, Iterable, List, Optional, Union, get_args
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from dateutil.tz import tzlocal
 
 from noshow.api.pydantic_models import Appointment
 from noshow.config import NO_SHOW_CODES, ClinicConfig
+from noshow.preprocessing.clinic_filter import ClinicFilter
+from noshow.preprocessing.geo import PostalCodeIndex, add_reference_distances
+from noshow.preprocessing.schema import (
+    APPOINTMENT_ARROW_SCHEMA,
+    APPOINTMENT_CATEGORIES,
+    PROCESSING_COLUMNS,
+    apply_appointment_schema,
+    memory_report,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -22,9 +38,13 @@ def load_appointment_pydantic(appointments: List[Appointment]) -> pd.DataFrame:
     Returns
     -------
     pd.DataFrame
-        The loaded data as pandas dataframe
+        The loaded data as pandas dataframe, see `apply_appointment_schema`
     """
     appointments_df = pd.DataFrame([a.model_dump() for a in appointments])
+    return apply_appointment_schema(_clean_appointments(appointments_df))
+
+
+def _clean_appointments(appointments_df: pd.DataFrame) -> pd.DataFrame:
     appointments_df = appointments_df.replace("", None)
 
     # Clinic name and description are sometimes unknown since HiX6.3
@@ -35,6 +55,96 @@ def load_appointment_pydantic(appointments: List[Appointment]) -> pd.DataFrame:
     return appointments_df
 
 
+def read_arrow_payload(payload: bytes) -> pa.Table:
+    """Read a Parquet file or Arrow IPC stream from bytes
+
+    Parquet files are recognized by their magic bytes, everything else is read
+    as an Arrow IPC stream.
+
+    Parameters
+    ----------
+    payload : bytes
+        The Parquet file or Arrow IPC stream
+
+    Returns
+    -------
+    pa.Table
+        The payload as Arrow table
+    """
+    if payload[:4] == b"PAR1":
+        return pq.read_table(pa.BufferReader(payload))
+    with pa.ipc.open_stream(payload) as reader:
+        return reader.read_all()
+
+
+def _to_datetime(column: pd.Series, local_date: bool = False) -> pd.Series:
+    """Convert a column to datetimes, numbers are milliseconds since epoch.
+
+    This follows the pydantic Appointment model: numeric timestamps are UTC and
+    a numeric `birthDate` is converted to the local date.
+    """
+    if column.dtype == object:
+        numeric_column = pd.to_numeric(column, errors="coerce")
+        if numeric_column.notna().sum() == column.notna().sum():
+            column = numeric_column
+    if pd.api.types.is_numeric_dtype(column):
+        column = pd.to_datetime(column, unit="ms", utc=True)
+        if local_date:
+            column = column.dt.tz_convert(tzlocal()).dt.tz_localize(None)
+            column = column.dt.normalize()
+    else:
+        column = pd.to_datetime(column)
+    # Arrow timestamps keep their unit, the pydantic datetimes are nanoseconds
+    return column.dt.as_unit("ns")
+
+
+def load_appointment_arrow(table: pa.Table) -> pd.DataFrame:
+    """Load prediction data from an Arrow table
+
+    Alternative to `load_appointment_pydantic` for large payloads. The columns are
+    validated and converted per column, following the types of the pydantic
+    Appointment model, instead of per appointment.
+
+    Parameters
+    ----------
+    table : pa.Table
+        The input data, with a column for every field of Appointment
+
+    Returns
+    -------
+    pd.DataFrame
+        The loaded data as pandas dataframe, see `apply_appointment_schema`
+
+    Raises
+    ------
+    ValueError
+        If columns are missing, contain missing values while they are required
+        or can not be converted to the right type
+    """
+    fields = Appointment.model_fields
+    missing_columns = set(fields).difference(table.column_names)
+    if missing_columns:
+        raise ValueError(f"Missing columns: {sorted(missing_columns)}")
+
+    appointments_df = table.select(list(fields)).to_pandas()
+    for name, field in fields.items():
+        field_types = set(get_args(field.annotation)) or {field.annotation}
+        column = appointments_df[name].replace("", None)
+
+        if datetime in field_types:
+            column = _to_datetime(column, local_date=name == "birthDate")
+        elif int in field_types:
+            column = pd.to_numeric(column)
+        else:
+            column = column.where(column.isna(), column.astype(str))
+
+        if type(None) not in field_types and column.isna().any():
+            raise ValueError(f"Column {name} contains missing values")
+        appointments_df[name] = column
+
+    return apply_appointment_schema(_clean_appointments(appointments_df))
+
+
 def load_appointment_csv(csv_path: Union[str, Path]) -> pd.DataFrame:
     """Load data from a csv file
 
@@ -48,16 +158,402 @@ def load_appointment_csv(csv_path: Union[str, Path]) -> pd.DataFrame:
     Returns
     -------
     pd.DataFrame
-        The pandas dataframe from the csv file
+        The pandas dataframe from the csv file, see `apply_appointment_schema`
     """
-    appointments_df = pd.read_csv(
+    raw_df = pd.read_csv(
         csv_path,
         engine="pyarrow",
     )
+    appointments_df = apply_appointment_schema(raw_df)
 
+    report = memory_report(raw_df, appointments_df)
+    logger.info(
+        f"Appointments use {report.loc['total', 'bytes_after'] / 1e6:.1f} MB, "
+        f"{report.loc['total', 'bytes_before'] / 1e6:.1f} MB without the schema"
+    )
+    logger.debug(f"Memory usage per column:\n{report}")
     return appointments_df
 
 
+PARTITIONING = ds.partitioning(
+    pa.schema([("year", pa.int16()), ("month", pa.int8())]), flavor="hive"
+)
+
+
+DATASET_SCHEMA = pa.unify_schemas([APPOINTMENT_ARROW_SCHEMA, PARTITIONING.schema])
+
+
+def _with_partition_columns(batch: pa.RecordBatch) -> pa.RecordBatch:
+    """Cast a batch to `APPOINTMENT_ARROW_SCHEMA` and add the year and month"""
+    columns = [
+        batch.column(field.name).cast(field.type) for field in APPOINTMENT_ARROW_SCHEMA
+    ]
+    start = columns[APPOINTMENT_ARROW_SCHEMA.get_field_index("start")]
+    return pa.RecordBatch.from_arrays(
+        columns + [pc.year(start).cast(pa.int16()), pc.month(start).cast(pa.int8())],
+        schema=DATASET_SCHEMA,
+    )
+
+
+def _partition_dir(year: Optional[int], month: Optional[int]) -> str:
+    """Folder of a partition, missing values are in the hive default partition"""
+    default = "__HIVE_DEFAULT_PARTITION__"
+    return (
+        f"year={default if year is None else year}/"
+        f"month={default if month is None else month}"
+    )
+
+
+def _write_appointment_dataset(
+    batches: Iterable[pa.RecordBatch],
+    dataset_path: Union[str, Path],
+    min_rows_per_group: int = 100_000,
+) -> None:
+    """Write batches of appointments to a Parquet dataset partitioned by year and
+    month of `start`, replacing all partitions of an existing dataset
+
+    The batches are written to a temporary folder first, the partitions of the
+    existing dataset are only replaced when writing has succeeded.
+    """
+    dataset_path = Path(dataset_path)
+    # Folders starting with a dot are not read as part of the dataset
+    write_path = dataset_path / ".write"
+    shutil.rmtree(write_path, ignore_errors=True)
+    try:
+        ds.write_dataset(
+            (_with_partition_columns(batch) for batch in batches),
+            write_path,
+            schema=DATASET_SCHEMA,
+            format="parquet",
+            partitioning=PARTITIONING,
+            min_rows_per_group=min_rows_per_group,
+        )
+    except BaseException:
+        shutil.rmtree(write_path, ignore_errors=True)
+        raise
+    for partition in dataset_path.glob("year=*"):
+        shutil.rmtree(partition)
+    for partition in write_path.glob("year=*"):
+        partition.rename(dataset_path / partition.name)
+    shutil.rmtree(write_path)
+
+
+def merge_appointment_dataset(
+    dataset_path: Union[str, Path],
+    delta: pa.Table,
+    min_rows_per_group: int = 100_000,
+) -> tuple[int, int]:
+    """Merge new and changed appointments into the Parquet dataset
+
+    The appointments are deduplicated on `APP_ID`: all stored rows of an `APP_ID`
+    in `delta` are replaced by the rows in `delta`, also when the appointment
+    moved to another month. Only the partitions with new, changed or moved
+    appointments are rewritten, in a temporary folder that is moved in place.
+
+    Parameters
+    ----------
+    dataset_path : Union[str, Path]
+        The folder of the Parquet dataset, see `convert_appointment_csv`
+    delta : pa.Table
+        The new and changed appointments, with the columns of
+        `APPOINTMENT_ARROW_SCHEMA`
+    min_rows_per_group : int, optional
+        Rows of a partition are buffered until a row group has this many rows,
+        by default 100 000
+
+    Returns
+    -------
+    tuple[int, int]
+        The number of new and of updated appointments (`APP_ID`)
+    """
+    dataset_path = Path(dataset_path)
+    delta = pa.Table.from_batches(
+        [_with_partition_columns(batch) for batch in delta.to_batches()],
+        schema=DATASET_SCHEMA,
+    )
+    delta_ids = pc.unique(delta["APP_ID"])
+    dataset = ds.dataset(
+        dataset_path, schema=DATASET_SCHEMA, format="parquet", partitioning=PARTITIONING
+    )
+    stored = dataset.to_table(columns=["APP_ID", "year", "month"])
+    replaced = stored.filter(pc.is_in(stored["APP_ID"], value_set=delta_ids))
+    n_updated = len(pc.unique(replaced["APP_ID"]))
+
+    partitions = set(
+        zip(
+            replaced["year"].to_pylist() + delta["year"].to_pylist(),
+            replaced["month"].to_pylist() + delta["month"].to_pylist(),
+            strict=True,
+        )
+    )
+    partition_filter = None
+    for year, month in partitions:
+        expression = (
+            ds.field("year").is_null() if year is None else ds.field("year") == year
+        ) & (
+            ds.field("month").is_null() if month is None else ds.field("month") == month
+        )
+        partition_filter = (
+            expression if partition_filter is None else partition_filter | expression
+        )
+    if partition_filter is None:
+        return 0, 0
+    kept = dataset.to_table(filter=partition_filter)
+    kept = kept.filter(pc.invert(pc.is_in(kept["APP_ID"], value_set=delta_ids)))
+
+    # Folders starting with a dot are not read as part of the dataset
+    merge_path = dataset_path / ".merge"
+    shutil.rmtree(merge_path, ignore_errors=True)
+    ds.write_dataset(
+        pa.concat_tables([kept, delta]),
+        merge_path,
+        schema=DATASET_SCHEMA,
+        format="parquet",
+        partitioning=PARTITIONING,
+        min_rows_per_group=min_rows_per_group,
+    )
+    for year, month in partitions:
+        target = dataset_path / _partition_dir(year, month)
+        shutil.rmtree(target, ignore_errors=True)
+        source = merge_path / _partition_dir(year, month)
+        if source.exists():
+            target.parent.mkdir(parents=True, exist_ok=True)
+            source.rename(target)
+    shutil.rmtree(merge_path)
+    return len(delta_ids) - n_updated, n_updated
+
+
+def compare_appointment_dataset(
+    dataset_path: Union[str, Path], table: pa.Table
+) -> dict[str, int]:
+    """Compare the Parquet dataset with a full export per `APP_ID`
+
+    Parameters
+    ----------
+    dataset_path : Union[str, Path]
+        The folder of the Parquet dataset
+    table : pa.Table
+        The full export, with the columns of `APPOINTMENT_ARROW_SCHEMA`
+
+    Returns
+    -------
+    dict[str, int]
+        The number of `APP_ID` that are only in the export (`missing`), only in
+        the dataset (`extra`) and that have different rows (`changed`)
+    """
+
+    def hash_per_app_id(appointments: pa.Table) -> pd.Series:
+        appointments_df = appointments.select(
+            APPOINTMENT_ARROW_SCHEMA.names
+        ).to_pandas()
+        row_hashes = pd.util.hash_pandas_object(
+            appointments_df.astype(str), index=False
+        )
+        # The sum does not depend on the order of the rows of an APP_ID
+        return row_hashes.groupby(appointments_df["APP_ID"].to_numpy()).sum()
+
+    stored = hash_per_app_id(
+        ds.dataset(
+            dataset_path,
+            schema=DATASET_SCHEMA,
+            format="parquet",
+            partitioning=PARTITIONING,
+        ).to_table()
+    )
+    exported = hash_per_app_id(
+        pa.Table.from_batches(
+            [_with_partition_columns(batch) for batch in table.to_batches()],
+            schema=DATASET_SCHEMA,
+        )
+    )
+    both = stored.index.intersection(exported.index)
+    return {
+        "missing": len(exported.index.difference(stored.index)),
+        "extra": len(stored.index.difference(exported.index)),
+        "changed": int((stored[both] != exported[both]).sum()),
+    }
+
+
+def convert_appointment_csv(
+    csv_path: Union[str, Path],
+    dataset_path: Union[str, Path],
+    block_size: int = 64 << 20,
+    min_rows_per_group: int = 100_000,
+) -> None:
+    """Convert the training export to a Parquet dataset partitioned by year and month
+
+    The csv file is read in blocks with the fixed types of
+    `APPOINTMENT_ARROW_SCHEMA`, so the full file never has to fit in memory. The
+    year and month of `start` are the partitions, appointments without a start
+    are stored in the default partition. An existing dataset is replaced.
+
+    Parameters
+    ----------
+    csv_path : Union[str, Path]
+        The path to the csv file, see `load_appointment_csv`
+    dataset_path : Union[str, Path]
+        The folder of the Parquet dataset
+    block_size : int, optional
+        The number of bytes of the csv file that is read at once, by default 64 MB
+    min_rows_per_group : int, optional
+        Rows of a partition are buffered until a row group has this many rows,
+        by default 100 000
+    """
+    reader = pa_csv.open_csv(
+        csv_path,
+        read_options=pa_csv.ReadOptions(block_size=block_size),
+        convert_options=pa_csv.ConvertOptions(
+            column_types=APPOINTMENT_ARROW_SCHEMA,
+            include_columns=APPOINTMENT_ARROW_SCHEMA.names,
+            # Empty strings are missing values, like in `load_appointment_csv`
+            strings_can_be_null=True,
+        ),
+    )
+    _write_appointment_dataset(reader, dataset_path, min_rows_per_group)
+    logger.info(f"Converted {csv_path} to the Parquet dataset {dataset_path}")
+
+
+def convert_appointment_parquet(
+    parquet_path: Union[str, Path],
+    dataset_path: Union[str, Path],
+    batch_size: int = 100_000,
+    min_rows_per_group: int = 100_000,
+) -> None:
+    """Convert a Parquet export to a Parquet dataset partitioned by year and month
+
+    Same as `convert_appointment_csv` for the Parquet file of `export_data` or the
+    folder of Parquet files of `export_data_partitioned`, which is read per
+    `batch_size` rows.
+
+    Parameters
+    ----------
+    parquet_path : Union[str, Path]
+        The path to the Parquet file or folder
+    dataset_path : Union[str, Path]
+        The folder of the Parquet dataset
+    batch_size : int, optional
+        The number of rows that is read at once, by default 100 000
+    min_rows_per_group : int, optional
+        Rows of a partition are buffered until a row group has this many rows,
+        by default 100 000
+    """
+    batches = ds.dataset(parquet_path, format="parquet").to_batches(
+        columns=APPOINTMENT_ARROW_SCHEMA.names, batch_size=batch_size
+    )
+    _write_appointment_dataset(batches, dataset_path, min_rows_per_group)
+    logger.info(f"Converted {parquet_path} to the Parquet dataset {dataset_path}")
+
+
+def update_appointment_dataset(
+    export_path: Union[str, Path], dataset_path: Union[str, Path]
+) -> bool:
+    """Convert the training export when the Parquet dataset is missing or outdated
+
+    Parameters
+    ----------
+    export_path : Union[str, Path]
+        The path to the csv or Parquet file or the folder of Parquet files of the
+        export
+    dataset_path : Union[str, Path]
+        The folder of the Parquet dataset
+
+    Returns
+    -------
+    bool
+        Whether the export was converted
+    """
+    export_path, dataset_path = Path(export_path), Path(dataset_path)
+    if export_path.is_dir():
+        export_mtime = max(f.stat().st_mtime for f in export_path.glob("*.parquet"))
+    else:
+        export_mtime = export_path.stat().st_mtime
+    files = list(dataset_path.rglob("*.parquet"))
+    if files and min(f.stat().st_mtime for f in files) >= export_mtime:
+        return False
+    if export_path.is_dir() or export_path.suffix == ".parquet":
+        convert_appointment_parquet(export_path, dataset_path)
+    else:
+        convert_appointment_csv(export_path, dataset_path)
+    return True
+
+
+def _month_filter(date_value: str, after: bool) -> ds.Expression:
+    """Select the year and month partitions on or after (or before) a date"""
+    year, month = ds.field("year"), ds.field("month")
+    timestamp = pd.Timestamp(date_value)
+    if after:
+        return (year > timestamp.year) | (
+            (year == timestamp.year) & (month >= timestamp.month)
+        )
+    return (year < timestamp.year) | (
+        (year == timestamp.year) & (month <= timestamp.month)
+    )
+
+
+def load_appointment_parquet(
+    dataset_path: Union[str, Path],
+    columns: Optional[List[str]] = PROCESSING_COLUMNS,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+) -> pd.DataFrame:
+    """Load data from the Parquet dataset of the training export
+
+    Only the given columns are read. The date range is pushed down to the
+    dataset, so only the partitions of the months in the range are read and the
+    row groups are filtered on `start`.
+
+    Parameters
+    ----------
+    dataset_path : Union[str, Path]
+        The folder of the Parquet dataset, see `convert_appointment_csv`
+    columns : Optional[List[str]], optional
+        The columns to read, None reads all columns, by default the columns used
+        by `process_appointments` and `create_features`
+    start_date : Optional[str], optional
+        Only load appointments that start on or after this date, by default None
+    end_date : Optional[str], optional
+        Only load appointments that start before this date, by default None
+
+    Returns
+    -------
+    pd.DataFrame
+        The appointments, see `apply_appointment_schema`
+    """
+    schema = pa.schema(
+        [
+            pa.field(field.name, pa.dictionary(pa.int32(), field.type))
+            if field.name in APPOINTMENT_CATEGORIES
+            else field
+            for field in APPOINTMENT_ARROW_SCHEMA
+        ]
+    )
+    dataset = ds.dataset(
+        dataset_path,
+        schema=pa.unify_schemas([schema, PARTITIONING.schema]),
+        format=ds.ParquetFileFormat(
+            read_options=ds.ParquetReadOptions(
+                dictionary_columns=APPOINTMENT_CATEGORIES
+            )
+        ),
+        partitioning=PARTITIONING,
+    )
+    filters = []
+    if start_date:
+        filters.append(_month_filter(start_date, after=True))
+        filters.append(ds.field("start") >= pd.Timestamp(start_date))
+    if end_date:
+        filters.append(_month_filter(end_date, after=False))
+        filters.append(ds.field("start") < pd.Timestamp(end_date))
+    expression = None
+    for expr in filters:
+        expression = expr if expression is None else expression & expr
+
+    if columns is None:
+        columns = APPOINTMENT_ARROW_SCHEMA.names
+    table = dataset.to_table(columns=columns, filter=expression)
+    return apply_appointment_schema(table.to_pandas())
+
+
 def process_appointments(
     appointments_df: pd.DataFrame,
     clinic_config: Dict[str, ClinicConfig],
@@ -131,7 +627,10 @@ def process_appointments(
     return appointments_df
 
 
-def process_postal_codes(postalcodes_path: Union[str, Path]) -> pd.DataFrame:
+def process_postal_codes(
+    postalcodes_path: Union[str, Path],
+    reference_locations: Optional[dict[str, tuple[float, float]]] = None,
+) -> pd.DataFrame:
     """Load and process all postalcode locations in the Netherlands
 
     This file can be found at: https://download.geonames.org/export/zip/NL.zip
@@ -140,12 +639,15 @@ def process_postal_codes(postalcodes_path: Union[str, Path]) -> pd.DataFrame:
     ----------
     postalcodes_path : Union[str, Path]
         Path to the tsv-file that contains postalcode information
+    reference_locations : Optional[dict[str, tuple[float, float]]], optional
+        Locations to precompute the distance to, as mapping of name to
+        (latitude, longitude), by default only the UMCU
 
     Returns
     -------
     pd.DataFrame
-        A dataframe containing all postalcodes and longlat positions
-        in the Netherlands
+        A dataframe containing all postalcodes, longlat positions and distance
+        to the reference locations (e.g. `dist_umcu`) in the Netherlands
     """
     all_postalcodes = pd.read_table(
         postalcodes_path,
@@ -168,7 +670,23 @@ def process_postal_codes(postalcodes_path: Union[str, Path]) -> pd.DataFrame:
     )
     all_postalcodes = all_postalcodes.set_index("postalcode")[["latitude", "longitude"]]
     all_postalcodes = all_postalcodes.loc[~all_postalcodes.index.duplicated()]
-    return all_postalcodes
+    return add_reference_distances(all_postalcodes, reference_locations)
+
+
+def load_postal_code_index(postalcodes_path: Union[str, Path]) -> PostalCodeIndex:
+    """Load all postalcode locations in the Netherlands as a dense lookup table
+
+    Parameters
+    ----------
+    postalcodes_path : Union[str, Path]
+        Path to the tsv-file that contains postalcode information
+
+    Returns
+    -------
+    PostalCodeIndex
+        The locations and distances of all postalcodes, see `process_postal_codes`
+    """
+    return PostalCodeIndex.from_frame(process_postal_codes(postalcodes_path))
 
 
 def apply_config_filters(
@@ -178,6 +696,10 @@ def apply_config_filters(
 ) -> pd.DataFrame:
     """Apply the clinic config filters to the appointments data
 
+    The config is compiled into a `ClinicFilter`, which labels and filters all
+    appointments in a single pass. An appointment of a main agenda that belongs
+    to several clinics is returned once per clinic.
+
     Parameters
     ----------
     appointments_df : pd.DataFrame
@@ -193,28 +715,7 @@ def apply_config_filters(
     pd.DataFrame
         The appointments data with the clinic config filters applied
     """
-    clinic_df_list = []
-    for name, config in clinic_config.items():
-        clinic_df = appointments_df.loc[
-            appointments_df["hoofdagenda_id"].isin(config.main_agenda_codes)
-        ].copy()
-        clinic_df["clinic"] = name
-
-        if config.subagenda_exclude and config.subagendas:
-            clinic_df = clinic_df.loc[
-                ~clinic_df["subagenda_id"].isin(config.subagendas)
-            ]
-        elif config.subagendas:
-            clinic_df = clinic_df.loc[clinic_df["subagenda_id"].isin(config.subagendas)]
-
-        if config.appcode_exclude and config.appcodes:
-            clinic_df = clinic_df.loc[~clinic_df["afspraak_code"].isin(config.appcodes)]
-        elif config.appcodes:
-            clinic_df = clinic_df.loc[clinic_df["afspraak_code"].isin(config.appcodes)]
-
-        clinic_df_list.append(clinic_df)
-
-    total_df = pd.concat(clinic_df_list)
+    total_df = ClinicFilter.from_config(clinic_config).apply(appointments_df)
 
     # After filtering there could still be appointments of patients that no longer have
     # an appointment on the start date.
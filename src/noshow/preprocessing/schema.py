@@ -0,0 +1,124 @@
+import logging
+
+import pandas as pd
+import pyarrow as pa
+from pandas.api.types import is_datetime64_any_dtype
+
+logger = logging.getLogger(__name__)
+
+# Repeated strings, stored once per category with integer codes per row
+APPOINTMENT_CATEGORIES = [
+    "pseudo_id",
+    "hoofdagenda",
+    "hoofdagenda_id",
+    "subagenda_id",
+    "specialty_code",
+    "soort_consult",
+    "afspraak_code",
+    "status",
+    "status_code_original",
+    "mutationReason_code",
+    "mutationReason_display",
+    "name",
+    "description",
+]
+APPOINTMENT_INTEGERS = ["minutesDuration", "BIRTH_YEAR", "address_postalCodeNumbersNL"]
+APPOINTMENT_DATETIMES = ["start", "end", "gearriveerd", "created"]
+
+# Fixed types of the training export, see data/sql/data_export.sql. Parquet
+# dictionary encodes the strings, the categories are read back as dictionaries.
+APPOINTMENT_ARROW_SCHEMA = pa.schema(
+    [("APP_ID", pa.string())]
+    + [(column, pa.string()) for column in APPOINTMENT_CATEGORIES]
+    + [(column, pa.timestamp("ns")) for column in APPOINTMENT_DATETIMES]
+    + [
+        ("minutesDuration", pa.int32()),
+        ("BIRTH_YEAR", pa.int16()),
+        ("address_postalCodeNumbersNL", pa.int16()),
+    ]
+)
+
+# Columns used by `process_appointments` and `create_features`
+PROCESSING_COLUMNS = [
+    "APP_ID",
+    "pseudo_id",
+    "hoofdagenda_id",
+    "subagenda_id",
+    "soort_consult",
+    "afspraak_code",
+    "start",
+    "gearriveerd",
+    "created",
+    "minutesDuration",
+    "status",
+    "mutationReason_code",
+    "BIRTH_YEAR",
+    "address_postalCodeNumbersNL",
+]
+
+
+def apply_appointment_schema(appointments_df: pd.DataFrame) -> pd.DataFrame:
+    """Convert the appointments to compact dtypes
+
+    Repeated strings (including `pseudo_id`) become categoricals, integers are
+    downcast to the smallest integer type (or float32 when there are missing
+    values) and datetimes are parsed. Columns that are not in the appointments are
+    skipped, other columns are kept as they are.
+
+    Parameters
+    ----------
+    appointments_df : pd.DataFrame
+        The loaded appointments
+
+    Returns
+    -------
+    pd.DataFrame
+        The appointments with compact dtypes
+    """
+    appointments_df = appointments_df.copy()
+    for column in APPOINTMENT_CATEGORIES:
+        if column in appointments_df.columns:
+            appointments_df[column] = appointments_df[column].astype("category")
+    for column in APPOINTMENT_INTEGERS:
+        if column in appointments_df.columns:
+            values = pd.to_numeric(appointments_df[column])
+            if values.isna().any():
+                appointments_df[column] = values.astype("float32")
+            else:
+                appointments_df[column] = pd.to_numeric(values, downcast="integer")
+    for column in APPOINTMENT_DATETIMES:
+        if column in appointments_df.columns and not is_datetime64_any_dtype(
+            appointments_df[column]
+        ):
+            appointments_df[column] = pd.to_datetime(appointments_df[column])
+    return appointments_df
+
+
+def memory_report(before: pd.DataFrame, after: pd.DataFrame) -> pd.DataFrame:
+    """Compare the memory usage of the appointments per column
+
+    Parameters
+    ----------
+    before : pd.DataFrame
+        The appointments before `apply_appointment_schema`
+    after : pd.DataFrame
+        The appointments after `apply_appointment_schema`
+
+    Returns
+    -------
+    pd.DataFrame
+        The dtype and the memory usage in bytes before and after per column, with
+        the totals in the row `total`
+    """
+    report = pd.DataFrame(
+        {
+            "dtype_before": before.dtypes.astype(str),
+            "bytes_before": before.memory_usage(index=False, deep=True),
+            "dtype_after": after.dtypes.astype(str),
+            "bytes_after": after.memory_usage(index=False, deep=True),
+        }
+    )
+    report.loc["total", ["bytes_before", "bytes_after"]] = report[
+        ["bytes_before", "bytes_after"]
+    ].sum()
+    return report
@@ -5,43 +5,165 @@ import logging
 from pathlib import Path
 
 import click
+import pandas as pd
 from dotenv import load_dotenv
 from sklearn.ensemble import HistGradientBoostingClassifier
 
-from noshow.config import CLINIC_CONFIG, setup_root_logger
-from noshow.database.export import export_data
+from noshow.config import (
+    APPOINTMENTS_LAST_DAYS,
+    CLINIC_CONFIG,
+    MINUTES_EARLY_CUTOFF,
+    NO_SHOW_CODES,
+    setup_root_logger,
+)
+from noshow.database.export import (
+    export_data,
+    export_data_incremental,
+    export_data_partitioned,
+)
+from noshow.features.feature_cache import cached_featuretable, featuretable_fingerprint
 from noshow.features.feature_pipeline import create_features, select_feature_columns
-from noshow.model.train_model import train_cv_model
+from noshow.model.train_model import retrain_model, train_cv_model
 from noshow.preprocessing.load_data import (
-    load_appointment_csv,
+    load_appointment_parquet,
     process_appointments,
     process_postal_codes,
+    update_appointment_dataset,
 )
 
 logger = logging.getLogger(__name__)
 
+EXPORT_PATHS = {
+    "csv": "poliafspraken_no_show.csv",
+    "parquet": "poliafspraken_no_show.parquet",
+    "partitioned": "poliafspraken_no_show_parts",
+    # Updates the Parquet dataset directly
+    "incremental": None,
+}
+
+
+def build_featuretable(
+    dataset_path: Path, postal_codes_path: Path, start_date: str | None
+) -> pd.DataFrame:
+    """Load and process the appointments and create the featuretable"""
+    appointments_df = load_appointment_parquet(dataset_path, start_date=start_date)
+    appointments_df = process_appointments(appointments_df, CLINIC_CONFIG)
+    all_postalcodes = process_postal_codes(postal_codes_path)
+    return create_features(appointments_df, all_postalcodes).pipe(
+        select_feature_columns
+    )
+
 
 @click.command()
 @click.option("--skip-export", is_flag=True, help="Skip data export from the database.")
-def train_pipeline(skip_export: bool) -> None:
+@click.option(
+    "--start-date",
+    default=None,
+    help="Only use appointments from this date on (YYYY-MM-DD).",
+)
+@click.option(
+    "--export-format",
+    type=click.Choice(list(EXPORT_PATHS)),
+    default="csv",
+    help=(
+        "Format of the data export, partitioned exports quarters concurrently and "
+        "incremental only exports the appointments that changed."
+    ),
+)
+@click.option(
+    "--export-workers",
+    default=4,
+    help="Number of concurrent connections of a partitioned export.",
+)
+@click.option(
+    "--full-refresh",
+    is_flag=True,
+    help="Export the full history with an incremental export.",
+)
+@click.option(
+    "--rebuild-features",
+    is_flag=True,
+    help="Rebuild the featuretable even when it is cached.",
+)
+@click.option(
+    "--search",
+    type=click.Choice(["grid", "halving"]),
+    default="grid",
+    help=(
+        "Hyperparameter search, halving trains all candidates with few iterations "
+        "and only continues with the best."
+    ),
+)
+@click.option(
+    "--retrain",
+    type=click.Choice(["cv", "early-stopping", "warm-start"]),
+    default="cv",
+    help=(
+        "cv searches the hyperparameters, early-stopping fits a single model until "
+        "the latest appointments stop improving, warm-start continues training the "
+        "deployed model."
+    ),
+)
+@click.option(
+    "--compare-cold-fit",
+    is_flag=True,
+    help="Also fit a new model with --retrain warm-start to measure the time saved.",
+)
+def train_pipeline(
+    skip_export: bool,
+    start_date: str | None,
+    export_format: str,
+    export_workers: int,
+    full_refresh: bool,
+    rebuild_features: bool,
+    search: str,
+    retrain: str,
+    compare_cold_fit: bool,
+) -> None:
     """Main function to run the training pipeline for the no-show model."""
     load_dotenv(override=True)
     setup_root_logger()
 
     if not skip_export:
         logger.info("Starting data export...")
-        export_data()
+        if export_format == "partitioned":
+            export_data_partitioned(max_workers=export_workers)
+        elif export_format == "incremental":
+            export_data_incremental(full_refresh=full_refresh)
+        else:
+            export_data(output_format=export_format)
 
     data_path = Path(__file__).parents[2] / "data" / "raw"
     output_path = Path(__file__).parents[2] / "data" / "processed"
     model_path = Path(__file__).parents[2] / "output" / "models"
 
     logger.info("Processing data...")
-    appointments_df = load_appointment_csv(data_path / "poliafspraken_no_show.csv")
-    appointments_df = process_appointments(appointments_df, CLINIC_CONFIG)
-    all_postalcodes = process_postal_codes(data_path / "NL.txt")
-    appointments_features = create_features(appointments_df, all_postalcodes).pipe(
-        select_feature_columns
+    # The export is converted once, later runs read the Parquet dataset
+    if EXPORT_PATHS[export_format] is not None:
+        update_appointment_dataset(
+            data_path / EXPORT_PATHS[export_format],
+            data_path / "poliafspraken_no_show",
+        )
+    dataset_path = data_path / "poliafspraken_no_show"
+    postal_codes_path = data_path / "NL.txt"
+    # The featuretable is only rebuilt when the data, settings or code changed
+    fingerprint = featuretable_fingerprint(
+        [dataset_path, postal_codes_path],
+        settings={
+            "start_date": start_date,
+            "appointments_last_days": APPOINTMENTS_LAST_DAYS,
+            "minutes_early_cutoff": MINUTES_EARLY_CUTOFF,
+            "no_show_codes": NO_SHOW_CODES,
+            "clinic_config": {
+                name: config.model_dump() for name, config in CLINIC_CONFIG.items()
+            },
+        },
+    )
+    appointments_features, _ = cached_featuretable(
+        output_path / "featuretables",
+        fingerprint,
+        lambda: build_featuretable(dataset_path, postal_codes_path, start_date),
+        rebuild=rebuild_features,
     )
     appointments_features.to_parquet(output_path / "featuretable.parquet")
     logger.info(
@@ -53,6 +175,16 @@ def train_pipeline(skip_export: bool) -> None:
 
     model = HistGradientBoostingClassifier(categorical_features=["hour", "weekday"])
 
+    if retrain != "cv":
+        retrain_model(
+            featuretable=appointments_features,
+            output_path=model_path,
+            classifier=model,
+            warm_start=retrain == "warm-start",
+            compare_cold=compare_cold_fit,
+        )
+        return
+
     train_cv_model(
         featuretable=appointments_features,
         output_path=model_path,
@@ -61,6 +193,7 @@ def train_pipeline(skip_export: bool) -> None:
             "max_iter": [200, 300, 500],
             "learning_rate": [0.01, 0.05, 0.1],
         },
+        search=search,
     )
 
 
@@ -1,6 +1,24 @@
+import asyncio
+import json
+import os
+import pickle
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from sklearn.dummy import DummyClassifier
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
 from test_noshow import (
+    create_test_session,
+    create_test_sessionmaker,
     create_unit_test_clinic_config,
     fake_appointments,
     fake_bins,
@@ -10,7 +28,22 @@ from test_noshow import (
 
 import noshow.api.app as app
 import noshow.api.app_helpers as app_helpers
+from noshow.api import metrics
 from noshow.api.app import predict
+from noshow.api.app_helpers import fix_outdated_appointments, store_predictions
+from noshow.api.executor import PredictionExecutor, check_deadline
+from noshow.api.resources import FileResource, ModelRegistry
+from noshow.api.timing import PREDICTION_STAGES, StageTimer
+from noshow.database.models import (
+    ApiAppointment,
+    ApiPatient,
+    ApiPatientState,
+    ApiPrediction,
+    ApiRequest,
+    ApiRequestStage,
+    ApiSensitiveInfo,
+)
+from noshow.preprocessing.load_data import load_appointment_pydantic
 
 
 class FakeExecute:
@@ -64,9 +97,12 @@ class FakeDB(Session):
 async def test_predict_endpoint(monkeypatch):
     appointments_pydantic = fake_appointments()
     monkeypatch.setattr(app, "get_bins", fake_bins)
-    monkeypatch.setattr(app, "process_postal_codes", fake_postal_codes)
-    monkeypatch.setattr(app, "load_model", fake_model)
-    monkeypatch.setattr(app_helpers, "delete", lambda x: FakeWhere())
+    monkeypatch.setattr(
+        app, "postal_codes", FileResource("postal_codes", "NL.txt", fake_postal_codes)
+    )
+    monkeypatch.setattr(
+        app, "model_registry", ModelRegistry("model", "model.pickle", fake_model)
+    )
     # patch create treatment groups and add column to the dataframe
     monkeypatch.setattr(
         app, "create_treatment_groups", lambda x, y, z, q: x.assign(treatment_group=1)
@@ -76,8 +112,27 @@ async def test_predict_endpoint(monkeypatch):
     monkeypatch.setenv("DB_USER", "")
     monkeypatch.setenv("X_API_KEY", "test")
 
-    output = await predict(appointments_pydantic, "2024-07-16", FakeDB(), "test")
+    session_maker = create_test_sessionmaker()
+    monkeypatch.setattr(app, "SessionLocal", session_maker)
+    db = session_maker()
+    output = await predict(
+        appointments_pydantic, "2024-07-16", db, "test", StageTimer()
+    )
     assert output == {"message": "5 predictions created and stored in db."}
+    assert db.scalar(select(func.count()).select_from(ApiPrediction)) == 5
+    assert db.scalar(select(func.count()).select_from(ApiRequest)) == 1
+
+    stages = {stage.stage: stage for stage in db.scalars(select(ApiRequestStage))}
+    # The decode stage is only recorded when called through FastAPI
+    assert set(stages) == set(PREDICTION_STAGES) - {"decode"}
+    assert stages["predict_proba"].rows == 5
+    assert stages["store"].rows == 5
+    assert all(stage.duration >= 0 for stage in stages.values())
+    # The runtime of the request adds up to the runtime of its stages
+    apirequest = db.scalar(select(ApiRequest))
+    assert apirequest.runtime == pytest.approx(
+        sum(stage.duration for stage in stages.values())
+    )
 
 
 # teste empty appointments
@@ -85,8 +140,12 @@ async def test_predict_endpoint(monkeypatch):
 async def test_predict_endpoint_empty_appointments(monkeypatch):
     appointments_pydantic = fake_appointments()
     monkeypatch.setattr(app, "get_bins", fake_bins)
-    monkeypatch.setattr(app, "process_postal_codes", fake_postal_codes)
-    monkeypatch.setattr(app, "load_model", fake_model)
+    monkeypatch.setattr(
+        app, "postal_codes", FileResource("postal_codes", "NL.txt", fake_postal_codes)
+    )
+    monkeypatch.setattr(
+        app, "model_registry", ModelRegistry("model", "model.pickle", fake_model)
+    )
     monkeypatch.setattr(app_helpers, "delete", lambda x: FakeWhere())
     # patch create treatment groups and add column to the dataframe
     monkeypatch.setattr(
@@ -98,12 +157,661 @@ async def test_predict_endpoint_empty_appointments(monkeypatch):
 
     # empty appointments
     with pytest.raises(Exception) as exc_info_empty:
-        __ = await predict([], "2024-07-16", FakeDB(), "test")
+        __ = await predict([], "2024-07-16", FakeDB(), "test", StageTimer())
     assert "400: Input cannot be empty." in str(exc_info_empty.value)
 
     # no appointments for the start date
     with pytest.raises(Exception) as exc_inf_wrong_date:
-        __ = await predict(appointments_pydantic, "2024-07-15", FakeDB(), "test")
+        __ = await predict(
+            appointments_pydantic, "2024-07-15", FakeDB(), "test", StageTimer()
+        )
     assert "400: No appointments for the start date and filters" in str(
         exc_inf_wrong_date.value
     )
+
+
+def test_file_resource_reloads_on_change(tmp_path):
+    resource_path = tmp_path / "resource.csv"
+    resource_path.write_text("value\n1\n")
+    resource = FileResource("test", resource_path, pd.read_csv)
+    assert not resource.ready
+
+    assert resource.get()["value"].to_list() == [1]
+    assert resource.ready
+    assert not resource.reload_if_changed()
+
+    resource_path.write_text("value\n2\n")
+    os.utime(resource_path, (0, 0))
+    assert resource.get()["value"].to_list() == [2]
+
+
+def test_file_resource_keeps_value_on_failed_reload(tmp_path):
+    resource_path = tmp_path / "resource.csv"
+    resource_path.write_text("value\n1\n")
+    resource = FileResource("test", resource_path, pd.read_csv)
+    resource.load()
+
+    resource_path.unlink()
+    assert resource.get()["value"].to_list() == [1]
+
+
+def test_file_resource_skips_failed_file_until_changed(tmp_path):
+    resource_path = tmp_path / "resource.csv"
+    resource_path.write_text("value\n1\n")
+    calls = []
+
+    def loader(path):
+        calls.append(path)
+        return pd.read_csv(path)
+
+    resource = FileResource("test", resource_path, loader)
+    resource.load()
+
+    resource_path.write_text("")
+    os.utime(resource_path, (0, 0))
+    for _ in range(3):
+        assert resource.get()["value"].to_list() == [1]
+    # The broken file is only loaded once
+    assert len(calls) == 2
+    assert resource.status()["error"] is not None
+
+    resource_path.write_text("value\n2\n")
+    os.utime(resource_path, (1, 1))
+    assert resource.get()["value"].to_list() == [2]
+    assert len(calls) == 3
+    assert resource.status()["error"] is None
+
+
+def test_model_registry_swaps_model_on_change(tmp_path):
+    model_path = tmp_path / "model.pickle"
+    with model_path.open("wb") as f:
+        pickle.dump(DummyClassifier(strategy="prior"), f)
+    registry = ModelRegistry("model", model_path, app_helpers.load_model)
+
+    first = registry.get()
+    assert first.version == registry.version
+    assert first.model.strategy == "prior"
+
+    # Same content, new modification time: the model is not unpickled again
+    os.utime(model_path, (0, 0))
+    assert registry.get() is first
+
+    with model_path.open("wb") as f:
+        pickle.dump(DummyClassifier(strategy="uniform"), f)
+    os.utime(model_path, (1, 1))
+    second = registry.get()
+    assert second.version != first.version
+    assert second.model.strategy == "uniform"
+    # Requests that already had the first model keep using it
+    assert first.model.strategy == "prior"
+
+
+@pytest.mark.asyncio
+async def test_health_endpoint(monkeypatch):
+    monkeypatch.setattr(
+        app, "postal_codes", FileResource("postal_codes", "NL.txt", fake_postal_codes)
+    )
+    monkeypatch.setattr(
+        app, "model_registry", ModelRegistry("model", "model.pickle", fake_model)
+    )
+    response = TestClient(app.app).get("/health")
+    assert response.status_code == 503
+    assert response.json()["status"] == "not ready"
+
+    app.postal_codes.load()
+    app.model_registry.load()
+    response = TestClient(app.app).get("/health")
+    assert response.status_code == 200
+    assert response.json()["resources"]["postal_codes"]["ready"]
+
+
+def test_run_prediction_pipeline_twice(monkeypatch):
+    monkeypatch.setattr(app, "get_bins", fake_bins)
+    monkeypatch.setattr(
+        app, "postal_codes", FileResource("postal_codes", "NL.txt", fake_postal_codes)
+    )
+    monkeypatch.setattr(
+        app, "model_registry", ModelRegistry("model", "model.pickle", fake_model)
+    )
+    monkeypatch.setattr(
+        app, "create_treatment_groups", lambda x, y, z, q: x.assign(treatment_group=1)
+    )
+    monkeypatch.setattr(app, "CLINIC_CONFIG", create_unit_test_clinic_config())
+    monkeypatch.setattr(app_helpers, "CLINIC_CONFIG", create_unit_test_clinic_config())
+
+    appointments_df = load_appointment_pydantic(fake_appointments())
+    assert appointments_df["start"].dt.tz is not None
+
+    db = create_test_session()
+    assert app.run_prediction_pipeline(appointments_df.copy(), "2024-07-16", db) == 5
+    first_ids = set(db.scalars(select(ApiPrediction.id)).all())
+
+    # The same payload updates the predictions instead of inserting new ones
+    assert app.run_prediction_pipeline(appointments_df.copy(), "2024-07-16", db) == 5
+    assert set(db.scalars(select(ApiPrediction.id)).all()) == first_ids
+    assert (
+        db.scalar(
+            select(func.count()).select_from(ApiPrediction).where(ApiPrediction.active)
+        )
+        == 5
+    )
+
+
+def _prediction_rows(predictions: list[float]) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "pseudo_id": ["p1", "p1", "p2"],
+            "start": pd.to_datetime(
+                ["2024-07-16 09:00", "2024-07-16 10:00", "2024-07-16 09:00"]
+            ),
+            "prediction": predictions,
+            "APP_ID": ["a1", "a2", "a3"],
+            "clinic": ["longziekten"] * 3,
+            "hoofdagenda": ["Longziekten"] * 3,
+            "description": ["Balie 1"] * 3,
+            "patient_id": ["h1", "h1", "h2"],
+            "name_text": ["Patient 1", "Patient 1", None],
+            "name_given1_callMe": ["P1", "P1", "P2"],
+            "telecom1_value": ["0600000001", "0600000001", "0600000002"],
+            "telecom2_value": [None, None, None],
+            "telecom3_value": [None, None, None],
+            "birthDate": pd.to_datetime(["1990-01-01", "1990-01-01", "1980-01-01"]),
+            "treatment_group": [1, 1, 0],
+        }
+    )
+
+
+def _api_request() -> ApiRequest:
+    return ApiRequest(
+        timestamp=datetime(2024, 7, 16),
+        response_code=200,
+        response_message="success",
+        endpoint="predict",
+        runtime=0.0,
+        api_version="test",
+    )
+
+
+def test_store_predictions_bulk_upsert(monkeypatch):
+    monkeypatch.setattr(app_helpers, "CLINIC_CONFIG", create_unit_test_clinic_config())
+    db = create_test_session()
+
+    ids = store_predictions(_prediction_rows([0.1, 0.2, 0.3]), db, _api_request())
+    assert len(set(ids)) == 3
+    assert db.get(ApiSensitiveInfo, "p2").full_name == ""
+    assert db.get(ApiPatient, "p2").treatment_group == 0
+
+    updated_rows = _prediction_rows([0.5, 0.6, 0.7])
+    updated_rows["telecom1_value"] = "0611111111"
+    # Also store a new appointment in the same request
+    new_row = updated_rows.iloc[[2]].assign(
+        APP_ID="a4", start=pd.Timestamp("2024-07-17 09:00")
+    )
+    updated_rows = pd.concat([updated_rows, new_row], ignore_index=True)
+    second_request = _api_request()
+    db.expire_all()
+    updated_ids = store_predictions(updated_rows, db, second_request)
+
+    assert updated_ids[:3] == ids
+    assert updated_ids[3] not in ids
+    assert db.scalar(select(func.count()).select_from(ApiPrediction)) == 4
+    prediction = db.get(ApiPrediction, ids[0])
+    assert prediction.prediction == 0.5
+    assert prediction.request_id == second_request.id
+    assert db.get(ApiSensitiveInfo, "p1").mobile_phone == "0611111111"
+
+
+@pytest.mark.parametrize("max_in_values", [1000, 1])
+def test_fix_outdated_appointments(monkeypatch, max_in_values):
+    monkeypatch.setattr(app_helpers, "CLINIC_CONFIG", create_unit_test_clinic_config())
+    db = create_test_session()
+    ids = store_predictions(_prediction_rows([0.1, 0.2, 0.3]), db, _api_request())
+
+    n_inactive = fix_outdated_appointments(
+        db, ids[1:], "2024-07-16", max_in_values=max_in_values
+    )
+
+    assert n_inactive == 1
+    active = db.scalars(select(ApiPrediction.id).where(ApiPrediction.active)).all()
+    assert sorted(active) == sorted(ids[1:])
+    # The staging table is removed, so the function can be called again
+    assert fix_outdated_appointments(db, ids[1:], "2024-07-16", max_in_values) == 0
+
+
+@pytest.mark.asyncio
+async def test_prediction_executor_keeps_event_loop_free():
+    executor = PredictionExecutor(max_workers=1, max_queued=0, timeout=10)
+    release = threading.Event()
+    prediction = asyncio.create_task(executor.run(lambda _: release.wait(5)))
+    await asyncio.sleep(0.01)
+
+    # The event loop still answers other requests while the pipeline runs
+    assert (await app.root()) == {"message": "UMCU <3"}
+    # but new predictions are refused when all workers are busy
+    with pytest.raises(HTTPException) as exc_info:
+        await executor.run(lambda _: None)
+    assert exc_info.value.status_code == 503
+
+    release.set()
+    assert await prediction
+    assert executor.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_prediction_executor_timeout():
+    executor = PredictionExecutor(max_workers=1, max_queued=1, timeout=0.01)
+
+    def slow_pipeline(deadline):
+        threading.Event().wait(0.05)
+        check_deadline(deadline, "store_predictions")
+        return "stored"
+
+    with pytest.raises(HTTPException) as exc_info:
+        await executor.run(slow_pipeline)
+    assert exc_info.value.status_code == 504
+
+
+@pytest.mark.asyncio
+async def test_predict_timeout_does_not_store(monkeypatch):
+    monkeypatch.setattr(app, "get_bins", fake_bins)
+    monkeypatch.setattr(
+        app, "postal_codes", FileResource("postal_codes", "NL.txt", fake_postal_codes)
+    )
+    monkeypatch.setattr(
+        app, "model_registry", ModelRegistry("model", "model.pickle", fake_model)
+    )
+    monkeypatch.setattr(
+        app, "create_treatment_groups", lambda x, y, z, q: x.assign(treatment_group=1)
+    )
+    monkeypatch.setattr(app, "CLINIC_CONFIG", create_unit_test_clinic_config())
+    monkeypatch.setattr(app_helpers, "CLINIC_CONFIG", create_unit_test_clinic_config())
+    session_maker = create_test_sessionmaker()
+    monkeypatch.setattr(app, "SessionLocal", session_maker)
+    executor = PredictionExecutor(max_workers=1, max_queued=0, timeout=0.2)
+    monkeypatch.setattr(app, "prediction_executor", executor)
+    finished = threading.Event()
+
+    # The deadline passes in the last stage before the predictions are stored
+    def slow_remove_sensitive_info(*args, **kwargs):
+        threading.Event().wait(0.4)
+        finished.set()
+        return 0
+
+    monkeypatch.setattr(app, "remove_sensitive_info", slow_remove_sensitive_info)
+    monkeypatch.setenv("X_API_KEY", "test")
+
+    request_db = session_maker()
+    with pytest.raises(HTTPException) as exc_info:
+        await predict(
+            fake_appointments(), "2024-07-16", request_db, "test", StageTimer()
+        )
+    assert exc_info.value.status_code == 504
+    request_db.close()
+
+    assert finished.wait(5)
+    for _ in range(100):
+        if executor.pending == 0:
+            break
+        await asyncio.sleep(0.01)
+    with session_maker() as db:
+        assert db.scalar(select(func.count()).select_from(ApiPrediction)) == 0
+        assert db.scalar(select(func.count()).select_from(ApiRequest)) == 0
+
+
+def test_prediction_job(monkeypatch):
+    monkeypatch.setattr(app, "get_bins", fake_bins)
+    monkeypatch.setattr(
+        app, "postal_codes", FileResource("postal_codes", "NL.txt", fake_postal_codes)
+    )
+    monkeypatch.setattr(
+        app, "model_registry", ModelRegistry("model", "model.pickle", fake_model)
+    )
+    monkeypatch.setattr(
+        app, "create_treatment_groups", lambda x, y, z, q: x.assign(treatment_group=1)
+    )
+    monkeypatch.setattr(app, "CLINIC_CONFIG", create_unit_test_clinic_config())
+    monkeypatch.setattr(app_helpers, "CLINIC_CONFIG", create_unit_test_clinic_config())
+    monkeypatch.setattr(app, "SessionLocal", create_test_sessionmaker())
+    monkeypatch.setenv("X_API_KEY", "test")
+
+    with (Path(__file__).parent / "data" / "test_appointments.json").open() as f:
+        appointments_json = json.load(f)
+
+    client = TestClient(app.app)
+    response = client.post(
+        "/predict/jobs",
+        params={"start_date": "2024-07-16"},
+        json=appointments_json,
+        headers={"X-API-KEY": "test"},
+    )
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    for _ in range(100):
+        status = client.get(
+            f"/predict/jobs/{job_id}", headers={"X-API-KEY": "test"}
+        ).json()
+        if status["status"] not in ("queued", "running"):
+            break
+        time.sleep(0.05)
+
+    assert status["status"] == "finished"
+    assert status["n_predictions"] == 5
+    assert status["progress"] == 1
+    assert set(status["stage_timings"]) == set(PREDICTION_STAGES)
+
+    # Finished jobs are also available from the ApiRequest table
+    app.job_store._jobs.clear()
+    status = client.get(f"/predict/jobs/{job_id}", headers={"X-API-KEY": "test"})
+    assert status.json()["status"] == "finished"
+    assert status.json()["message"] == "5 predictions created and stored in db."
+
+    missing = client.get("/predict/jobs/999", headers={"X-API-KEY": "test"})
+    assert missing.status_code == 404
+
+
+@pytest.mark.parametrize("payload_format", ["arrow", "parquet"])
+def test_predict_arrow_endpoint(monkeypatch, payload_format):
+    monkeypatch.setattr(app, "get_bins", fake_bins)
+    monkeypatch.setattr(
+        app, "postal_codes", FileResource("postal_codes", "NL.txt", fake_postal_codes)
+    )
+    monkeypatch.setattr(
+        app, "model_registry", ModelRegistry("model", "model.pickle", fake_model)
+    )
+    monkeypatch.setattr(
+        app, "create_treatment_groups", lambda x, y, z, q: x.assign(treatment_group=1)
+    )
+    monkeypatch.setattr(app, "CLINIC_CONFIG", create_unit_test_clinic_config())
+    monkeypatch.setattr(app_helpers, "CLINIC_CONFIG", create_unit_test_clinic_config())
+    monkeypatch.setattr(app, "SessionLocal", create_test_sessionmaker())
+    monkeypatch.setenv("X_API_KEY", "test")
+
+    with (Path(__file__).parent / "data" / "test_appointments.json").open() as f:
+        table = pa.Table.from_pylist(json.load(f))
+
+    sink = pa.BufferOutputStream()
+    if payload_format == "arrow":
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        pq.write_table(table, sink)
+
+    client = TestClient(app.app)
+    response = client.post(
+        "/predict/arrow",
+        params={"start_date": "2024-07-16"},
+        content=sink.getvalue().to_pybytes(),
+        headers={"X-API-KEY": "test"},
+    )
+    assert response.status_code == 200
+    assert response.json() == {"message": "5 predictions created and stored in db."}
+
+    response = client.post(
+        "/predict/arrow",
+        params={"start_date": "2024-07-16"},
+        content=b"not an arrow stream",
+        headers={"X-API-KEY": "test"},
+    )
+    assert response.status_code == 422
+
+
+def test_histogram_render():
+    histogram = metrics.Histogram(
+        "test_duration_seconds", "Test.", labelnames=("stage",), buckets=(0.1, 1)
+    )
+    histogram.observe(0.05, stage="a")
+    histogram.observe(0.5, stage="a")
+    histogram.observe(5, stage="a")
+
+    assert histogram.render().splitlines() == [
+        "# HELP test_duration_seconds Test.",
+        "# TYPE test_duration_seconds histogram",
+        'test_duration_seconds_bucket{stage="a",le="0.1"} 1',
+        'test_duration_seconds_bucket{stage="a",le="1"} 2',
+        'test_duration_seconds_bucket{stage="a",le="+Inf"} 3',
+        'test_duration_seconds_sum{stage="a"} 5.55',
+        'test_duration_seconds_count{stage="a"} 3',
+    ]
+    with pytest.raises(ValueError):
+        histogram.observe(1)
+
+
+def test_metric_requires_samples():
+    class IncompleteMetric(metrics._Metric):
+        pass
+
+    with pytest.raises(TypeError):
+        IncompleteMetric("test_incomplete", "Test.")
+
+
+def test_metrics_endpoint(monkeypatch):
+    monkeypatch.setattr(app, "get_bins", fake_bins)
+    monkeypatch.setattr(
+        app, "postal_codes", FileResource("postal_codes", "NL.txt", fake_postal_codes)
+    )
+    monkeypatch.setattr(
+        app, "model_registry", ModelRegistry("model", "model.pickle", fake_model)
+    )
+    monkeypatch.setattr(
+        app, "create_treatment_groups", lambda x, y, z, q: x.assign(treatment_group=1)
+    )
+    monkeypatch.setattr(app, "CLINIC_CONFIG", create_unit_test_clinic_config())
+    monkeypatch.setattr(app_helpers, "CLINIC_CONFIG", create_unit_test_clinic_config())
+    monkeypatch.setattr(app, "SessionLocal", create_test_sessionmaker())
+    monkeypatch.setenv("X_API_KEY", "test")
+
+    with (Path(__file__).parent / "data" / "test_appointments.json").open() as f:
+        appointments_json = json.load(f)
+
+    stored_before = metrics.predictions_stored.value()
+    predict_proba_before = metrics.stage_duration.count(stage="predict_proba")
+
+    client = TestClient(app.app)
+    response = client.post(
+        "/predict",
+        params={"start_date": "2024-07-16"},
+        json=appointments_json,
+        headers={"X-API-KEY": "test"},
+    )
+    assert response.status_code == 200
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert metrics.predictions_stored.value() == stored_before + 5
+    assert metrics.stage_duration.count(stage="predict_proba") == (
+        predict_proba_before + 1
+    )
+    assert (
+        metrics.resource_loads.value(resource="model", kind="load", result="success")
+        >= 1
+    )
+    assert 'noshow_http_request_duration_seconds_count{path="/predict"' in (
+        response.text
+    )
+    assert "noshow_prediction_requests_pending 0" in response.text
+
+
+@pytest.mark.asyncio
+async def test_predict_incremental_features(monkeypatch):
+    appointments_pydantic = fake_appointments()
+    monkeypatch.setattr(app, "get_bins", fake_bins)
+    monkeypatch.setattr(
+        app, "postal_codes", FileResource("postal_codes", "NL.txt", fake_postal_codes)
+    )
+    monkeypatch.setattr(
+        app, "model_registry", ModelRegistry("model", "model.pickle", fake_model)
+    )
+    monkeypatch.setattr(
+        app, "create_treatment_groups", lambda x, y, z, q: x.assign(treatment_group=1)
+    )
+    monkeypatch.setattr(app, "CLINIC_CONFIG", create_unit_test_clinic_config())
+    monkeypatch.setattr(app_helpers, "CLINIC_CONFIG", create_unit_test_clinic_config())
+    monkeypatch.setattr(
+        app,
+        "API_CONFIG",
+        app.API_CONFIG.model_copy(update={"incremental_features": True}),
+    )
+    monkeypatch.setenv("DB_USER", "")
+    monkeypatch.setenv("X_API_KEY", "test")
+    session_maker = create_test_sessionmaker()
+    monkeypatch.setattr(app, "SessionLocal", session_maker)
+    db = session_maker()
+
+    # Without a stored state the full history is needed
+    with pytest.raises(HTTPException) as exc_info:
+        await predict(
+            appointments_pydantic, "2024-07-16", db, "test", StageTimer(), "2024-07-01"
+        )
+    assert exc_info.value.status_code == 409
+
+    output = await predict(
+        appointments_pydantic, "2024-07-16", db, "test", StageTimer()
+    )
+    assert output == {"message": "5 predictions created and stored in db."}
+    state = {row.pseudo_id: row for row in db.scalars(select(ApiPatientState))}
+    assert len(state) == 5
+    assert state["937GN3KD12"].n_no_show == 1
+    assert state["937GN3KD12"].n_appointments == 1
+
+    output = await predict(
+        appointments_pydantic, "2024-07-16", db, "test", StageTimer(), "2024-07-01"
+    )
+    assert output == {"message": "5 predictions created and stored in db."}
+
+    # The payload has to cover the appointments that are not in the state yet
+    with pytest.raises(HTTPException) as exc_info:
+        await predict(
+            appointments_pydantic, "2024-07-16", db, "test", StageTimer(), "2024-07-10"
+        )
+    assert exc_info.value.status_code == 400
+
+
+@pytest.fixture
+def delta_payload_db(monkeypatch):
+    """Database session of the API with delta payloads enabled.
+
+    Returns the session and the list the feature table of every request is
+    appended to.
+    """
+    monkeypatch.setattr(app, "get_bins", fake_bins)
+    monkeypatch.setattr(
+        app, "postal_codes", FileResource("postal_codes", "NL.txt", fake_postal_codes)
+    )
+    monkeypatch.setattr(
+        app, "model_registry", ModelRegistry("model", "model.pickle", fake_model)
+    )
+    monkeypatch.setattr(
+        app, "create_treatment_groups", lambda x, y, z, q: x.assign(treatment_group=1)
+    )
+    monkeypatch.setattr(app, "CLINIC_CONFIG", create_unit_test_clinic_config())
+    monkeypatch.setattr(app_helpers, "CLINIC_CONFIG", create_unit_test_clinic_config())
+    monkeypatch.setattr(
+        app, "API_CONFIG", app.API_CONFIG.model_copy(update={"delta_payloads": True})
+    )
+    featuretables = []
+
+    def create_prediction_features(*args, **kwargs):
+        featuretable = original_create_prediction_features(*args, **kwargs)
+        featuretables.append(featuretable)
+        return featuretable
+
+    original_create_prediction_features = app.create_prediction_features
+    monkeypatch.setattr(app, "create_prediction_features", create_prediction_features)
+    monkeypatch.setenv("DB_USER", "")
+    monkeypatch.setenv("X_API_KEY", "test")
+    session_maker = create_test_sessionmaker()
+    monkeypatch.setattr(app, "SessionLocal", session_maker)
+    return session_maker(), featuretables
+
+
+@pytest.mark.asyncio
+async def test_predict_delta_payload(delta_payload_db):
+    db, featuretables = delta_payload_db
+    appointments_pydantic = fake_appointments()
+
+    # A delta payload needs a stored history
+    with pytest.raises(HTTPException) as exc_info:
+        await predict(
+            appointments_pydantic,
+            "2024-07-16",
+            db,
+            "test",
+            StageTimer(),
+            None,
+            "2024-07-15T12:00:00",
+        )
+    assert exc_info.value.status_code == 409
+
+    output = await predict(
+        appointments_pydantic, "2024-07-16", db, "test", StageTimer()
+    )
+    assert output["message"] == "5 predictions created and stored in db."
+    assert db.scalar(select(func.count()).select_from(ApiAppointment)) == 13
+
+    # Only the appointments on the start date are sent again
+    delta = [
+        a for a in appointments_pydantic if a.start.date().isoformat() >= "2024-07-16"
+    ]
+    delta_output = await predict(
+        delta, "2024-07-16", db, "test", StageTimer(), None, output["watermark"]
+    )
+    assert delta_output["message"] == "5 predictions created and stored in db."
+    assert delta_output["watermark"] > output["watermark"]
+    pd.testing.assert_frame_equal(featuretables[1], featuretables[0])
+
+    # An outdated watermark means a request was missed
+    with pytest.raises(HTTPException) as exc_info:
+        await predict(
+            delta, "2024-07-16", db, "test", StageTimer(), None, output["watermark"]
+        )
+    assert exc_info.value.status_code == 409
+
+
+def start_date_appointments(appointments: list, pseudo_ids: set[str]) -> list:
+    return [
+        a
+        for a in appointments
+        if a.pseudo_id in pseudo_ids and a.start.date().isoformat() >= "2024-07-16"
+    ]
+
+
+@pytest.mark.asyncio
+async def test_predict_delta_payload_new_patient(delta_payload_db):
+    db, _ = delta_payload_db
+    appointments_pydantic = fake_appointments()
+
+    full = [a for a in appointments_pydantic if a.pseudo_id != "K486HCF13H"]
+    output = await predict(full, "2024-07-16", db, "test", StageTimer())
+
+    # The history of K486HCF13H was never stored, so it would have no features
+    delta = start_date_appointments(appointments_pydantic, {"K486HCF13H"})
+    with pytest.raises(HTTPException) as exc_info:
+        await predict(
+            delta, "2024-07-16", db, "test", StageTimer(), None, output["watermark"]
+        )
+    assert exc_info.value.status_code == 409
+
+
+@pytest.mark.asyncio
+async def test_predict_delta_payload_after_other_patients(delta_payload_db):
+    db, featuretables = delta_payload_db
+    appointments_pydantic = fake_appointments()
+
+    await predict(appointments_pydantic, "2024-07-16", db, "test", StageTimer())
+    # A full payload of other patients keeps the history of K486HCF13H
+    others = [a for a in appointments_pydantic if a.pseudo_id != "K486HCF13H"]
+    output = await predict(others, "2024-07-16", db, "test", StageTimer())
+    assert db.scalar(select(func.count()).select_from(ApiAppointment)) == 13
+
+    delta = start_date_appointments(appointments_pydantic, {"K486HCF13H"})
+    delta_output = await predict(
+        delta, "2024-07-16", db, "test", StageTimer(), None, output["watermark"]
+    )
+    assert delta_output["message"] == "1 predictions created and stored in db."
+    full_features = featuretables[0].loc[featuretables[2].index]
+    pd.testing.assert_frame_equal(
+        featuretables[2], full_features, check_dtype=False, check_categorical=False
+    )
+    assert featuretables[2]["earlier_appointments"].to_list() == [3]
@@ -1,3 +1,4 @@
+import pandas as pd
 from test_noshow import fake_appointments
 
 from noshow.config import ClinicConfig
@@ -89,3 +90,54 @@ def test_exclude_appcodes():
 
     filtered_df = apply_config_filters(appointments_df, clinic_config)
     assert filtered_df.shape[0] == 8
+
+
+def _filter_per_clinic(appointments_df, clinic_config):
+    """Reference implementation with a filtered copy per clinic"""
+    clinic_df_list = []
+    for name, config in clinic_config.items():
+        clinic_df = appointments_df.loc[
+            appointments_df["hoofdagenda_id"].isin(config.main_agenda_codes)
+        ].copy()
+        clinic_df["clinic"] = name
+        if config.subagendas:
+            in_subagendas = clinic_df["subagenda_id"].isin(config.subagendas)
+            clinic_df = clinic_df.loc[
+                ~in_subagendas if config.subagenda_exclude else in_subagendas
+            ]
+        if config.appcodes:
+            in_appcodes = clinic_df["afspraak_code"].isin(config.appcodes)
+            clinic_df = clinic_df.loc[
+                ~in_appcodes if config.appcode_exclude else in_appcodes
+            ]
+        clinic_df_list.append(clinic_df)
+    return pd.concat(clinic_df_list)
+
+
+def test_overlapping_clinics_match_filter_per_clinic():
+    appointments_df = load_appointment_pydantic(fake_appointments())
+    appointments_df.loc[0, "subagenda_id"] = None
+
+    def clinic(agendas, subagendas, subagenda_exclude, appcodes, appcode_exclude):
+        return ClinicConfig(
+            include_rct=True,
+            phone_number="58831",
+            teleq_name="Totaalagenda1",
+            main_agenda_codes=agendas,
+            subagenda_exclude=subagenda_exclude,
+            subagendas=subagendas,
+            appcode_exclude=appcode_exclude,
+            appcodes=appcodes,
+        )
+
+    clinic_config = {
+        "second": clinic(["H2", "H1"], [], False, ["H46"], True),
+        "first": clinic(["H1", "H1"], ["S1"], True, [], False),
+        "third": clinic(["H1", "H2", "H3"], ["S1"], False, [], False),
+        "empty": clinic(["X1"], [], False, [], False),
+    }
+
+    filtered_df = apply_config_filters(appointments_df, clinic_config)
+    expected = _filter_per_clinic(appointments_df, clinic_config)
+    pd.testing.assert_frame_equal(filtered_df, expected)
+    assert filtered_df.index.duplicated().any()
@@ -0,0 +1,156 @@
+import json
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from test_noshow import fake_appointments
+
+from noshow.database import export
+from noshow.database.export import (
+    MANIFEST_FILE,
+    date_partitions,
+    export_incremental,
+    export_partitions,
+    write_parquet,
+)
+from noshow.preprocessing.load_data import (
+    compare_appointment_dataset,
+    load_appointment_parquet,
+    load_appointment_pydantic,
+    update_appointment_dataset,
+)
+from noshow.preprocessing.schema import APPOINTMENT_ARROW_SCHEMA, APPOINTMENT_DATETIMES
+
+
+def test_write_parquet(tmp_path):
+    export_df = load_appointment_pydantic(fake_appointments())
+    export_df = export_df[APPOINTMENT_ARROW_SCHEMA.names]
+    for column in APPOINTMENT_DATETIMES:
+        export_df[column] = export_df[column].dt.tz_localize(None)
+    export_df["extra"] = 1
+
+    engine = create_engine("sqlite://")
+    with engine.connect() as conn:
+        export_df.astype({"pseudo_id": str}).to_sql("export", conn, index=False)
+        result = conn.execute(text("SELECT * FROM export"))
+        progress = []
+        n_rows = write_parquet(
+            result,
+            tmp_path / "export.parquet",
+            batch_size=4,
+            row_group_size=8,
+            progress=lambda n, rate: progress.append(n),
+        )
+
+    assert n_rows == len(export_df)
+    assert progress == [4, 8, 12, 13]
+    parquet_file = pq.ParquetFile(tmp_path / "export.parquet")
+    assert parquet_file.metadata.num_row_groups == 2
+    # Columns of the export have a fixed type, other columns are strings
+    assert parquet_file.schema_arrow.field("start").type == pa.timestamp("ns")
+    assert parquet_file.schema_arrow.field("BIRTH_YEAR").type == pa.int16()
+    assert parquet_file.schema_arrow.field("extra").type == pa.string()
+
+    update_appointment_dataset(tmp_path / "export.parquet", tmp_path / "export")
+    appointments_df = load_appointment_parquet(tmp_path / "export", columns=None)
+    assert sorted(appointments_df["APP_ID"]) == sorted(export_df["APP_ID"].astype(str))
+    assert sorted(appointments_df["start"]) == sorted(export_df["start"])
+
+
+def test_export_partitions(tmp_path, monkeypatch):
+    export_df = load_appointment_pydantic(fake_appointments())
+    export_df = export_df[APPOINTMENT_ARROW_SCHEMA.names].astype({"pseudo_id": str})
+    for column in APPOINTMENT_DATETIMES:
+        export_df[column] = export_df[column].dt.tz_localize(None)
+    engine = create_engine(f"sqlite:///{tmp_path / 'export.db'}")
+    with engine.begin() as conn:
+        export_df.to_sql("export", conn, index=False)
+    sql_query = "SELECT * FROM export\nORDER BY [start]"
+    partitions = date_partitions("2024-01-01", "2025-01-01", freq="MS")
+    assert len(partitions) == 12
+
+    # Every partition fails once, July keeps failing
+    attempts = []
+
+    def flaky_write_parquet(result, output_path, batch_size):
+        attempts.append(output_path.name)
+        if attempts.count(output_path.name) == 1 or "20240701" in output_path.name:
+            raise OperationalError("SELECT", {}, Exception("connection lost"))
+        return write_parquet(result, output_path, batch_size)
+
+    monkeypatch.setattr(export, "write_parquet", flaky_write_parquet)
+    with pytest.raises(RuntimeError, match="part-20240701"):
+        export_partitions(
+            engine, sql_query, tmp_path / "parts", partitions, retries=2, retry_delay=0
+        )
+    manifest = json.loads((tmp_path / "parts" / MANIFEST_FILE).read_text())
+    assert len(manifest["partitions"]) == 11
+    assert {record["attempts"] for record in manifest["partitions"].values()} == {2}
+
+    # Rerunning only exports the failed partition
+    attempts.clear()
+    monkeypatch.setattr(export, "write_parquet", write_parquet)
+    manifest = export_partitions(
+        engine, sql_query, tmp_path / "parts", partitions, retry_delay=0
+    )
+    assert len(manifest["partitions"]) == 12
+    n_rows = sum(record["rows"] for record in manifest["partitions"].values())
+    assert n_rows == (export_df["start"] >= "2024-01-01").sum()
+
+    update_appointment_dataset(tmp_path / "parts", tmp_path / "dataset")
+    appointments_df = load_appointment_parquet(tmp_path / "dataset")
+    assert len(appointments_df) == n_rows
+
+
+def test_export_incremental(tmp_path):
+    export_df = load_appointment_pydantic(fake_appointments())
+    export_df = export_df[APPOINTMENT_ARROW_SCHEMA.names].astype({"pseudo_id": str})
+    for column in APPOINTMENT_DATETIMES:
+        export_df[column] = export_df[column].dt.tz_localize(None)
+    export_df = export_df.astype(
+        {column: object for column in export_df.select_dtypes("category")}
+    )
+    export_df["APP_ID"] = export_df["APP_ID"].astype(str)
+    engine = create_engine(f"sqlite:///{tmp_path / 'export.db'}")
+    sql_query = "SELECT * FROM export\nORDER BY [start]"
+    dataset_path = tmp_path / "dataset"
+
+    def dataset_ids():
+        return load_appointment_parquet(dataset_path)["APP_ID"].to_list()
+
+    # The first export is a full export
+    first_export = export_df.loc[export_df["end"] < "2024-07-14"]
+    with engine.begin() as conn:
+        first_export.to_sql("export", conn, index=False)
+    state = export_incremental(engine, sql_query, dataset_path)
+    assert state["full_refresh"] and state["rows"] == 8
+    assert state["watermark"] == "2024-07-13 14:00:00"
+
+    # New appointments, a change within the lookback (that also moves the
+    # appointment to another month) and a change before the lookback
+    export_df.loc[export_df["APP_ID"] == "6783216597", "start"] = pd.Timestamp(
+        "2024-06-20 13:45"
+    )
+    export_df.loc[export_df["APP_ID"] == "4763486528", "mutationReason_code"] = "X"
+    with engine.begin() as conn:
+        export_df.to_sql("export", conn, index=False, if_exists="replace")
+    state = export_incremental(engine, sql_query, dataset_path)
+    assert not state["full_refresh"]
+    assert (state["rows"], state["new"], state["updated"]) == (7, 5, 2)
+    assert sorted(dataset_ids()) == sorted(export_df["APP_ID"])
+
+    full_export = pa.Table.from_pandas(export_df, preserve_index=False)
+    assert compare_appointment_dataset(dataset_path, full_export) == {
+        "missing": 0,
+        "extra": 0,
+        "changed": 1,
+    }
+
+    # The full refresh reports and fixes the change before the lookback
+    state = export_incremental(engine, sql_query, dataset_path, full_refresh=True)
+    assert state["differences"]["changed"] == 1
+    assert compare_appointment_dataset(dataset_path, full_export)["changed"] == 0
+    assert sorted(dataset_ids()) == sorted(export_df["APP_ID"])
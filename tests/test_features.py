@@ -1,9 +1,43 @@
+import numpy as np
 import pandas as pd
+import pytest
+from test_noshow import (
+    create_unit_test_clinic_config,
+    fake_appointments,
+    fake_postal_codes,
+)
 
 from noshow.features.appointment_features import add_minutes_early
-from noshow.features.cumulative_features import calc_cumulative_features
+from noshow.features.cumulative_features import (
+    CumulativeFeature,
+    calc_cumulative_features,
+    calc_history_features,
+)
+from noshow.features.feature_cache import cached_featuretable, featuretable_fingerprint
+from noshow.features.feature_pipeline import (
+    create_features,
+    select_feature_columns,
+    verify_patient_state,
+)
 from noshow.features.no_show_features import prev_no_show_features
 from noshow.features.patient_features import add_patient_features
+from noshow.features.patient_state import (
+    advance_patient_state,
+    calc_patient_state,
+    history_watermark,
+    inconsistent_patients,
+)
+from noshow.preprocessing.geo import (
+    PostalCodeIndex,
+    add_reference_distances,
+    haversine_distance,
+    haversine_distances,
+)
+from noshow.preprocessing.load_data import (
+    load_appointment_pydantic,
+    process_appointments,
+    process_postal_codes,
+)
 
 
 def test_cum_features():
@@ -36,6 +70,87 @@ def test_cum_features():
     assert output_df["count_out"].to_list() == [0, 0, 0, 1, 1, 2]
 
 
+def _rolling_reference(
+    df: pd.DataFrame, column_name: str, window: str, cumfunc: str, exclude: bool
+) -> pd.Series:
+    """Grouped cumsum minus grouped time-based rolling, as previously used"""
+    df = df.sort_index(level="start")
+    grouped = df.groupby(level="pseudo_id", sort=False)[column_name]
+    total = grouped.cumsum() if cumfunc == "sum" else grouped.cumcount() + 1
+    rolling = (
+        df.reset_index()
+        .set_index("start")
+        .groupby("pseudo_id", sort=False)[column_name]
+        .rolling(window)
+    )
+    in_window = rolling.sum() if cumfunc == "sum" else rolling.count()
+    df["out"] = (total - in_window) if exclude else in_window
+    return df["out"]
+
+
+@pytest.mark.parametrize("cumfunc", ["sum", "count"])
+@pytest.mark.parametrize("exclude_window", [True, False])
+@pytest.mark.parametrize("window", ["3D", "14D"])
+def test_history_features_match_rolling(cumfunc, exclude_window, window):
+    rng = np.random.default_rng(42)
+    n_rows = 2000
+    # Hourly grid, so there are ties between patients and exact window boundaries
+    test_df = (
+        pd.DataFrame(
+            {
+                "pseudo_id": rng.integers(0, 100, n_rows).astype(str),
+                "start": pd.Timestamp("2022-01-01")
+                + pd.to_timedelta(rng.integers(0, 24 * 60, n_rows), unit="h"),
+                "val": rng.normal(size=n_rows),
+            }
+        )
+        .drop_duplicates(["pseudo_id", "start"])
+        .set_index(["pseudo_id", "start"])
+    )
+    test_df.loc[test_df.sample(frac=0.1, random_state=1).index, "val"] = np.nan
+
+    expected = _rolling_reference(test_df, "val", window, cumfunc, exclude_window)
+    output_df = calc_history_features(
+        test_df.copy(),
+        [CumulativeFeature("val", "out", window, cumfunc, exclude_window)],
+    )
+
+    assert output_df.index.equals(expected.index)
+    pd.testing.assert_series_equal(output_df["out"], expected, check_names=False)
+
+
+@pytest.mark.parametrize("unit", ["s", "ms"])
+def test_history_features_datetime_unit(unit):
+    appointments_df = _shifted_history()
+    other_unit = appointments_df.copy()
+    other_unit.index = pd.MultiIndex.from_arrays(
+        [
+            appointments_df.index.get_level_values("pseudo_id"),
+            appointments_df.index.get_level_values("start").as_unit(unit),
+        ],
+        names=["pseudo_id", "start"],
+    )
+    watermark = history_watermark("2024-07-16", tz="UTC")
+
+    pd.testing.assert_frame_equal(
+        create_features(other_unit, fake_postal_codes()),
+        create_features(appointments_df, fake_postal_codes()),
+        check_index_type=False,
+    )
+    pd.testing.assert_frame_equal(
+        calc_patient_state(other_unit, watermark),
+        calc_patient_state(appointments_df, watermark),
+    )
+
+
+def test_history_features_invalid_cumfunc():
+    test_df = pd.DataFrame(
+        {"pseudo_id": ["1"], "start": pd.to_datetime(["2022-01-01"]), "val": [1]}
+    ).set_index(["pseudo_id", "start"])
+    with pytest.raises(NotImplementedError):
+        calc_history_features(test_df, [CumulativeFeature("val", "out", cumfunc="max")])
+
+
 def test_patient_features():
     test_df = pd.DataFrame(
         {
@@ -63,6 +178,90 @@ def test_patient_features():
     assert output_df["age"].to_list() == [31, 22]
 
 
+def test_haversine_distances_match_scalar():
+    latitudes = np.array([52.0238, 52.0846, 53.211872, 0])
+    longitudes = np.array([5.1842, 5.1637, 6.576597, 0])
+
+    distances = haversine_distances(latitudes, longitudes)
+
+    expected = [
+        haversine_distance(lat, lon)
+        for lat, lon in zip(latitudes, longitudes, strict=True)
+    ]
+    np.testing.assert_allclose(distances, expected)
+
+
+def test_process_postal_codes_adds_distances(tmp_path):
+    postalcodes_path = tmp_path / "NL.txt"
+    postalcodes_path.write_text(
+        "NL\t3584\tUtrecht\tUtrecht\t09\tUtrecht\t0344\t\t\t52.0846\t5.1637\t6\n"
+        "NL\t9724\tGroningen\tGroningen\t04\tGroningen\t0014\t\t\t53.2118\t6.5765\t6\n"
+    )
+
+    all_postalcodes = process_postal_codes(
+        postalcodes_path,
+        reference_locations={"umcu": (52.0859, 5.1796), "umcg": (53.2219, 6.5757)},
+    )
+
+    assert list(all_postalcodes.columns) == [
+        "latitude",
+        "longitude",
+        "dist_umcu",
+        "dist_umcg",
+    ]
+    assert all_postalcodes.loc[3584, "dist_umcu"] < 2
+    assert all_postalcodes.loc[9724, "dist_umcg"] < 2
+
+
+@pytest.mark.parametrize("policy", ["drop", "nan"])
+def test_patient_features_missing_postal_codes(policy, caplog):
+    test_df = pd.DataFrame(
+        {
+            "pseudo_id": ["1", "2", "3", "4"],
+            "start": pd.to_datetime(["2022-01-01"] * 4),
+            "BIRTH_YEAR": [1991, 2000, 1980, 1970],
+            "address_postalCodeNumbersNL": [3584, None, 1234, 99999],
+        }
+    ).set_index(["pseudo_id", "start"])
+    postal_code_index = PostalCodeIndex.from_frame(
+        pd.DataFrame(
+            {"postal_code": [3584], "latitude": [52.0846], "longitude": [5.1637]}
+        ).set_index("postal_code")
+    )
+
+    output_df = add_patient_features(test_df, postal_code_index, policy)
+
+    assert "3 appointments with a missing or unknown postal code" in caplog.text
+    assert output_df.loc["1", "dist_umcu"].item() < 2
+    if policy == "drop":
+        assert output_df.index.get_level_values("pseudo_id").to_list() == ["1"]
+    else:
+        assert len(output_df) == 4
+        assert output_df["dist_umcu"].isna().sum() == 3
+
+
+def test_postal_code_index_matches_merge():
+    postalcodes_df = add_reference_distances(
+        pd.DataFrame(
+            {
+                "postal_code": [3994, 2034, 3738, 9724],
+                "latitude": [52.0238, 52.3613, 52.155789, 53.211872],
+                "longitude": [5.1842, 4.6464, 5.177230, 6.576597],
+            }
+        ).set_index("postal_code")
+    )
+    codes = pd.Series([9724, 3994, 3994, 2034, 3738])
+
+    postal_code_index = PostalCodeIndex.from_frame(postalcodes_df)
+    positions, found = postal_code_index.positions(codes)
+
+    assert found.all()
+    expected = postalcodes_df.loc[codes, "dist_umcu"].to_numpy()
+    np.testing.assert_allclose(
+        postal_code_index.distances["dist_umcu"][positions], expected, rtol=1e-6
+    )
+
+
 def test_no_show_features():
     test_df = pd.DataFrame(
         {
@@ -119,3 +318,116 @@ def test_minutes_early():
 
     assert output_df.shape == (6, 4)
     assert output_df["prev_minutes_early"].to_list() == [0.0, 0.0, 0.0, 5.0, 5.0, -3.0]
+
+
+def _shifted_history(n_weeks: int = 10) -> pd.DataFrame:
+    """Repeat the test appointments in earlier weeks to create a longer history"""
+    appointments_df = process_appointments(
+        load_appointment_pydantic(fake_appointments()),
+        create_unit_test_clinic_config(),
+    )
+    history = []
+    for week in range(n_weeks):
+        shift = pd.Timedelta(weeks=week)
+        shifted = appointments_df.copy()
+        shifted.index = shifted.index.set_levels(
+            shifted.index.levels[1] - shift, level="start"
+        )
+        shifted["gearriveerd"] = shifted["gearriveerd"] - shift
+        history.append(shifted)
+    return pd.concat(history)
+
+
+def test_patient_state_features_match_full_history():
+    appointments_df = _shifted_history()
+
+    differences = verify_patient_state(
+        appointments_df, fake_postal_codes(), "2024-07-16"
+    )
+    assert differences.empty
+
+    patient_state = calc_patient_state(
+        appointments_df, history_watermark("2024-07-16", tz="UTC")
+    )
+    patient_state["n_no_show"] += 1
+    differences = verify_patient_state(
+        appointments_df, fake_postal_codes(), "2024-07-16", patient_state
+    )
+    assert not differences.empty
+
+
+def test_advance_patient_state():
+    appointments_df = _shifted_history()
+    watermark = history_watermark("2024-07-16", tz="UTC")
+    previous_state = calc_patient_state(
+        appointments_df, watermark - pd.Timedelta(days=20)
+    )
+
+    advanced = advance_patient_state(previous_state, appointments_df, watermark)
+    expected = calc_patient_state(appointments_df, watermark)
+    pd.testing.assert_frame_equal(advanced, expected.loc[advanced.index])
+    assert inconsistent_patients(previous_state, appointments_df, watermark).empty
+
+
+def test_target_features_match_full_features():
+    appointments_df = _shifted_history()
+
+    full = create_features(appointments_df.copy(), fake_postal_codes())
+    full = full.loc[
+        (full["status"] == "planned")
+        & (full.index.get_level_values("start") >= "2024-07-16")
+    ]
+    targets = create_features(
+        appointments_df.copy(), fake_postal_codes(), prediction_start_date="2024-07-16"
+    )
+
+    assert len(targets) == 5
+    pd.testing.assert_frame_equal(
+        select_feature_columns(targets),
+        select_feature_columns(full),
+        check_dtype=False,
+    )
+
+
+def test_featuretable_cache(tmp_path):
+    featuretable = select_feature_columns(
+        create_features(
+            process_appointments(
+                load_appointment_pydantic(fake_appointments()),
+                create_unit_test_clinic_config(),
+            ),
+            fake_postal_codes(),
+        )
+    )
+    dataset_path = tmp_path / "dataset"
+    (dataset_path / "year=2024").mkdir(parents=True)
+    (dataset_path / "year=2024" / "part-0.parquet").write_bytes(b"appointments")
+    builds = []
+
+    def build():
+        builds.append(1)
+        return featuretable
+
+    def fingerprint(**settings):
+        return featuretable_fingerprint([dataset_path], settings)
+
+    cached, hit = cached_featuretable(tmp_path / "cache", fingerprint(days=14), build)
+    assert not hit
+    cached, hit = cached_featuretable(tmp_path / "cache", fingerprint(days=14), build)
+    assert hit and len(builds) == 1
+    # The timezone of the test data is read back as UTC from Parquet
+    pd.testing.assert_frame_equal(cached, featuretable, check_index_type=False)
+
+    # Temporary files do not change the fingerprint, the data and settings do
+    before = fingerprint(days=14)
+    (dataset_path / ".export.parquet").write_bytes(b"partial")
+    assert fingerprint(days=14) == before
+    assert fingerprint(days=7) != fingerprint(days=14)
+    (dataset_path / "year=2024" / "part-0.parquet").write_bytes(b"changed")
+    _, hit = cached_featuretable(tmp_path / "cache", fingerprint(days=14), build)
+    assert not hit
+
+    _, hit = cached_featuretable(
+        tmp_path / "cache", fingerprint(days=14), build, rebuild=True
+    )
+    assert not hit and len(builds) == 3
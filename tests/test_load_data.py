@@ -0,0 +1,174 @@
+import json
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+from test_noshow import (
+    create_unit_test_clinic_config,
+    fake_appointments,
+    fake_postal_codes,
+)
+
+from noshow.features.feature_pipeline import create_features, select_feature_columns
+from noshow.preprocessing.load_data import (
+    convert_appointment_csv,
+    load_appointment_arrow,
+    load_appointment_csv,
+    load_appointment_parquet,
+    load_appointment_pydantic,
+    process_appointments,
+    update_appointment_dataset,
+)
+from noshow.preprocessing.schema import (
+    APPOINTMENT_ARROW_SCHEMA,
+    APPOINTMENT_CATEGORIES,
+    APPOINTMENT_DATETIMES,
+    PROCESSING_COLUMNS,
+    memory_report,
+)
+
+
+def load_test_appointments_json() -> list[dict]:
+    with (Path(__file__).parent / "data" / "test_appointments.json").open("r") as f:
+        return json.load(f)
+
+
+def test_load_appointment_arrow_matches_pydantic():
+    expected_df = load_appointment_pydantic(fake_appointments())
+
+    table = pa.Table.from_pylist(load_test_appointments_json())
+    appointments_df = load_appointment_arrow(table)
+    pd.testing.assert_frame_equal(appointments_df, expected_df, check_dtype=False)
+
+    # Numeric timestamps and postal codes give the same result
+    numeric_df = pd.DataFrame(load_test_appointments_json())
+    for column in ["start", "end", "created", "address_postalCodeNumbersNL"]:
+        numeric_df[column] = pd.to_numeric(numeric_df[column])
+    appointments_df = load_appointment_arrow(pa.Table.from_pandas(numeric_df))
+    pd.testing.assert_frame_equal(appointments_df, expected_df, check_dtype=False)
+
+
+def test_load_appointment_arrow_timestamp_unit():
+    expected_df = load_appointment_pydantic(fake_appointments())
+
+    table = pa.Table.from_pylist(load_test_appointments_json())
+    for column in ["start", "end", "gearriveerd", "created"]:
+        index = table.schema.get_field_index(column)
+        values = pa.array(expected_df[column], pa.timestamp("ms", tz="UTC"))
+        table = table.set_column(index, column, values)
+    appointments_df = load_appointment_arrow(table)
+
+    datetime_columns = [*APPOINTMENT_DATETIMES, "birthDate"]
+    # The timezone objects differ, so the dtypes are compared as strings
+    pd.testing.assert_series_equal(
+        appointments_df.dtypes[datetime_columns].astype(str),
+        expected_df.dtypes[datetime_columns].astype(str),
+    )
+    pd.testing.assert_frame_equal(appointments_df, expected_df, check_dtype=False)
+
+
+def test_load_appointment_arrow_validation():
+    appointments = load_test_appointments_json()
+    table = pa.Table.from_pylist(appointments)
+
+    with pytest.raises(ValueError, match="Missing columns"):
+        load_appointment_arrow(table.drop_columns(["pseudo_id"]))
+
+    appointments[0]["start"] = None
+    with pytest.raises(ValueError, match="start contains missing values"):
+        load_appointment_arrow(pa.Table.from_pylist(appointments))
+
+    appointments[0]["start"] = "1721120400000"
+    for appointment in appointments:
+        appointment["minutesDuration"] = str(appointment["minutesDuration"])
+    appointments[0]["minutesDuration"] = "thirty"
+    with pytest.raises(ValueError):
+        load_appointment_arrow(pa.Table.from_pylist(appointments))
+
+
+def test_appointment_schema():
+    appointments_df = load_appointment_pydantic(fake_appointments())
+    assert isinstance(appointments_df["pseudo_id"].dtype, pd.CategoricalDtype)
+    assert appointments_df["minutesDuration"].dtype.itemsize < 8
+
+    # The features are the same as without the schema
+    object_df = appointments_df.astype(
+        {column: object for column in APPOINTMENT_CATEGORIES}
+    )
+    features = [
+        select_feature_columns(
+            create_features(
+                process_appointments(df, create_unit_test_clinic_config()),
+                fake_postal_codes(),
+            )
+        )
+        for df in (appointments_df, object_df)
+    ]
+    assert features[0].index.to_list() == features[1].index.to_list()
+    pd.testing.assert_frame_equal(
+        features[0].reset_index(drop=True),
+        features[1].reset_index(drop=True),
+        check_dtype=False,
+    )
+
+    report = memory_report(object_df, appointments_df)
+    assert report.loc["pseudo_id", "dtype_after"] == "category"
+    assert report.loc["total", "bytes_after"] < report.loc["total", "bytes_before"]
+
+
+def test_appointment_parquet_dataset(tmp_path):
+    csv_df = load_appointment_pydantic(fake_appointments())
+    csv_df = csv_df[APPOINTMENT_ARROW_SCHEMA.names]
+    for column in APPOINTMENT_DATETIMES:
+        csv_df[column] = csv_df[column].dt.tz_localize(None)
+    csv_df.to_csv(tmp_path / "export.csv", index=False)
+    dataset_path = tmp_path / "export"
+
+    assert update_appointment_dataset(tmp_path / "export.csv", dataset_path)
+    assert not update_appointment_dataset(tmp_path / "export.csv", dataset_path)
+    assert {p.parent.name for p in dataset_path.rglob("*.parquet")} == {
+        f"month={month}" for month in csv_df["start"].dt.month.unique()
+    }
+
+    expected_df = load_appointment_csv(tmp_path / "export.csv")
+    appointments_df = load_appointment_parquet(dataset_path, columns=None)
+    assert isinstance(appointments_df["pseudo_id"].dtype, pd.CategoricalDtype)
+    # APP_ID is a string in the dataset, the csv reader parses it as number
+    pd.testing.assert_frame_equal(
+        appointments_df.drop(columns="APP_ID").sort_values("start", ignore_index=True),
+        expected_df.drop(columns="APP_ID").sort_values("start", ignore_index=True),
+        check_dtype=False,
+        check_categorical=False,
+    )
+
+    appointments_df = load_appointment_parquet(dataset_path, start_date="2024-07-16")
+    assert list(appointments_df.columns) == PROCESSING_COLUMNS
+    assert len(appointments_df) == (expected_df["start"] >= "2024-07-16").sum()
+    appointments_df = load_appointment_parquet(dataset_path, end_date="2024-07-01")
+    assert len(appointments_df) == (expected_df["start"] < "2024-07-01").sum()
+
+
+def test_convert_appointment_csv_keeps_dataset_on_failure(tmp_path):
+    csv_df = load_appointment_pydantic(fake_appointments())
+    csv_df = csv_df[APPOINTMENT_ARROW_SCHEMA.names]
+    for column in APPOINTMENT_DATETIMES:
+        csv_df[column] = csv_df[column].dt.tz_localize(None)
+    csv_df.to_csv(tmp_path / "export.csv", index=False)
+    dataset_path = tmp_path / "export"
+    convert_appointment_csv(tmp_path / "export.csv", dataset_path)
+    expected_df = load_appointment_parquet(dataset_path, columns=None)
+
+    # The last row can't be converted, after the first blocks have been read
+    broken_df = pd.concat([csv_df] * 20, ignore_index=True).astype(
+        {"minutesDuration": object}
+    )
+    broken_df.loc[len(broken_df) - 1, "minutesDuration"] = "thirty"
+    broken_df.to_csv(tmp_path / "broken.csv", index=False)
+    with pytest.raises(pa.ArrowInvalid):
+        convert_appointment_csv(tmp_path / "broken.csv", dataset_path, block_size=4096)
+
+    assert not (dataset_path / ".write").exists()
+    pd.testing.assert_frame_equal(
+        load_appointment_parquet(dataset_path, columns=None), expected_df
+    )
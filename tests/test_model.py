@@ -1,8 +1,13 @@
+import pickle
 from pathlib import Path
 from tempfile import TemporaryDirectory
+from types import SimpleNamespace
 
+import numpy as np
 import pandas as pd
+import pytest
 from sklearn.dummy import DummyClassifier
+from sklearn.ensemble import HistGradientBoostingClassifier
 from test_noshow import (
     FakeModel,
     create_unit_test_clinic_config,
@@ -12,7 +17,15 @@ from test_noshow import (
 
 from noshow.features.feature_pipeline import create_features, select_feature_columns
 from noshow.model.predict import create_prediction
-from noshow.model.train_model import train_cv_model
+from noshow.model.train_model import (
+    WarmStartHistGradientBoostingClassifier,
+    load_warm_start_model,
+    peak_rss_mb,
+    retrain_model,
+    search_budget,
+    shared_training_data,
+    train_cv_model,
+)
 from noshow.preprocessing.load_data import (
     load_appointment_pydantic,
     process_appointments,
@@ -70,3 +83,142 @@ def test_train_model():
             save_exp=False,
         )
         assert (Path(tempdirname) / "no_show_model_cv.pickle").is_file()
+
+
+def test_train_model_halving():
+    appointments_df = load_appointment_pydantic(fake_appointments())
+    appointments_df = process_appointments(
+        appointments_df, create_unit_test_clinic_config()
+    )
+    feature_table = create_features(appointments_df, fake_postal_codes(None)).pipe(
+        select_feature_columns
+    )
+    feature_table = pd.concat([feature_table] * 8)
+    param_grid = {"max_iter": [9], "learning_rate": [0.01, 0.05, 0.1, 0.2, 0.3, 0.5]}
+    with TemporaryDirectory() as tempdirname:
+        grid = train_cv_model(
+            feature_table,
+            tempdirname,
+            HistGradientBoostingClassifier(),
+            param_grid=param_grid,
+            save_exp=False,
+            n_jobs=1,
+        )
+        halving = train_cv_model(
+            feature_table,
+            tempdirname,
+            HistGradientBoostingClassifier(),
+            param_grid=param_grid,
+            save_exp=False,
+            search="halving",
+            n_jobs=1,
+        )
+        with (Path(tempdirname) / "no_show_model_cv.pickle").open("rb") as f:
+            model = pickle.load(f)
+
+    # The best candidate of the last round is refit on the dataframe
+    assert model.max_iter == 9
+    assert model.learning_rate == halving.best_params_["learning_rate"]
+    assert list(model.feature_names_in_) == list(feature_table.drop(columns="no_show"))
+    # The searches keep the contract of a search with refit
+    X = feature_table.drop(columns="no_show")
+    for search in (grid, halving):
+        assert list(search.feature_names_in_) == list(X.columns)
+        assert search.predict_proba(X).shape == (len(X), 2)
+    np.testing.assert_array_equal(halving.predict_proba(X), model.predict_proba(X))
+
+    # The halving search trains all candidates with 3 iterations and the best
+    # third with 9, the grid search trains all candidates with 9 iterations
+    assert halving.n_resources_ == [3, 9]
+    grid_budget = search_budget(grid, 5, len(feature_table))
+    halving_budget = search_budget(halving, 5, len(feature_table))
+    assert grid_budget == {"search_fits": 30, "search_resources": 270.0}
+    assert halving_budget == {"search_fits": 40, "search_resources": 180.0}
+
+    with pytest.raises(ValueError, match="search should be one of"):
+        train_cv_model(
+            feature_table, "", DummyClassifier(), param_grid={}, search="random"
+        )
+
+
+def test_shared_training_data():
+    X = pd.DataFrame({"hour": [8, 9, 10], "age": [30.5, np.nan, 70.0]})
+    y = pd.Series([0, 1, 0])
+    with TemporaryDirectory() as tempdirname:
+        with shared_training_data(X, y, tempdirname) as (X_shared, y_shared):
+            assert isinstance(X_shared, np.memmap)
+            assert X_shared.dtype == np.float32
+            assert X_shared.flags.c_contiguous and not X_shared.flags.writeable
+            np.testing.assert_array_equal(X_shared, X.to_numpy(np.float32))
+            np.testing.assert_array_equal(y_shared, y.to_numpy())
+        assert not any(Path(tempdirname).iterdir())
+
+
+@pytest.mark.parametrize(
+    ("platform", "maxrss"), [("linux", 512 * 1024), ("darwin", 512 * 1024**2)]
+)
+def test_peak_rss_mb(monkeypatch, platform, maxrss):
+    fake_resource = SimpleNamespace(
+        RUSAGE_SELF=0,
+        RUSAGE_CHILDREN=-1,
+        getrusage=lambda who: SimpleNamespace(ru_maxrss=maxrss * (1 - who)),
+    )
+    monkeypatch.setattr("noshow.model.train_model.resource", fake_resource)
+    monkeypatch.setattr("noshow.model.train_model.sys.platform", platform)
+    assert peak_rss_mb() == {"peak_rss_mb": 512, "peak_rss_workers_mb": 1024}
+
+
+def test_retrain_model(caplog):
+    appointments_df = load_appointment_pydantic(fake_appointments())
+    appointments_df = process_appointments(
+        appointments_df, create_unit_test_clinic_config()
+    )
+    feature_table = create_features(appointments_df, fake_postal_codes(None)).pipe(
+        select_feature_columns
+    )
+    feature_table = pd.concat([feature_table] * 8)
+    classifier = HistGradientBoostingClassifier(categorical_features=["hour"])
+    columns = feature_table.columns.drop("no_show")
+    with TemporaryDirectory() as tempdirname:
+        model_path = Path(tempdirname) / "no_show_model_cv.pickle"
+        assert load_warm_start_model(model_path, classifier, columns) is None
+
+        cold = retrain_model(
+            feature_table, tempdirname, classifier, n_iter_no_change=2, save_exp=False
+        )
+        assert isinstance(cold, WarmStartHistGradientBoostingClassifier)
+        assert cold.n_iter_ < 1000
+
+        with caplog.at_level("INFO", logger="noshow.model.train_model"):
+            warm = retrain_model(
+                feature_table,
+                tempdirname,
+                classifier,
+                warm_start=True,
+                n_iter_no_change=2,
+                save_exp=False,
+            )
+        with model_path.open("rb") as f:
+            deployed = pickle.load(f)
+
+        # A changed feature schema is not warm started
+        assert load_warm_start_model(model_path, classifier, columns[::-1]) is None
+        assert (
+            load_warm_start_model(model_path, HistGradientBoostingClassifier(), columns)
+            is None
+        )
+
+    # Without a cold fit to compare with, only the last cold fit is reported
+    assert warm.cold_fit_seconds_ == cold.cold_fit_seconds_
+    assert "time_saved_vs_last_cold_fit_seconds" in caplog.text
+    assert "'time_saved_seconds'" not in caplog.text
+
+    # The trees of the cold model are kept and split on the same bins
+    assert warm.n_iter_ > cold.n_iter_
+    assert deployed.n_iter_ == warm.n_iter_
+    for cold_bins, warm_bins in zip(
+        cold._bin_mapper.bin_thresholds_,
+        warm._bin_mapper.bin_thresholds_,
+        strict=True,
+    ):
+        np.testing.assert_array_equal(cold_bins, warm_bins)
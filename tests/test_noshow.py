@@ -5,9 +5,13 @@ from typing import Dict, List
 
 import numpy as np
 import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
 
 from noshow.api.pydantic_models import Appointment
 from noshow.config import ClinicConfig
+from noshow.database.models import Base
 
 
 class FakeModel:
@@ -98,3 +102,20 @@ def create_unit_test_clinic_config() -> Dict[str, ClinicConfig]:
             appcodes=[],
         ),
     }
+
+
+def create_test_sessionmaker() -> sessionmaker:
+    """Create a sessionmaker for an empty in-memory SQLite database."""
+    engine = create_engine(
+        "sqlite://",
+        execution_options={"schema_translate_map": {"noshow": None}},
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+
+def create_test_session() -> Session:
+    """Create a session to an empty in-memory SQLite database."""
+    return create_test_sessionmaker()()